@@ -1,8 +1,12 @@
 """Flask application factory."""
 
+import os
+
 from flask import Flask
 from flask_cors import CORS
 
+from app import metrics, programs
+
 
 def create_app() -> Flask:
     """Create and configure the Flask application."""
@@ -20,13 +24,43 @@ def create_app() -> Flask:
     # Register blueprints
     from app.dspy_routes import dspy_bp
     from app.data_routes import data_bp
+    from app.inbox_analysis import inbox_pipeline
+    from app.inbox_routes import inbox_bp
+    from app.jobs import job_queue
+    from app.jobs_routes import jobs_bp
+    from app.metrics_routes import metrics_bp
+    from app.workflow_routes import workflows_bp
 
     app.register_blueprint(dspy_bp, url_prefix="/api/dspy")
     app.register_blueprint(data_bp)
+    app.register_blueprint(jobs_bp)
+    app.register_blueprint(inbox_bp)
+    app.register_blueprint(metrics_bp)
+    app.register_blueprint(workflows_bp)
+
+    # Per-request timings for /metrics and the optional Server-Timing header
+    metrics.init_app(app)
+
+    # Import dspy and build the LM programs off the request path
+    if os.getenv("DSPY_WARM_UP", "1") != "0":
+        programs.start_warm_up()
+
+    # Background job workers (JOB_WORKERS=0 to only accept and serve jobs)
+    job_queue.start()
+
+    # Keep the precomputed inbox analysis up to date (costs LM calls for new emails)
+    if os.getenv("INBOX_WATCH", "0") == "1":
+        inbox_pipeline.start_watching()
 
     @app.route("/health")
     def health_check():
         """Health check endpoint."""
         return {"status": "healthy", "service": "makora-bio-backend"}
 
+    @app.route("/ready")
+    def readiness_check():
+        """Readiness endpoint: 200 once the LM client and DSPy programs are built."""
+        readiness = programs.readiness()
+        return readiness, 200 if readiness["ready"] else 503
+
     return app
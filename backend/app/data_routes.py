@@ -1,84 +1,195 @@
 """
-Data persistence routes for saving changes back to coms.json
+Data persistence routes for the problems/threads document (coms.json format),
+stored in SQLite (app.sqlite_store) or in coms.json itself (app.data_store)
 """
 
-import json
+import hashlib
 import os
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, make_response
+
+from app.data_store import (
+    COLLECTIONS,
+    JsonDocumentStore,
+    validate_document,
+    validate_patch,
+)
+from app.sqlite_store import DEFAULT_DB_PATH, SqliteDocumentStore
 
 data_bp = Blueprint('data', __name__, url_prefix='/api/data')
 
 # Path to the coms.json file
 COMS_JSON_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), 'src', 'data', 'coms.json')
 
+# "sqlite" (default) or "json"
+DATA_BACKEND = os.getenv('DATA_BACKEND', 'sqlite')
+
+def create_store(backend=DATA_BACKEND):
+    """The storage backend behind these routes; both implement the same methods."""
+    if backend == 'sqlite':
+        # An existing coms.json is imported the first time the database is created
+        return SqliteDocumentStore(os.getenv('DATA_DB_PATH', DEFAULT_DB_PATH), seed_path=COMS_JSON_PATH)
+    if backend == 'json':
+        # Snapshot + write-ahead log; the log is compacted into coms.json every N patches
+        return JsonDocumentStore(COMS_JSON_PATH, compact_every=int(os.getenv('DATA_WAL_COMPACT_EVERY', '100')))
+    raise ValueError(f"Unknown DATA_BACKEND {backend!r}; use 'sqlite' or 'json'")
+
+store = create_store()
+
 @data_bp.route("/save", methods=["POST"])
 def save_data():
-    """Save data back to coms.json file."""
+    """Replace the whole problems/threads document."""
     try:
         data = request.get_json()
-        
+
         if not data:
             return jsonify({"success": False, "error": "No data provided"}), 400
-        
+
         # Validate data structure
         if "problems" not in data or "threads" not in data:
             return jsonify({"success": False, "error": "Invalid data structure. Must contain 'problems' and 'threads'"}), 400
-        
-        # Ensure the directory exists
-        os.makedirs(os.path.dirname(COMS_JSON_PATH), exist_ok=True)
-        
-        # Write the data to the JSON file
-        with open(COMS_JSON_PATH, 'w', encoding='utf-8') as f:
-            json.dump(data, f, indent=2, ensure_ascii=False)
-        
+
+        error = validate_document(data)
+        if error:
+            return jsonify({"success": False, "error": error}), 400
+
+        # One transaction (SQLite) or write-to-temp-then-rename (JSON)
+        store.save(data)
+
         return jsonify({"success": True, "message": "Data saved successfully"}), 200
-        
+
     except Exception as e:
         return jsonify({"success": False, "error": str(e)}), 500
 
+@data_bp.route("/patch", methods=["POST"])
+def patch_data():
+    """Save only the problems/threads that changed.
+
+    Expected JSON payload:
+    {
+        "problems": [{"id": 1, ...full updated problem...}],
+        "threads": [{"id": 7, ...full updated thread...}],
+        "deleted": {"problems": [2], "threads": []}
+    }
+
+    Records are upserted by id. SQLite applies each patch in one transaction; the
+    JSON backend appends it to a write-ahead log that is periodically compacted into
+    coms.json.
+    """
+    try:
+        patch = request.get_json()
+
+        if not patch:
+            return jsonify({"success": False, "error": "No data provided"}), 400
+
+        error = validate_patch(patch)
+        if error:
+            return jsonify({"success": False, "error": error}), 400
+
+        pending = store.patch(patch)
+
+        return jsonify({"success": True, "message": "Changes saved successfully", "pending_log_entries": pending}), 200
+
+    except Exception as e:
+        return jsonify({"success": False, "error": str(e)}), 500
+
+def _conditional(etag, build_body):
+    """Return 304 if the client already has `etag`, otherwise the body built by `build_body`."""
+    if request.if_none_match.contains(etag):
+        response = make_response("", 304)
+    else:
+        response = build_body()
+    response.set_etag(etag)
+    # Clients may keep the copy but must revalidate before using it
+    response.headers["Cache-Control"] = "no-cache"
+    return response
+
 @data_bp.route("/load", methods=["GET"])
 def load_data():
-    """Load data from coms.json file."""
+    """Load the whole document, or a single problem or thread.
+
+    Query parameters (optional, mutually exclusive):
+        problem_id - return only the problem with this id
+        thread_id  - return only the thread with this id
+
+    Responses carry an ETag; polls sending a matching If-None-Match get a 304
+    with no body.
+    """
     try:
-        if not os.path.exists(COMS_JSON_PATH):
-            # Return empty structure if file doesn't exist
-            return jsonify({
-                "success": True,
-                "data": {
-                    "problems": [],
-                    "threads": []
-                }
-            }), 200
-        
-        with open(COMS_JSON_PATH, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-        
-        return jsonify({"success": True, "data": data}), 200
-        
+        problem_id = request.args.get("problem_id")
+        thread_id = request.args.get("thread_id")
+
+        if problem_id is not None and thread_id is not None:
+            return jsonify({"success": False, "error": "Pass either 'problem_id' or 'thread_id', not both"}), 400
+
+        if problem_id is None and thread_id is None:
+            # Returns an empty structure if nothing has been saved yet
+            data, version = store.load_versioned()
+            return _conditional(version, lambda: jsonify({"success": True, "data": data}))
+
+        collection, record_id = ("problems", problem_id) if problem_id is not None else ("threads", thread_id)
+        record, version = store.get_record(collection, record_id)
+
+        if record is None:
+            return jsonify({"success": False, "error": f"No {collection[:-1]} with id {record_id}"}), 404
+
+        # Each single-record representation gets its own validator
+        etag = hashlib.sha1(f"{version}:{collection}:{record_id}".encode("utf-8")).hexdigest()[:16]
+        return _conditional(etag, lambda: jsonify({"success": True, "data": record}))
+
+    except Exception as e:
+        return jsonify({"success": False, "error": str(e)}), 500
+
+@data_bp.route("/query", methods=["GET"])
+def query_data():
+    """Problems or threads filtered by status and/or urgency (indexed columns in SQLite).
+
+    Query parameters:
+        collection - "problems" or "threads" (required)
+        status     - optional, exact match
+        urgency    - optional, exact match
+
+    Responses carry an ETag like /load.
+    """
+    try:
+        collection = request.args.get("collection")
+        if collection not in COLLECTIONS:
+            return jsonify({"success": False, "error": "'collection' must be 'problems' or 'threads'"}), 400
+
+        status = request.args.get("status")
+        urgency = request.args.get("urgency")
+        records, version = store.query(collection, status=status, urgency=urgency)
+
+        etag = hashlib.sha1(f"{version}:{request.query_string.decode('utf-8')}".encode("utf-8")).hexdigest()[:16]
+        return _conditional(etag, lambda: jsonify({"success": True, "data": records}))
+
+    except Exception as e:
+        return jsonify({"success": False, "error": str(e)}), 500
+
+@data_bp.route("/compact", methods=["POST"])
+def compact_data():
+    """Checkpoint the SQLite WAL, or fold pending log entries into coms.json."""
+    try:
+        store.compact()
+
+        return jsonify({"success": True, "message": "Data compacted successfully"}), 200
+
     except Exception as e:
         return jsonify({"success": False, "error": str(e)}), 500
 
 @data_bp.route("/backup", methods=["POST"])
 def backup_data():
-    """Create a backup of the current coms.json file."""
+    """Back up the data: SQLite's online backup, or a copy of coms.json."""
     try:
-        if not os.path.exists(COMS_JSON_PATH):
+        if not store.exists():
             return jsonify({"success": False, "error": "No data file to backup"}), 404
-        
-        # Create backup filename with timestamp
-        import datetime
-        timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-        backup_path = COMS_JSON_PATH.replace('.json', f'_backup_{timestamp}.json')
-        
-        # Copy the file
-        import shutil
-        shutil.copy2(COMS_JSON_PATH, backup_path)
-        
+
+        backup_path = store.backup()
+
         return jsonify({
-            "success": True, 
+            "success": True,
             "message": "Backup created successfully",
             "backup_path": backup_path
         }), 200
-        
+
     except Exception as e:
         return jsonify({"success": False, "error": str(e)}), 500
@@ -0,0 +1,311 @@
+"""Write-ahead-logged persistence for the coms.json document.
+
+The document ({"problems": [...], "threads": [...]}) lives in a snapshot file.
+Edits are appended to a JSON-lines log next to it as small patches keyed by
+record id, and the log is folded back into the snapshot (write to a temp file,
+then rename) once it grows past a threshold. Loading replays the log on top of
+the snapshot.
+
+The parsed document is kept in memory together with an id index, and is only
+re-read when the stat signature (inode, size, mtime) of the snapshot or log
+changes, e.g. because another worker process wrote to them.
+"""
+
+import datetime
+import hashlib
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - non-POSIX platforms
+    fcntl = None
+
+COLLECTIONS = ("problems", "threads")
+
+
+def _empty_document():
+    return {"problems": [], "threads": []}
+
+
+def apply_patch(document, patch):
+    """Apply a patch to `document` in place.
+
+    A patch upserts whole records by id and removes deleted ids:
+    {
+        "problems": [{"id": 1, ...}],
+        "threads": [{"id": 7, ...}],
+        "deleted": {"problems": [2], "threads": []}
+    }
+    Updated records keep their position; new records are appended.
+    """
+    deleted = patch.get("deleted", {})
+    for collection in COLLECTIONS:
+        records = document.setdefault(collection, [])
+        changed = patch.get(collection, [])
+        removed = {str(record_id) for record_id in deleted.get(collection, [])}
+        if not changed and not removed:
+            continue
+
+        positions = {str(record.get("id")): i for i, record in enumerate(records)}
+        for record in changed:
+            position = positions.get(str(record["id"]))
+            if position is None:
+                positions[str(record["id"])] = len(records)
+                records.append(record)
+            else:
+                records[position] = record
+
+        if removed:
+            document[collection] = [r for r in records if str(r.get("id")) not in removed]
+    return document
+
+
+def _build_index(document):
+    return {
+        collection: {str(record.get("id")): record for record in document.get(collection, [])}
+        for collection in COLLECTIONS
+    }
+
+
+def validate_document(document):
+    """Return an error message naming the first record without an id, otherwise None."""
+    if not isinstance(document, dict):
+        return "Data must be a JSON object"
+    for collection in COLLECTIONS:
+        records = document.get(collection, [])
+        if not isinstance(records, list):
+            return f"'{collection}' must be a list"
+        for index, record in enumerate(records):
+            if not isinstance(record, dict) or "id" not in record:
+                return f"{collection}[{index}] must be an object with an 'id'"
+    return None
+
+
+def validate_patch(patch):
+    """Return an error message if `patch` is malformed, otherwise None."""
+    if not isinstance(patch, dict):
+        return "Patch must be a JSON object"
+    for collection in COLLECTIONS:
+        records = patch.get(collection, [])
+        if not isinstance(records, list):
+            return f"'{collection}' must be a list"
+        for record in records:
+            if not isinstance(record, dict) or "id" not in record:
+                return f"Every entry in '{collection}' must be an object with an 'id'"
+    deleted = patch.get("deleted", {})
+    if not isinstance(deleted, dict) or not all(
+        isinstance(deleted.get(collection, []), list) for collection in COLLECTIONS
+    ):
+        return "'deleted' must map 'problems'/'threads' to lists of ids"
+    return None
+
+
+class JsonDocumentStore:
+    """Snapshot + append-only log storage for the problems/threads document."""
+
+    def __init__(self, snapshot_path, compact_every=100):
+        self.snapshot_path = snapshot_path
+        base, _ = os.path.splitext(snapshot_path)
+        self.log_path = f"{base}.wal.jsonl"
+        self.lock_path = f"{base}.lock"
+        self.compact_every = compact_every
+        self._lock = threading.Lock()
+        # (stat signature, document, id index, version) of the last load or local write
+        self._cached = None
+
+    @contextmanager
+    def _locked(self):
+        """Serialize access across threads and, where supported, across processes."""
+        with self._lock:
+            os.makedirs(os.path.dirname(self.snapshot_path), exist_ok=True)
+            if fcntl is None:
+                yield
+                return
+            with open(self.lock_path, "a") as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def exists(self):
+        return os.path.exists(self.snapshot_path) or os.path.exists(self.log_path)
+
+    def load(self):
+        """Return the current document: the snapshot with the log replayed on top.
+
+        The returned document is shared with the cache and must not be mutated.
+        """
+        return self.load_versioned()[0]
+
+    def load_versioned(self):
+        """Return (document, version); the version changes whenever the data does."""
+        _, document, _, version = self._current()
+        return document, version
+
+    def get_record(self, collection, record_id):
+        """Return (record or None, version) for one problem or thread by id."""
+        _, _, index, version = self._current()
+        return index[collection].get(str(record_id)), version
+
+    def query(self, collection, status=None, urgency=None):
+        """Return (records, version): the records of `collection` matching every given filter."""
+        _, document, _, version = self._current()
+        filters = [
+            (field, str(value))
+            for field, value in (("status", status), ("urgency", urgency))
+            if value is not None
+        ]
+        records = [
+            record
+            for record in document.get(collection, [])
+            if all(
+                record.get(field) is not None and str(record.get(field)) == value
+                for field, value in filters
+            )
+        ]
+        return records, version
+
+    def save(self, document):
+        """Replace the whole document atomically and discard the log."""
+        with self._locked():
+            self._write_snapshot(document)
+            self._truncate_log()
+            self._remember(document)
+
+    def patch(self, patch):
+        """Append a patch to the log, compacting when the log is long enough.
+
+        Returns the number of log entries pending compaction.
+        """
+        entry = json.dumps({"ts": time.time(), "patch": patch}, ensure_ascii=False)
+        with self._locked():
+            signature_before = self._signature()
+            with open(self.log_path, "ab+") as f:
+                if f.tell() > 0:
+                    f.seek(-1, os.SEEK_END)
+                    if f.read(1) != b"\n":
+                        # Terminate a torn line so this entry stays parseable
+                        entry = "\n" + entry
+                f.write((entry + "\n").encode("utf-8"))
+                f.flush()
+                os.fsync(f.fileno())
+
+            # Fold the patch into the cached copy rather than re-reading from disk
+            cached = self._cached
+            document = None
+            if cached is not None and cached[0] == signature_before:
+                # Copy the lists so readers holding the previous document are unaffected
+                document = {
+                    key: list(value) if isinstance(value, list) else value
+                    for key, value in cached[1].items()
+                }
+                apply_patch(document, patch)
+
+            pending = self._log_length()
+            if pending >= self.compact_every:
+                self._compact_unlocked()
+                pending = 0
+            elif document is not None:
+                self._remember(document)
+            return pending
+
+    def compact(self):
+        """Fold the log into the snapshot."""
+        with self._locked():
+            self._compact_unlocked()
+
+    def backup(self):
+        """Write the current document to a timestamped file and return its path."""
+        timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+        backup_path = self.snapshot_path.replace(".json", f"_backup_{timestamp}.json")
+        with self._locked():
+            self._atomic_write(backup_path, self._load_unlocked())
+        return backup_path
+
+    def _signature(self):
+        """Stat-based fingerprint of the snapshot and log files."""
+        signature = []
+        for path in (self.snapshot_path, self.log_path):
+            try:
+                st = os.stat(path)
+                signature.append((st.st_ino, st.st_size, st.st_mtime_ns))
+            except FileNotFoundError:
+                signature.append(None)
+        return tuple(signature)
+
+    def _current(self):
+        cached = self._cached
+        if cached is not None and cached[0] == self._signature():
+            return cached
+        with self._locked():
+            cached = self._cached
+            if cached is None or cached[0] != self._signature():
+                self._remember(self._load_unlocked())
+            return self._cached
+
+    def _remember(self, document):
+        # Caller holds the lock and has just read or written the files
+        signature = self._signature()
+        version = hashlib.sha1(repr(signature).encode("utf-8")).hexdigest()[:16]
+        self._cached = (signature, document, _build_index(document), version)
+
+    def _load_unlocked(self):
+        if os.path.exists(self.snapshot_path):
+            with open(self.snapshot_path, "r", encoding="utf-8") as f:
+                document = json.load(f)
+        else:
+            document = _empty_document()
+
+        for patch in self._read_log():
+            apply_patch(document, patch)
+        return document
+
+    def _read_log(self):
+        if not os.path.exists(self.log_path):
+            return
+        with open(self.log_path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    yield json.loads(line)["patch"]
+                except (ValueError, KeyError):
+                    # Torn line left behind by an interrupted append
+                    continue
+
+    def _log_length(self):
+        if not os.path.exists(self.log_path):
+            return 0
+        with open(self.log_path, "rb") as f:
+            return sum(1 for _ in f)
+
+    def _compact_unlocked(self):
+        if not os.path.exists(self.log_path):
+            return
+        document = self._load_unlocked()
+        self._write_snapshot(document)
+        self._truncate_log()
+        self._remember(document)
+
+    def _write_snapshot(self, document):
+        self._atomic_write(self.snapshot_path, document)
+
+    def _truncate_log(self):
+        if os.path.exists(self.log_path):
+            os.remove(self.log_path)
+
+    @staticmethod
+    def _atomic_write(path, document):
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(document, f, indent=2, ensure_ascii=False)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
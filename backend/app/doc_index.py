@@ -0,0 +1,338 @@
+"""Passage retrieval over the study document library for draft citations.
+
+Documents (from docs_info.json, plus any added through /api/dspy/documents) are
+split into passages: one for the title/description and fixed-size windows over
+raw_text. Passages are indexed for BM25 with postings lists, so a query only
+touches the passages that contain its terms, and documents can be added, changed
+or removed one at a time without rebuilding the index.
+
+Documents sent with a single draft request are not added to the shared index,
+which every caller searches. They are passed to search() as `extra_documents`:
+split into passages for that query only and ranked together with the library
+under the same BM25 statistics.
+
+If DOC_INDEX_EMBEDDINGS=1 and sentence-transformers is installed, passages are
+also embedded with a local model and ranked by a blend of BM25 and cosine
+similarity.
+"""
+
+import hashlib
+import json
+import math
+import os
+import re
+import threading
+from collections import Counter, defaultdict
+
+DOCS_INFO_PATH = os.getenv(
+    "DOCS_INFO_PATH",
+    os.path.join(
+        os.path.dirname(os.path.dirname(os.path.dirname(__file__))),
+        "simulated_backend",
+        "docs_info.json",
+    ),
+)
+DEFAULT_TOP_K = int(os.getenv("DOC_RETRIEVAL_TOP_K", "5"))
+MAX_TOP_K = int(os.getenv("DOC_RETRIEVAL_MAX_TOP_K", "50"))
+PASSAGE_CHARS = 800
+PASSAGE_OVERLAP = 100
+
+_TOKEN = re.compile(r"[a-z0-9]+(?:[-.][a-z0-9]+)*")
+_STOPWORDS = frozenset(
+    "a an and are as at be by for from has have in is it its of on or that the to was were "
+    "will with this these those we you your our please thanks".split()
+)
+
+
+def tokenize(text):
+    return [token for token in _TOKEN.findall(text.lower()) if token not in _STOPWORDS]
+
+
+def parse_top_k(value):
+    """Validate a requested number of passages; larger values are capped at MAX_TOP_K."""
+    if isinstance(value, bool):
+        raise ValueError("must be an integer")
+    try:
+        top_k = int(value)
+    except (TypeError, ValueError):
+        raise ValueError("must be an integer")
+    if top_k < 1:
+        raise ValueError("must be at least 1")
+    return min(top_k, MAX_TOP_K)
+
+
+def document_id(doc):
+    return str(doc.get("id") or doc.get("title") or doc.get("name") or "")
+
+
+def _passages(doc):
+    """Split a document into (kind, text) passages."""
+    title = doc.get("title") or doc.get("name") or ""
+    passages = [("summary", f"{title}\n{doc.get('description', '')}".strip())]
+    raw_text = doc.get("raw_text") or ""
+    step = PASSAGE_CHARS - PASSAGE_OVERLAP
+    for start in range(0, len(raw_text), step):
+        passages.append(("raw_text", raw_text[start : start + PASSAGE_CHARS]))
+        if start + PASSAGE_CHARS >= len(raw_text):
+            break
+    return passages
+
+
+class _Embedder:
+    """Optional local embedding model, loaded on first use."""
+
+    def __init__(self, model_name):
+        self.model_name = model_name
+        self._model = None
+
+    def encode(self, texts):
+        if self._model is None:
+            from sentence_transformers import SentenceTransformer
+
+            self._model = SentenceTransformer(self.model_name)
+        return self._model.encode(texts, normalize_embeddings=True)
+
+
+def _load_embedder():
+    if os.getenv("DOC_INDEX_EMBEDDINGS", "0") != "1":
+        return None
+    try:
+        import sentence_transformers  # noqa: F401
+    except ImportError:
+        return None
+    return _Embedder(os.getenv("DOC_INDEX_EMBEDDING_MODEL", "all-MiniLM-L6-v2"))
+
+
+class DocumentIndex:
+    """Incrementally updated BM25 (optionally hybrid) passage index."""
+
+    def __init__(self, k1=1.5, b=0.75, embedder=None):
+        self.k1 = k1
+        self.b = b
+        self.embedder = embedder
+        self._lock = threading.RLock()
+        self._documents = {}  # doc id -> (content hash, doc metadata, passage ids)
+        self._passages = {}  # passage id -> (doc id, kind, text, length)
+        self._postings = defaultdict(dict)  # term -> {passage id: term frequency}
+        self._embeddings = {}  # passage id -> vector
+        self._total_length = 0
+        self._next_passage_id = 0
+        self._source_signature = None
+        self._library_ids = set()
+
+    def __len__(self):
+        return len(self._documents)
+
+    def upsert(self, doc):
+        """Add or replace one document. Unchanged documents are a no-op."""
+        doc_id = document_id(doc)
+        if not doc_id:
+            return False
+        content_hash = hashlib.sha1(
+            json.dumps(doc, sort_keys=True, default=str).encode("utf-8")
+        ).hexdigest()
+
+        with self._lock:
+            existing = self._documents.get(doc_id)
+            if existing is not None and existing[0] == content_hash:
+                return False
+            if existing is not None:
+                self._remove_passages(existing[2])
+
+            passage_ids = []
+            texts = []
+            for kind, text in _passages(doc):
+                terms = tokenize(text)
+                if not terms:
+                    continue
+                passage_id = self._next_passage_id
+                self._next_passage_id += 1
+                self._passages[passage_id] = (doc_id, kind, text, len(terms))
+                self._total_length += len(terms)
+                for term in terms:
+                    postings = self._postings[term]
+                    postings[passage_id] = postings.get(passage_id, 0) + 1
+                passage_ids.append(passage_id)
+                texts.append(text)
+
+            if self.embedder is not None and texts:
+                for passage_id, vector in zip(passage_ids, self.embedder.encode(texts)):
+                    self._embeddings[passage_id] = vector
+
+            metadata = {key: value for key, value in doc.items() if key != "raw_text"}
+            self._documents[doc_id] = (content_hash, metadata, passage_ids)
+            return True
+
+    def remove(self, doc_id):
+        with self._lock:
+            existing = self._documents.pop(str(doc_id), None)
+            if existing is None:
+                return False
+            self._remove_passages(existing[2])
+            return True
+
+    def _remove_passages(self, passage_ids):
+        for passage_id in passage_ids:
+            _, _, text, length = self._passages.pop(passage_id)
+            self._total_length -= length
+            self._embeddings.pop(passage_id, None)
+            for term in set(tokenize(text)):
+                postings = self._postings.get(term)
+                if postings is not None:
+                    postings.pop(passage_id, None)
+                    if not postings:
+                        del self._postings[term]
+
+    def sync_file(self, path=DOCS_INFO_PATH):
+        """Bring the index in line with a docs_info.json file if it changed on disk."""
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            return
+        signature = (path, st.st_size, st.st_mtime_ns)
+        with self._lock:
+            if signature == self._source_signature:
+                return
+            with open(path, "r", encoding="utf-8") as f:
+                docs = json.load(f)
+            library_ids = {document_id(doc) for doc in docs}
+            for doc_id in self._library_ids - library_ids:
+                self.remove(doc_id)
+            for doc in docs:
+                self.upsert(doc)
+            self._library_ids = library_ids
+            self._source_signature = signature
+
+    def search(self, query, top_k=DEFAULT_TOP_K, doc_ids=None, extra_documents=()):
+        """Return the `top_k` best passages for `query`.
+
+        Each hit is {"doc_id", "kind", "text", "score", "document": metadata}.
+        `doc_ids` optionally restricts the search to those documents.
+        `extra_documents` are searched along with the index for this query only and
+        are never added to it; one with the id of an indexed document replaces that
+        document in the results.
+        """
+        terms = tokenize(query)
+        if not terms or top_k < 1:
+            return []
+        extra = _transient_passages(extra_documents)
+        extra_metadata = {
+            document_id(doc): {key: value for key, value in doc.items() if key != "raw_text"}
+            for doc in extra_documents
+            if isinstance(doc, dict) and document_id(doc)
+        }
+        with self._lock:
+            # Library passages of documents the request replaces
+            shadowed = set()
+            for doc_id in extra_metadata:
+                existing = self._documents.get(doc_id)
+                if existing is not None:
+                    shadowed.update(existing[2])
+
+            n = len(self._passages) - len(shadowed) + len(extra)
+            if not n:
+                return []
+            total_length = self._total_length + sum(passage[3] for passage in extra.values())
+            total_length -= sum(self._passages[pid][3] for pid in shadowed)
+            avg_length = total_length / n
+
+            def bm25(tf, length, idf):
+                norm = tf + self.k1 * (1 - self.b + self.b * length / avg_length)
+                return idf * tf * (self.k1 + 1) / norm
+
+            scores = defaultdict(float)
+            for term in set(terms):
+                postings = self._postings.get(term, {})
+                extra_tf = {pid: p[4][term] for pid, p in extra.items() if term in p[4]}
+                df = len(postings) - sum(1 for pid in shadowed if pid in postings) + len(extra_tf)
+                if not df:
+                    continue
+                idf = math.log(1 + (n - df + 0.5) / (df + 0.5))
+                for passage_id, tf in postings.items():
+                    if passage_id not in shadowed:
+                        scores[passage_id] += bm25(tf, self._passages[passage_id][3], idf)
+                for passage_id, tf in extra_tf.items():
+                    scores[passage_id] += bm25(tf, extra[passage_id][3], idf)
+
+            def passage(passage_id):
+                return extra[passage_id] if passage_id < 0 else self._passages[passage_id]
+
+            if doc_ids is not None:
+                allowed = {str(doc_id) for doc_id in doc_ids}
+                scores = {pid: s for pid, s in scores.items() if passage(pid)[0] in allowed}
+
+            if self.embedder is not None and (self._embeddings or extra) and scores:
+                scores = self._blend(query, scores, extra)
+
+            ranked = sorted(scores.items(), key=lambda item: -item[1])[:top_k]
+            hits = []
+            for passage_id, score in ranked:
+                doc_id, kind, text = passage(passage_id)[:3]
+                metadata = extra_metadata[doc_id] if passage_id < 0 else self._documents[doc_id][1]
+                hits.append(
+                    {
+                        "doc_id": doc_id,
+                        "kind": kind,
+                        "text": text,
+                        "score": round(score, 4),
+                        "document": metadata,
+                    }
+                )
+            return hits
+
+    def _blend(self, query, scores, extra):
+        """Mix max-normalized BM25 with cosine similarity from the embedding model."""
+        query_vector = self.embedder.encode([query])[0]
+        extra_ids = [pid for pid in scores if pid < 0]
+        vectors = dict(zip(extra_ids, self.embedder.encode([extra[pid][2] for pid in extra_ids])))
+        top = max(scores.values()) or 1.0
+        blended = {}
+        for passage_id, score in scores.items():
+            vector = vectors.get(passage_id) if passage_id < 0 else self._embeddings.get(passage_id)
+            cosine = float(query_vector @ vector) if vector is not None else 0.0
+            blended[passage_id] = 0.5 * (score / top) + 0.5 * cosine
+        return blended
+
+
+def _transient_passages(documents):
+    """Passages of documents searched for one query, keyed by negative passage ids.
+
+    Values are (doc id, kind, text, length, term counts). A later document with the
+    same id replaces an earlier one, as upsert would.
+    """
+    latest = {}
+    for doc in documents:
+        if isinstance(doc, dict) and document_id(doc):
+            latest[document_id(doc)] = doc
+    passages = {}
+    for doc_id, doc in latest.items():
+        for kind, text in _passages(doc):
+            terms = tokenize(text)
+            if terms:
+                passages[-1 - len(passages)] = (doc_id, kind, text, len(terms), Counter(terms))
+    return passages
+
+
+def passages_to_documents(hits):
+    """Group retrieved passages back into the documents shape DraftEmailReply expects."""
+    grouped = {}
+    for hit in hits:
+        doc = hit["document"]
+        entry = grouped.get(hit["doc_id"])
+        if entry is None:
+            entry = grouped[hit["doc_id"]] = {
+                "id": hit["doc_id"],
+                "type": doc.get("type", ""),
+                "title": doc.get("title") or doc.get("name", ""),
+                "date": doc.get("date") or doc.get("modified", ""),
+                "description": doc.get("description", ""),
+                "raw_text": [],
+            }
+        if hit["kind"] == "raw_text":
+            entry["raw_text"].append(hit["text"].strip())
+    for entry in grouped.values():
+        entry["raw_text"] = " [...] ".join(entry["raw_text"])
+    return list(grouped.values())
+
+
+doc_index = DocumentIndex(embedder=_load_embedder())
@@ -1,29 +1,438 @@
-"""DSPY-powered API routes."""
+"""DSPY-powered API routes.
 
-import os
-
-# Disable DSPy cache before importing to prevent permissions issues
-os.environ["DSPY_CACHE_DISABLED"] = "1"
-os.environ["DSPY_CACHE_TYPE"] = "none"
+dspy itself is imported lazily (see app.programs) so registering this blueprint
+stays cheap; functions that need it import it locally. LM calls run on the shared
+event loop in app.lm_loop, under each route's concurrency limit, and through the
+provider rate limiter in app.rate_limits.
+"""
 
-from dotenv import load_dotenv
-from flask import Blueprint, jsonify, request
-import dspy
+import contextvars
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from flask import Blueprint, Response, has_request_context, jsonify, request
 import json
-from app.dspy_signatures import DraftEmailReply, CategorizeEmailThread, GenerateTodos
+from app import metrics, programs
+from app import prompt_compaction as compaction
+from app import rate_limits, structured_output, task_matching
+from app.doc_index import DEFAULT_TOP_K, doc_index, parse_top_k, passages_to_documents
+from app.gmail_inbox import thread_index
+from app.lm_cache import lm_cache
+from app.jobs import job_queue
+from app.lm_loop import REQUEST_TIMEOUT, RouteBusy, lm_loop
+from app.rate_limits import RateLimited
+from app.single_flight import lm_single_flight
+from app.todo_digests import todo_digests
 
 dspy_bp = Blueprint("dspy", __name__)
 
-# Initialize DSPY with your LLM provider
-load_dotenv("../.env")
-# Use Gemini 2.5 Flash - API key should be in .env as GEMINI_API_KEY
-api_key = os.getenv("GEMINI_API_KEY") or os.getenv("GOOGLE_API_KEY")
-if api_key:
-    # Set GOOGLE_API_KEY for DSPy if it's not already set
-    if not os.getenv("GOOGLE_API_KEY"):
-        os.environ["GOOGLE_API_KEY"] = api_key
-lm = dspy.LM("gemini/gemini-2.5-flash-lite", temperature=0.0, cache=False)
-dspy.settings.configure(lm=lm)
+# Upper bound on concurrent LM calls for batch triage; requests may ask for less
+BATCH_MAX_CONCURRENCY = int(os.getenv("DSPY_BATCH_MAX_CONCURRENCY", "8"))
+
+
+def _bypass_cache(data):
+    """Whether the caller asked to skip cached results for this request."""
+    if data.get("bypass_cache"):
+        return True
+    # Background jobs have no request; their payload carries bypass_cache instead
+    if not has_request_context():
+        return False
+    return "no-cache" in request.headers.get("Cache-Control", "").lower()
+
+
+def _resolve_thread_ids(data, field, as_text=False):
+    """Fill `field` from the inbox when the payload names Gmail threads by id instead.
+
+    "thread_id" stands in for "email_thread" (plain text when `as_text`, for
+    drafts) and "thread_ids" for "email_threads". Returns (error, HTTP status)
+    if the ids are invalid or unknown, otherwise None.
+    """
+    id_field = "thread_ids" if field == "email_threads" else "thread_id"
+    if not isinstance(data, dict) or field in data or id_field not in data:
+        return None
+
+    ids = data[id_field]
+    if id_field == "thread_ids" and not isinstance(ids, list):
+        return "'thread_ids' must be a list", 400
+    threads = thread_index.get_many(ids if id_field == "thread_ids" else [ids])
+    missing = [str(thread_id) for thread_id, thread in threads.items() if thread is None]
+    if missing:
+        return f"Unknown thread id(s): {', '.join(missing)}", 404
+
+    resolved = [thread.to_text() if as_text else thread.to_dict() for thread in threads.values()]
+    data[field] = resolved if id_field == "thread_ids" else resolved[0]
+    return None
+
+
+def _busy_response(e):
+    """Retry-After response for a full route queue (503) or a provider rate limit (429)."""
+    response = jsonify({"success": False, "error": str(e), "retry_after": e.retry_after})
+    response.status_code = 429 if isinstance(e, RateLimited) else 503
+    response.headers["Retry-After"] = str(e.retry_after)
+    return response
+
+
+def _timeout_response():
+    return jsonify({"success": False, "error": "Timed out waiting for the language model"}), 504
+
+
+def _model_name(lm):
+    return getattr(lm, "model", None) or ""
+
+
+def _cache_key(program_name, inputs, lm=None):
+    """Cache key for running `program_name` on `inputs` with `lm` (default: its configured LM)."""
+    current_lm = lm or programs.get_lm(program_name)
+    return lm_cache.make_key(
+        programs.SIGNATURES[program_name],
+        getattr(current_lm, "model", None),
+        getattr(current_lm, "kwargs", {}).get("temperature"),
+        inputs,
+    )
+
+
+def _predict(program_name, inputs, bypass_cache=False, lm=None):
+    """Run the shared program `program_name`, serving identical repeat calls from lm_cache.
+
+    `lm` overrides the program's configured LM for this call. Identical calls
+    already in flight are joined rather than repeated (see app.single_flight).
+    Returns (prediction, cache_key, cache_hit). A bypassed call still refreshes the
+    cached entry with the new result.
+    """
+    import dspy
+
+    lm = lm or programs.get_lm(program_name)
+    cache_key = _cache_key(program_name, inputs, lm)
+    signature = programs.SIGNATURES[program_name]
+    model = _model_name(lm)
+
+    if not bypass_cache:
+        cached = lm_cache.get(cache_key)
+        if cached is not None:
+            metrics.record_lm_call(signature, 0.0, outcome="cache_hit", model=model)
+            return dspy.Prediction(**cached), cache_key, True
+
+    with metrics.phase("lm"):
+        result, shared = lm_single_flight.do(
+            cache_key,
+            lambda: _run_program(program_name, inputs, cache_key, lm),
+            label=signature,
+            timeout=REQUEST_TIMEOUT,
+        )
+    if shared:
+        metrics.record_lm_call(signature, 0.0, outcome="coalesced", model=model)
+    return result, cache_key, False
+
+
+def _run_program(program_name, inputs, cache_key, lm):
+    """Call `lm` for `program_name` on the event loop, record it and cache the result."""
+    import dspy
+
+    signature = programs.SIGNATURES[program_name]
+    program = programs.get_program(program_name)
+    model = _model_name(lm)
+
+    async def call():
+        # Token usage is tracked per call: each coroutine runs in its own context
+        with dspy.track_usage() as usage:
+            result = await program.acall(**inputs, lm=lm)
+        return result, usage.get_total_tokens()
+
+    started = time.perf_counter()
+    try:
+        result, usage = lm_loop.run(program_name, call)
+    except TimeoutError:
+        metrics.record_lm_call(
+            signature, time.perf_counter() - started, outcome="timeout", model=model
+        )
+        raise
+    except RateLimited:
+        metrics.record_lm_call(
+            signature, time.perf_counter() - started, outcome="rate_limited", model=model
+        )
+        raise
+    except Exception:
+        metrics.record_lm_call(
+            signature, time.perf_counter() - started, outcome="error", model=model
+        )
+        raise
+    metrics.record_lm_call(signature, time.perf_counter() - started, usage=usage, model=model)
+
+    lm_cache.set(cache_key, result.toDict())
+    return result
+
+
+def _draft_inputs(data):
+    """Build compacted DraftEmailReply inputs from a request payload.
+
+    Returns (inputs, metadata). What the token budget leaves after the todo, user
+    profile and context is split between the thread and the documents.
+    """
+    documents = data.get("documents", [])
+    retrieved = None
+    if data.get("retrieve_documents", True):
+        documents = retrieved = _retrieve_documents(data, documents)
+
+    raw_inputs = {
+        "email_thread": data["email_thread"],
+        "todo_description": data["todo_description"],
+        "user_profile": json.dumps(data.get("user_profile", {})),
+        # Optional context inputs
+        "documents": json.dumps(documents),
+        "email_context": data.get("email_context", ""),
+    }
+
+    budget = compaction.TOKEN_BUDGETS["draft_email_reply"]
+    fixed = sum(
+        compaction.estimate_tokens(raw_inputs[name])
+        for name in ("todo_description", "user_profile", "email_context")
+    )
+    available = max(budget - fixed, budget // 4)
+    thread_budget = available // 2 if documents else available
+
+    email_thread = compaction.compact_email_text(data["email_thread"], thread_budget)
+    documents = compaction.compact_documents(
+        documents, f"{data['todo_description']}\n{email_thread}", available - thread_budget
+    )
+
+    inputs = dict(raw_inputs, email_thread=email_thread, documents=json.dumps(documents))
+    metadata = compaction.token_report("draft_email_reply", raw_inputs, inputs)
+    if retrieved is not None:
+        metadata["retrieved_documents"] = [doc["id"] for doc in retrieved]
+    return inputs, metadata
+
+
+def _retrieve_documents(data, documents):
+    """Pick the top-k passages for this thread and todo from the document index.
+
+    Documents sent with the request are searched along with the docs_info.json
+    library for this query only; they are not added to the shared index.
+    """
+    doc_index.sync_file()
+    query = f"{data['todo_description']}\n{data['email_thread']}"
+    hits = doc_index.search(
+        query,
+        top_k=data.get("top_k", DEFAULT_TOP_K),
+        extra_documents=[doc for doc in documents if isinstance(doc, dict)],
+    )
+    return passages_to_documents(hits)
+
+
+def _parse_output(result, signature, field, schema, cache_key=None):
+    """Parse and validate JSON output `field` of `result` (see app.structured_output).
+
+    Returns (items, repair). A repaired value replaces the one in the cache entry
+    under `cache_key`, so repeat requests do not repair it again.
+    """
+    items, repair = structured_output.parse_json_field(
+        getattr(result, field, None) or "[]", schema, signature, field
+    )
+    if repair is not None and cache_key is not None:
+        lm_cache.set(cache_key, dict(result.toDict(), **{field: json.dumps(items)}))
+    return items, repair
+
+
+def _draft_from_result(result, cache_key=None):
+    """Shape a DraftEmailReply prediction into the draft object returned to the frontend."""
+    try:
+        references, _ = _parse_output(
+            result, "DraftEmailReply", "references", structured_output.REFERENCE_SCHEMA, cache_key
+        )
+    except (structured_output.StructuredOutputError, RateLimited):
+        # The draft itself is still usable, even if the references repair was throttled
+        references = []
+    return {
+        "to": result.to,
+        "cc": result.cc,
+        "bcc": result.bcc,
+        "subject": result.subject,
+        "body": result.body,
+        "references": references,
+        "reasoning": result.reasoning if hasattr(result, "reasoning") else "",
+    }
+
+
+def _sse(event, payload):
+    """Encode one Server-Sent Events message."""
+    return f"event: {event}\ndata: {json.dumps(payload)}\n\n"
+
+
+def _format_email_thread(thread):
+    """Flatten an email thread object into the prompt text used for categorization."""
+    email_content = f"""
+Subject: {thread.get("subject", "")}
+Participants: {", ".join(thread.get("participants", []))}
+Description: {thread.get("description", "")}
+
+Messages:
+"""
+
+    for msg in thread.get("messages", []):
+        email_content += f"""
+From: {msg.get("from", "")}
+To: {msg.get("to", "")}
+Time: {msg.get("timestamp", "")}
+Content: {msg.get("content", "")}
+---
+"""
+
+    return email_content.strip()
+
+
+def _categorize_thread(thread, existing_tasks, user_profile, bypass_cache=False):
+    """Categorize a single thread against the existing tasks.
+
+    Tasks are pre-scored against the thread; a clear match is assigned without the
+    LM ("deterministic" path), otherwise only the top candidates are sent to
+    CategorizeEmailThread ("lm" path).
+
+    Returns (recommendation, metadata), where metadata reports the path taken and
+    prompt compaction.
+    """
+    with metrics.phase("match"):
+        candidates, match = task_matching.select_candidates(thread, existing_tasks)
+    if match is not None:
+        return task_matching.deterministic_recommendation(match), {
+            "path": "deterministic",
+            "candidate_tasks": len(candidates),
+            "total_tasks": len(existing_tasks),
+            "match_score": match[0],
+        }
+
+    with metrics.phase("prompt"):
+        existing_tasks_json = json.dumps(candidates)
+        budget = compaction.TOKEN_BUDGETS["categorize_email"]
+        fixed = compaction.estimate_tokens(existing_tasks_json)
+        fixed += compaction.estimate_tokens(user_profile)
+        compacted = compaction.compact_thread(thread, max(budget - fixed, budget // 4))
+
+        raw_inputs = {
+            "email_thread": _format_email_thread(thread),
+            "existing_tasks": json.dumps(existing_tasks),
+            "user_profile": user_profile,
+        }
+        inputs = dict(
+            raw_inputs,
+            email_thread=_format_email_thread(compacted),
+            existing_tasks=existing_tasks_json,
+        )
+
+    result, model, cascade = _categorize_with_cascade(inputs, candidates, bypass_cache)
+
+    recommendation = {
+        "action": result.action,
+        "confidence": result.confidence,
+        "reasoning": result.reasoning,
+    }
+
+    if result.action == "assign_existing":
+        recommendation["task_id"] = result.task_id
+    elif result.action == "create_new":
+        recommendation["new_task"] = {
+            "subject": result.new_task_subject,
+            "summary": result.new_task_summary,
+            "priority": result.new_task_priority,
+        }
+
+    metadata = compaction.token_report("categorize_email", raw_inputs, inputs)
+    metadata.update(
+        {
+            "path": "lm",
+            "model": model,
+            "candidate_tasks": len(candidates),
+            "total_tasks": len(existing_tasks),
+        }
+    )
+    if cascade is not None:
+        metadata["cascade"] = cascade
+    return recommendation, metadata
+
+
+def _cascade_rejection(result, candidates):
+    """Why a cheap-model categorization must be escalated, or None to accept it."""
+    action = (result.action or "").strip()
+    if action == "assign_existing":
+        if str(result.task_id).strip() not in {str(task.get("id")) for task in candidates}:
+            return "invalid"
+    elif action != "create_new" or not (result.new_task_subject or "").strip():
+        return "invalid"
+    try:
+        confidence = float(str(result.confidence).strip().rstrip("%"))
+    except ValueError:
+        return "invalid"
+    if confidence < programs.CASCADE_MIN_CONFIDENCE:
+        return "low_confidence"
+    return None
+
+
+def _categorize_with_cascade(inputs, candidates, bypass_cache):
+    """Run CategorizeEmailThread, first on the cascade model when one is configured.
+
+    The cheap answer is kept if it is valid and at least DSPY_CASCADE_MIN_CONFIDENCE
+    confident; otherwise the route's own model is asked. Returns (prediction, model,
+    cascade metadata or None).
+    """
+    lm = programs.get_lm("categorize_email")
+    cascade_lm = programs.get_cascade_lm()
+    if cascade_lm is None or cascade_lm is lm:
+        result, _, _ = _predict("categorize_email", inputs, bypass_cache=bypass_cache, lm=lm)
+        return result, _model_name(lm), None
+
+    first_model = _model_name(cascade_lm)
+    first = None
+    try:
+        first, _, _ = _predict(
+            "categorize_email", inputs, bypass_cache=bypass_cache, lm=cascade_lm
+        )
+        reason = _cascade_rejection(first, candidates)
+    except TimeoutError:
+        # The request's time is already spent; escalating would only time out again
+        raise
+    except Exception:
+        reason = "error"
+    metrics.lm_cascade.inc(signature="CategorizeEmailThread", result=reason or "accepted")
+
+    if reason is None:
+        return first, first_model, {"model": first_model, "escalated": False}
+
+    cascade = {"model": first_model, "escalated": True, "reason": reason}
+    if first is not None:
+        cascade["confidence"] = first.confidence
+    result, _, _ = _predict("categorize_email", inputs, bypass_cache=bypass_cache, lm=lm)
+    return result, _model_name(lm), cascade
+
+
+def _draft_payload_error(data):
+    """Why a draft_email_reply payload with the required fields is malformed, or None.
+
+    A valid "top_k" is replaced by its parsed (and capped) value.
+    """
+    if "top_k" in data:
+        try:
+            data["top_k"] = parse_top_k(data["top_k"])
+        except ValueError as e:
+            return f"'top_k' {e}"
+    return None
+
+
+def _draft_reply(data):
+    """Draft a reply for a payload with the required fields. Returns (body, HTTP status)."""
+    error = _draft_payload_error(data)
+    if error:
+        return {"success": False, "error": error}, 400
+    with lm_loop.admission("draft_email_reply"):
+        with metrics.phase("prompt"):
+            inputs, metadata = _draft_inputs(data)
+        result, cache_key, cache_hit = _predict(
+            "draft_email_reply", inputs, bypass_cache=_bypass_cache(data)
+        )
+
+    return {
+        "success": True,
+        "cached": cache_hit,
+        "draft": _draft_from_result(result, cache_key),
+        "metadata": metadata,
+    }, 200
 
 
 @dspy_bp.route("/draft-email-reply", methods=["POST"])
@@ -36,6 +445,9 @@ def draft_email_reply():
         "todo_description": "Confirm follow-up with internal team"
     }
 
+    Instead of "email_thread", a "thread_id" naming a Gmail thread in the inbox
+    may be given; its messages are rendered in the same format.
+
     Returns:
     {
         "success": true,
@@ -44,12 +456,18 @@ def draft_email_reply():
             "cc": "manager@example.com",
             "bcc": "",
             "subject": "Re: Project Update",
-            "body": "Hi John and Jane,\n\nThank you for your updates..."
+            "body": "Hi John and Jane,\n\nThank you for your updates...",
+            "references": [{"type": "email", "title": "Project Update", "date": "2024-10-24"}]
         }
     }
     """
     try:
-        data = request.get_json()
+        with metrics.phase("parse"):
+            data = request.get_json()
+
+        error = _resolve_thread_ids(data, "email_thread", as_text=True)
+        if error:
+            return jsonify({"success": False, "error": error[0]}), error[1]
 
         # Validate required fields
         required_fields = ["email_thread", "todo_description"]
@@ -60,41 +478,168 @@ def draft_email_reply():
                 {"success": False, "error": f"Missing required fields: {', '.join(missing_fields)}"}
             ), 400
 
-        # Draft the email reply using DSPY
-        draft_reply_signature = dspy.ChainOfThought(DraftEmailReply)
+        body, status = _draft_reply(data)
+        return jsonify(body), status
 
-        user_profile = json.dumps(data.get("user_profile", {}))
+    except (RouteBusy, RateLimited) as e:
+        return _busy_response(e)
+    except TimeoutError:
+        return _timeout_response()
+    except Exception as e:
+        return jsonify({"success": False, "error": str(e)}), 500
 
-        # Optional context inputs
-        documents = json.dumps(data.get("documents", []))
-        email_context = data.get("email_context", "")
-
-        result = draft_reply_signature(
-            email_thread=data["email_thread"],
-            todo_description=data["todo_description"],
-            user_profile=user_profile,
-            documents=documents,
-            email_context=email_context,
-        )
 
-        return jsonify(
-            {
-                "success": True,
-                "draft": {
-                    "to": result.to,
-                    "cc": result.cc,
-                    "bcc": result.bcc,
-                    "subject": result.subject,
-                    "body": result.body,
-                    "references": result.references if hasattr(result, "references") else "[]",
-                    "reasoning": result.reasoning if hasattr(result, "reasoning") else "",
-                },
-            }
-        ), 200
+@dspy_bp.route("/draft-email-reply/stream", methods=["POST"])
+def draft_email_reply_stream():
+    """Draft an email reply, streaming the result as Server-Sent Events.
+
+    Accepts the same JSON payload as /draft-email-reply. Events:
+
+    event: token   data: {"field": "body", "chunk": "Hi John"}
+    event: field   data: {"field": "subject", "value": "Re: Project Update"}
+                   (sent once per to/cc/bcc/subject/body as each completes, then
+                    references as a parsed list)
+    event: done    data: {"success": true, "cached": false, "draft": { ...full draft... }}
+    event: error   data: {"success": false, "error": "..."}
 
+    Cached drafts skip the LM and are replayed as field events followed by done.
+    Errors before the stream starts are returned as JSON, like /draft-email-reply.
+    """
+    try:
+        with metrics.phase("parse"):
+            data = request.get_json(silent=True)
+
+        if not data:
+            return jsonify({"success": False, "error": "No data provided"}), 400
+
+        error = _resolve_thread_ids(data, "email_thread", as_text=True)
+        if error:
+            return jsonify({"success": False, "error": error[0]}), error[1]
+
+        required_fields = ["email_thread", "todo_description"]
+        missing_fields = [field for field in required_fields if field not in data]
+
+        if missing_fields:
+            return jsonify(
+                {"success": False, "error": f"Missing required fields: {', '.join(missing_fields)}"}
+            ), 400
+
+        error = _draft_payload_error(data)
+        if error:
+            return jsonify({"success": False, "error": error}), 400
+
+        with metrics.phase("prompt"):
+            inputs, metadata = _draft_inputs(data)
+        bypass_cache = _bypass_cache(data)
+
+        lm_loop.admit("draft_email_reply")
+    except RouteBusy as e:
+        return _busy_response(e)
     except Exception as e:
         return jsonify({"success": False, "error": str(e)}), 500
 
+    field_names = ["to", "cc", "bcc", "subject", "body", "references"]
+
+    def generate():
+        import dspy
+
+        try:
+            cache_key = _cache_key("draft_email_reply", inputs)
+            model = _model_name(programs.get_lm("draft_email_reply"))
+        except Exception as e:
+            yield _sse("error", {"success": False, "error": str(e)})
+            return
+
+        cached = None if bypass_cache else lm_cache.get(cache_key)
+        if cached is not None:
+            metrics.record_lm_call("DraftEmailReply", 0.0, outcome="cache_hit", model=model)
+            draft = _draft_from_result(dspy.Prediction(**cached), cache_key)
+            for name in field_names:
+                yield _sse("field", {"field": name, "value": draft[name]})
+            yield _sse(
+                "done", {"success": True, "cached": True, "draft": draft, "metadata": metadata}
+            )
+            return
+
+        streaming_program = dspy.streamify(
+            programs.get_program("draft_email_reply"),
+            stream_listeners=[dspy.streaming.StreamListener(name) for name in field_names],
+            is_async_program=True,
+        )
+
+        usage = {}
+
+        async def stream_with_usage():
+            with dspy.track_usage() as tracker:
+                async for chunk in streaming_program(**inputs):
+                    yield chunk
+            usage.update(tracker.get_total_tokens())
+
+        partial = {name: "" for name in field_names}
+        emitted = set()
+        started = time.perf_counter()
+        try:
+            for chunk in lm_loop.stream("draft_email_reply", stream_with_usage):
+                if isinstance(chunk, dspy.streaming.StreamResponse):
+                    name = chunk.signature_field_name
+                    partial[name] += chunk.chunk
+                    if name == "body" and chunk.chunk:
+                        yield _sse("token", {"field": name, "chunk": chunk.chunk})
+                    # references are sent parsed, once the prediction is complete
+                    if chunk.is_last_chunk and name != "references":
+                        emitted.add(name)
+                        yield _sse("field", {"field": name, "value": partial[name].strip()})
+                elif isinstance(chunk, dspy.Prediction):
+                    lm_cache.set(cache_key, chunk.toDict())
+                    draft = _draft_from_result(chunk, cache_key)
+                    # Fields the listeners did not capture (e.g. non-streaming LMs)
+                    for name in field_names:
+                        if name not in emitted:
+                            yield _sse("field", {"field": name, "value": draft[name]})
+                    yield _sse(
+                        "done",
+                        {"success": True, "cached": False, "draft": draft, "metadata": metadata},
+                    )
+            metrics.record_lm_call(
+                "DraftEmailReply", time.perf_counter() - started, usage=usage, model=model
+            )
+        except Exception as e:
+            outcome = "timeout" if isinstance(e, TimeoutError) else "error"
+            error = {"success": False, "error": str(e)}
+            if isinstance(e, RateLimited):
+                outcome = "rate_limited"
+                error["retry_after"] = e.retry_after
+            metrics.record_lm_call(
+                "DraftEmailReply", time.perf_counter() - started, outcome=outcome, model=model
+            )
+            yield _sse("error", error)
+
+    response = Response(
+        generate(),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+    response.call_on_close(lambda: lm_loop.release("draft_email_reply"))
+    return response
+
+
+def _categorize_email(data):
+    """Categorize one thread from a payload with the required fields.
+
+    Returns (response body, HTTP status).
+    """
+    if not isinstance(data["existing_tasks"], list):
+        return {"success": False, "error": "'existing_tasks' must be a list"}, 400
+
+    user_profile = json.dumps(data.get("user_profile", {}))
+
+    with lm_loop.admission("categorize_email"):
+        recommendation, metadata = _categorize_thread(
+            data["email_thread"], data["existing_tasks"], user_profile, _bypass_cache(data)
+        )
+
+    return {"success": True, "recommendation": recommendation, "metadata": metadata}, 200
+
 
 @dspy_bp.route("/categorize-email", methods=["POST"])
 def categorize_email():
@@ -127,6 +672,9 @@ def categorize_email():
         ]
     }
 
+    Instead of "email_thread", a "thread_id" naming a Gmail thread in the inbox
+    may be given (see app.gmail_inbox).
+
     Returns:
     {
         "success": true,
@@ -140,11 +688,25 @@ def categorize_email():
                 "summary": "Task summary",
                 "priority": "Medium"
             }
+        },
+        "metadata": {
+            "path": "deterministic" | "lm",  (deterministic = clear rule match, no LM call)
+            "model": "gemini/gemini-2.5-flash-lite",  (lm path: the model that answered)
+            "cascade": {"model": "...", "escalated": true, "reason": "low_confidence"},
+                        (lm path with DSPY_CASCADE_MODEL set)
+            "candidate_tasks": 10,
+            "total_tasks": 240,
+            ...prompt token counts (lm path) or "match_score" (deterministic path)
         }
     }
     """
     try:
-        data = request.get_json()
+        with metrics.phase("parse"):
+            data = request.get_json()
+
+        error = _resolve_thread_ids(data, "email_thread")
+        if error:
+            return jsonify({"success": False, "error": error[0]}), error[1]
 
         # Validate required fields
         required_fields = ["email_thread", "existing_tasks"]
@@ -155,58 +717,265 @@ def categorize_email():
                 {"success": False, "error": f"Missing required fields: {', '.join(missing_fields)}"}
             ), 400
 
-        thread = data["email_thread"]
-        email_content = f"""
-Subject: {thread.get("subject", "")}
-Participants: {", ".join(thread.get("participants", []))}
-Description: {thread.get("description", "")}
+        body, status = _categorize_email(data)
+        return jsonify(body), status
 
-Messages:
-"""
+    except (RouteBusy, RateLimited) as e:
+        return _busy_response(e)
+    except TimeoutError:
+        return _timeout_response()
+    except Exception as e:
+        return jsonify({"success": False, "error": str(e)}), 500
 
-        for msg in thread.get("messages", []):
-            email_content += f"""
-From: {msg.get("from", "")}
-To: {msg.get("to", "")}
-Time: {msg.get("timestamp", "")}
-Content: {msg.get("content", "")}
----
-"""
 
-        # Format existing tasks as JSON string
-        existing_tasks_json = json.dumps(data["existing_tasks"])
+@dspy_bp.route("/categorize-email/batch", methods=["POST"])
+def categorize_email_batch():
+    """Categorize many email threads against one shared task list.
+
+    Threads are categorized concurrently (at most `max_concurrency` LM calls in
+    flight) and results are streamed back as newline-delimited JSON in completion
+    order. A failure in one thread is reported on its own line and does not
+    affect the others.
+
+    Expected JSON payload:
+    {
+        "email_threads": [ { ...same shape as categorize-email "email_thread"... } ],
+                          (or "thread_ids": ["18a72f3c8e9d4b21", ...] from the inbox)
+        "existing_tasks": [ ... ],
+        "user_profile": { ... },          (optional)
+        "max_concurrency": 4              (optional, capped by DSPY_BATCH_MAX_CONCURRENCY)
+    }
+
+    Streams (application/x-ndjson), one object per line:
+    {"index": 0, "thread_id": 1, "success": true, "recommendation": { ... }, "metadata": { ... }}
+    {"index": 1, "thread_id": 2, "success": false, "error": "..."}
+    ...
+    {"done": true, "total": 2, "succeeded": 1, "failed": 1}
+    """
+    try:
+        with metrics.phase("parse"):
+            data = request.get_json(silent=True)
+
+        if not data:
+            return jsonify({"success": False, "error": "No data provided"}), 400
 
-        # Use DSPy to categorize the email
-        categorize_signature = dspy.ChainOfThought(CategorizeEmailThread)
+        error = _resolve_thread_ids(data, "email_threads")
+        if error:
+            return jsonify({"success": False, "error": error[0]}), error[1]
 
+        required_fields = ["email_threads", "existing_tasks"]
+        missing_fields = [field for field in required_fields if field not in data]
+
+        if missing_fields:
+            return jsonify(
+                {"success": False, "error": f"Missing required fields: {', '.join(missing_fields)}"}
+            ), 400
+
+        threads = data["email_threads"]
+        if not isinstance(threads, list):
+            return jsonify({"success": False, "error": "'email_threads' must be a list"}), 400
+
+        if not isinstance(data["existing_tasks"], list):
+            return jsonify({"success": False, "error": "'existing_tasks' must be a list"}), 400
+
+        try:
+            max_concurrency = int(data.get("max_concurrency", BATCH_MAX_CONCURRENCY))
+        except (TypeError, ValueError):
+            return jsonify({"success": False, "error": "'max_concurrency' must be an integer"}), 400
+        max_concurrency = max(1, min(max_concurrency, BATCH_MAX_CONCURRENCY))
+
+        existing_tasks = data["existing_tasks"]
         user_profile = json.dumps(data.get("user_profile", {}))
+        bypass_cache = _bypass_cache(data)
 
-        result = categorize_signature(
-            email_thread=email_content.strip(),
-            existing_tasks=existing_tasks_json,
-            user_profile=user_profile,
+        # The whole batch is admitted as one request; its LM calls share the
+        # categorize_email limit on the event loop
+        lm_loop.admit("categorize_email_batch")
+    except RouteBusy as e:
+        return _busy_response(e)
+    except Exception as e:
+        return jsonify({"success": False, "error": str(e)}), 500
+
+    # Captured now: the body is generated after the request context is gone
+    request_context = contextvars.copy_context()
+
+    def generate():
+        succeeded = 0
+        if threads:
+            with ThreadPoolExecutor(max_workers=min(max_concurrency, len(threads))) as pool:
+                futures = {
+                    # Each thread gets a copy of the request's context so its phases are
+                    # attributed to this route
+                    pool.submit(
+                        request_context.copy().run,
+                        _categorize_thread,
+                        thread,
+                        existing_tasks,
+                        user_profile,
+                        bypass_cache,
+                    ): index
+                    for index, thread in enumerate(threads)
+                }
+                for future in as_completed(futures):
+                    index = futures[future]
+                    thread = threads[index]
+                    line = {
+                        "index": index,
+                        "thread_id": thread.get("id") if isinstance(thread, dict) else None,
+                    }
+                    try:
+                        line["recommendation"], line["metadata"] = future.result()
+                        line["success"] = True
+                        succeeded += 1
+                    except Exception as e:
+                        line["success"] = False
+                        line["error"] = str(e)
+                        if isinstance(e, RateLimited):
+                            line["retry_after"] = e.retry_after
+                    yield json.dumps(line) + "\n"
+
+        yield json.dumps(
+            {
+                "done": True,
+                "total": len(threads),
+                "succeeded": succeeded,
+                "failed": len(threads) - succeeded,
+            }
+        ) + "\n"
+
+    response = Response(generate(), mimetype="application/x-ndjson")
+    response.call_on_close(lambda: lm_loop.release("categorize_email_batch"))
+    return response
+
+
+def _todos_payload_error(data):
+    """Why a generate_todos payload with the required fields is malformed, or None."""
+    if not isinstance(data["task"], dict):
+        return "'task' must be an object"
+    if not isinstance(data["existing_todos"], list):
+        return "'existing_todos' must be a list"
+    if not isinstance(data["email_threads"], list):
+        return "'email_threads' must be a list"
+    for index, thread in enumerate(data["email_threads"]):
+        if not isinstance(thread, dict):
+            return f"email_threads[{index}] must be an object"
+        messages = thread.get("messages", [])
+        if not isinstance(messages, list):
+            return f"email_threads[{index}].messages must be a list"
+        for position, message in enumerate(messages):
+            if not isinstance(message, dict) or not isinstance(message.get("content", ""), str):
+                return (
+                    f"email_threads[{index}].messages[{position}] must be an object "
+                    "with string 'content'"
+                )
+    return None
+
+
+def _generate_todos(data):
+    """Generate todos from a payload with the required fields.
+
+    Only messages not analyzed for this task before are sent, or none at all when
+    nothing changed (see app.todo_digests). Returns (response body, HTTP status).
+    """
+    error = _todos_payload_error(data)
+    if error:
+        return {"success": False, "error": error}, 400
+
+    bypass_cache = _bypass_cache(data)
+
+    with metrics.phase("prompt"):
+        task = data["task"]
+        task_context = f"""
+Task ID: {task.get("id", "")}
+Subject: {task.get("subject", "")}
+Summary: {task.get("summary", "")}
+Urgency: {task.get("urgency", "")}
+Status: {task.get("status", "")}
+"""
+
+        # Format existing todos
+        existing_todos_json = json.dumps(data["existing_todos"])
+
+        user_profile = json.dumps(data.get("user_profile", {}))
+
+        # "incremental": false (or bypassing the cache) re-analyzes every thread
+        todo_plan = todo_digests.plan(
+            data, force_full=bypass_cache or data.get("incremental") is False
         )
+        metrics.todo_runs.inc(mode=todo_plan.mode)
+
+    if todo_plan.mode == "unchanged":
+        # Nothing new since the last analysis, which the existing todos reflect
+        return {
+            "success": True,
+            "cached": False,
+            "coverage_assessment": "comprehensive",
+            "todos": [],
+            "summary": (
+                f"No new messages since the last analysis of this task "
+                f"({todo_plan.analyzed_messages} messages); the existing TODOs still cover them."
+            ),
+            "metadata": {"incremental": todo_plan.metadata()},
+        }, 200
 
-        # Build response
-        recommendation = {
-            "action": result.action,
-            "confidence": result.confidence,
-            "reasoning": result.reasoning,
+    with metrics.phase("prompt"):
+        # Compact the threads (or only their new messages) to what the token budget leaves
+        program_name = "update_todos" if todo_plan.mode == "delta" else "generate_todos"
+        prior_coverage = json.dumps(todo_plan.prior_coverage()) if todo_plan.mode == "delta" else ""
+        budget = compaction.TOKEN_BUDGETS["generate_todos"]
+        fixed = sum(
+            compaction.estimate_tokens(value)
+            for value in (task_context, existing_todos_json, user_profile, prior_coverage)
+        )
+        threads = todo_plan.delta_threads if todo_plan.mode == "delta" else data["email_threads"]
+        email_threads_json = json.dumps(
+            compaction.compact_threads(threads, max(budget - fixed, budget // 4))
+        )
+
+        inputs = {
+            "task_context": task_context.strip(),
+            "email_threads": email_threads_json,
+            "existing_todos": existing_todos_json,
+            "user_profile": user_profile,
         }
+        full_inputs = dict(inputs, email_threads=json.dumps(data["email_threads"]))
+        if todo_plan.mode == "delta":
+            inputs["new_messages"] = inputs.pop("email_threads")
+            inputs["prior_coverage"] = prior_coverage
+        # Compared against sending every thread uncompacted
+        metadata = compaction.token_report("generate_todos", full_inputs, inputs)
+        metadata["incremental"] = todo_plan.metadata()
 
-        if result.action == "assign_existing":
-            recommendation["task_id"] = result.task_id
-        elif result.action == "create_new":
-            recommendation["new_task"] = {
-                "subject": result.new_task_subject,
-                "summary": result.new_task_summary,
-                "priority": result.new_task_priority,
-            }
+    # Use DSPy to generate TODOs
+    with lm_loop.admission("generate_todos"):
+        result, cache_key, cache_hit = _predict(program_name, inputs, bypass_cache=bypass_cache)
 
-        return jsonify({"success": True, "recommendation": recommendation}), 200
+    # Parse the JSON response, repairing it if needed
+    try:
+        todos_list, repair = _parse_output(
+            result,
+            programs.SIGNATURES[program_name],
+            "todos",
+            structured_output.TODO_SCHEMA,
+            cache_key,
+        )
+    except structured_output.StructuredOutputError:
+        # Don't keep serving an unparseable response from the cache
+        lm_cache.delete(cache_key)
+        return {"success": False, "error": "Invalid JSON format in AI response"}, 500
+    if repair is not None:
+        metadata["output_repair"] = repair
 
-    except Exception as e:
-        return jsonify({"success": False, "error": str(e)}), 500
+    todo_digests.record(todo_plan, data, result.coverage_assessment, result.summary)
+
+    return {
+        "success": True,
+        "cached": cache_hit,
+        "coverage_assessment": result.coverage_assessment,
+        "todos": todos_list,
+        "summary": result.summary,
+        "metadata": metadata,
+    }, 200
 
 
 @dspy_bp.route("/generate-todos", methods=["POST"])
@@ -248,6 +1017,14 @@ def generate_todos():
         ]
     }
 
+    Instead of "email_threads", "thread_ids" naming Gmail threads in the inbox
+    may be given (see app.gmail_inbox).
+
+    Later calls for the same task send only the messages not analyzed before,
+    with a summary of the previous analysis; if there are none, the response is
+    "comprehensive" and no LM call is made. "incremental": false re-analyzes every
+    thread (see app.todo_digests).
+
     Returns:
     {
         "success": true,
@@ -263,7 +1040,12 @@ def generate_todos():
     }
     """
     try:
-        data = request.get_json()
+        with metrics.phase("parse"):
+            data = request.get_json()
+
+        error = _resolve_thread_ids(data, "email_threads")
+        if error:
+            return jsonify({"success": False, "error": error[0]}), error[1]
 
         # Validate required fields
         required_fields = ["task", "email_threads", "existing_todos"]
@@ -274,48 +1056,140 @@ def generate_todos():
                 {"success": False, "error": f"Missing required fields: {', '.join(missing_fields)}"}
             ), 400
 
-        task = data["task"]
-        task_context = f"""
-Task ID: {task.get("id", "")}
-Subject: {task.get("subject", "")}
-Summary: {task.get("summary", "")}
-Urgency: {task.get("urgency", "")}
-Status: {task.get("status", "")}
-"""
+        body, status = _generate_todos(data)
+        return jsonify(body), status
 
-        # Format email threads
-        email_threads_json = json.dumps(data["email_threads"])
+    except (RouteBusy, RateLimited) as e:
+        return _busy_response(e)
+    except TimeoutError:
+        return _timeout_response()
+    except Exception as e:
+        return jsonify({"success": False, "error": str(e)}), 500
 
-        # Format existing todos
-        existing_todos_json = json.dumps(data["existing_todos"])
 
-        # Use DSPy to generate TODOs
-        generate_todos_signature = dspy.ChainOfThought(GenerateTodos)
+@dspy_bp.route("/documents", methods=["POST"])
+def upsert_documents():
+    """Add or update documents in the retrieval index.
 
-        user_profile = json.dumps(data.get("user_profile", {}))
+    Expected JSON payload:
+    {
+        "documents": [
+            {
+                "id": "doc_013",
+                "title": "...",
+                "type": "pdf",
+                "description": "...",
+                "raw_text": "..."
+            }
+        ]
+    }
+    """
+    with metrics.phase("parse"):
+        data = request.get_json(silent=True)
 
-        result = generate_todos_signature(
-            task_context=task_context.strip(),
-            email_threads=email_threads_json,
-            existing_todos=existing_todos_json,
-            user_profile=user_profile,
-        )
+    if not data or not isinstance(data.get("documents"), list):
+        return jsonify({"success": False, "error": "'documents' must be a list"}), 400
 
-        # Parse the JSON response
-        try:
-            todos_list = json.loads(result.todos)
-        except json.JSONDecodeError:
-            # If JSON parsing fails, return an error
-            return jsonify({"success": False, "error": "Invalid JSON format in AI response"}), 500
+    doc_index.sync_file()
+    updated = sum(1 for doc in data["documents"] if isinstance(doc, dict) and doc_index.upsert(doc))
+    return jsonify({"success": True, "updated": updated, "indexed": len(doc_index)}), 200
 
-        return jsonify(
-            {
-                "success": True,
-                "coverage_assessment": result.coverage_assessment,
-                "todos": todos_list,
-                "summary": result.summary,
-            }
-        ), 200
 
-    except Exception as e:
-        return jsonify({"success": False, "error": str(e)}), 500
+@dspy_bp.route("/documents/<doc_id>", methods=["DELETE"])
+def remove_document(doc_id):
+    """Remove a document from the retrieval index."""
+    if not doc_index.remove(doc_id):
+        return jsonify({"success": False, "error": f"No indexed document with id {doc_id}"}), 404
+    return jsonify({"success": True, "indexed": len(doc_index)}), 200
+
+
+@dspy_bp.route("/documents/search", methods=["GET"])
+def search_documents():
+    """Return the top passages for ?q=... (optional &k=5)."""
+    query = request.args.get("q", "")
+    if not query:
+        return jsonify({"success": False, "error": "Missing query parameter 'q'"}), 400
+
+    try:
+        top_k = parse_top_k(request.args.get("k", DEFAULT_TOP_K))
+    except ValueError as e:
+        return jsonify({"success": False, "error": f"'k' {e}"}), 400
+
+    doc_index.sync_file()
+    return jsonify({"success": True, "results": doc_index.search(query, top_k=top_k)}), 200
+
+
+@dspy_bp.route("/models", methods=["GET"])
+def model_stats():
+    """Model per route and the categorization cascade, with per-model calls, mean
+    latency, tokens and estimated cost, the cascade's escalation rate, and the state
+    of each model's rate limiter (concurrency limit, queue, bucket levels)."""
+    return jsonify(
+        {
+            "success": True,
+            **programs.models(),
+            "usage": metrics.model_report(),
+            "rate_limits": rate_limits.snapshot(),
+        }
+    ), 200
+
+
+@dspy_bp.route("/cache/stats", methods=["GET"])
+def cache_stats():
+    """Report LM result cache hit/miss counters and sizes, and in-flight call coalescing."""
+    return jsonify(
+        {"success": True, "cache": lm_cache.stats(), "coalescing": lm_single_flight.stats()}
+    ), 200
+
+
+@dspy_bp.route("/cache", methods=["DELETE"])
+def clear_cache():
+    """Drop every cached LM result."""
+    lm_cache.clear()
+    return jsonify({"success": True, "message": "Cache cleared"}), 200
+
+
+def _job_handler(run):
+    """Adapt a (body, status) helper into a job handler that raises on failure."""
+
+    def handler(payload):
+        body, status = run(payload)
+        if status != 200:
+            raise RuntimeError(body.get("error") or f"Failed with status {status}")
+        return body
+
+    return handler
+
+
+def _job_thread_ids(field, as_text=False):
+    """Resolve Gmail thread ids in a job payload at submission, as the routes do."""
+
+    def prepare(payload):
+        error = _resolve_thread_ids(payload, field, as_text=as_text)
+        return error[0] if error else None
+
+    return prepare
+
+
+# Long-running operations can also be submitted as background jobs (see app.jobs)
+job_queue.register(
+    "draft_email_reply",
+    _job_handler(_draft_reply),
+    priority="interactive",
+    required_fields=["email_thread", "todo_description"],
+    prepare=_job_thread_ids("email_thread", as_text=True),
+)
+job_queue.register(
+    "generate_todos",
+    _job_handler(_generate_todos),
+    priority="normal",
+    required_fields=["task", "email_threads", "existing_todos"],
+    prepare=_job_thread_ids("email_threads"),
+)
+job_queue.register(
+    "categorize_email",
+    _job_handler(_categorize_email),
+    priority="bulk",
+    required_fields=["email_thread", "existing_tasks"],
+    prepare=_job_thread_ids("email_thread"),
+)
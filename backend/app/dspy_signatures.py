@@ -127,4 +127,96 @@ class GenerateTodos(dspy.Signature):
     )
     summary: str = dspy.OutputField(
         desc="Brief explanation of the coverage assessment and TODO generation strategy. If comprehensive, explain why existing TODOs are sufficient. If gaps identified, explain what new TODOs were suggested."
-    )
\ No newline at end of file
+    )
+
+
+class UpdateTodos(dspy.Signature):
+    """Update TODO suggestions for a clinical research task after new email messages.
+
+    The earlier messages of these threads were already analyzed and the existing
+    TODOs reflect them; prior_coverage summarizes that analysis. Only the new
+    messages are given. Suggest TODOs only for what the new messages add (new
+    requests, changed deadlines, reopened issues) that the existing TODOs do not
+    cover. Apply the same filtering as for a full analysis: only items directly
+    actionable by the person described in user_profile, at most 3–5.
+    """
+
+    # Inputs
+    task_context: str = dspy.InputField(
+        desc="The task details including subject, summary, urgency, and status"
+    )
+    prior_coverage: str = dspy.InputField(
+        desc="JSON summary of the previous analysis: its coverage assessment and summary, and how many messages of each thread it covered"
+    )
+    new_messages: str = dspy.InputField(
+        desc="JSON string of the threads with new messages, each holding only the messages not analyzed before"
+    )
+    existing_todos: str = dspy.InputField(
+        desc="JSON string of existing TODO items to analyze for completeness"
+    )
+    user_profile: str = dspy.InputField(
+        desc="Information about the current user (name, email, organization, role). Tailor suggestions to this role."
+    )
+
+    # Outputs
+    coverage_assessment: str = dspy.OutputField(
+        desc="Either 'comprehensive' if the existing TODOs still cover the task after the new messages, or 'gaps_identified' if new TODOs are needed"
+    )
+    todos: str = dspy.OutputField(
+        desc="JSON array of TODO objects needed because of the new messages (empty array if none), each with 'description', 'priority' (High/Medium/Low), 'tag' (system tag like 'EDC', 'Thread 1', 'Thread 2', etc.), and 'reasoning' (why this TODO is needed)"
+    )
+    summary: str = dspy.OutputField(
+        desc="Brief explanation of what the new messages changed and of the TODOs suggested, if any."
+    )
+
+
+class AnalyzeEmail(dspy.Signature):
+    """Summarize and triage one incoming clinical research email for the inbox view.
+
+    Produces the precomputed analysis the inbox shows next to each email: a short
+    summary, an inbox category, suggested quick actions for the reader, and the
+    automation workflow (if any) the email should trigger.
+    """
+
+    # Inputs
+    email: str = dspy.InputField(
+        desc="The email including From, To, Cc, Subject, Date, attachment names and body"
+    )
+    workflows: str = dspy.InputField(
+        desc="JSON array of configured automation workflows, each with 'id', 'name' and 'description'"
+    )
+
+    # Outputs
+    summary: str = dspy.OutputField(
+        desc="One or two sentences naming the study, site, patient/subject IDs and what the email is about or asks for"
+    )
+    category: str = dspy.OutputField(
+        desc="Inbox category: 'Critical', 'Urgent', 'Important', 'IRB', or 'Other'"
+    )
+    quick_actions: str = dspy.OutputField(
+        desc="JSON array of follow-up actions for the reader (empty array if none), each an object with an 'action' string"
+    )
+    workflow_id: str = dspy.OutputField(
+        desc="The 'id' of the workflow this email should trigger, or empty string if none applies"
+    )
+
+
+class RepairStructuredOutput(dspy.Signature):
+    """Fix one malformed JSON output field so that it parses and has the expected shape.
+
+    Keep the original content wherever it can be recovered (complete truncated
+    items only if their meaning is clear, otherwise drop them) and do not invent
+    new items. Return valid JSON only.
+    """
+
+    # Inputs
+    field_description: str = dspy.InputField(
+        desc="What the field must contain, from the signature that produced it"
+    )
+    broken_output: str = dspy.InputField(desc="The malformed value as the model returned it")
+    error: str = dspy.InputField(desc="Why the value failed to parse or validate")
+
+    # Outputs
+    fixed_output: str = dspy.OutputField(
+        desc="The corrected value as valid JSON, without code fences or commentary"
+    )
@@ -0,0 +1,358 @@
+"""Gmail API messages from the inbox directory, grouped into threads.
+
+The inbox holds email_NNN.json files, each a Gmail API message (nested
+payload.headers, multipart parts, base64url bodies) with the rest of its thread
+under "threadEmails". Files are parsed one at a time into compact GmailMessage
+records that keep only what the routes use: the raw headers packed into one
+string and the still-encoded text/plain body, both decoded on first access.
+Messages are grouped into Threads by threadId, deduplicated by message id and
+ordered by internalDate.
+
+thread_index serves threads by Gmail thread id to the DSPy routes, which accept
+a thread_id in place of a full email thread, re-parsing only files whose size or
+modification time changed since the last lookup.
+"""
+
+import base64
+import glob
+import json
+import os
+import re
+import threading
+import time
+from email.header import decode_header, make_header
+
+_REPO_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+INBOX_DIR = os.getenv("INBOX_DIR", os.path.join(_REPO_ROOT, "simulated_backend", "simulated_inbox"))
+
+# How often a lookup may re-list the inbox directory for changed files
+RESCAN_SECONDS = float(os.getenv("INBOX_RESCAN_SECONDS", "2"))
+
+_EMAIL = re.compile(r"[\w.+-]+@[\w-]+(?:\.[\w-]+)+")
+_TAG = re.compile(r"<[^>]+>")
+_NO_ATTACHMENTS = ()
+
+# Serializes the first decode of a message's headers or body, which replaces the
+# encoded source; later reads see the decoded value without taking it
+_decode_lock = threading.Lock()
+
+
+def _decode_base64url(data):
+    return base64.urlsafe_b64decode(data + "=" * (-len(data) % 4)).decode("utf-8", "replace")
+
+
+def _decode_header_value(value):
+    """Decode RFC 2047 encoded words (=?UTF-8?B?...?=); plain values are returned as is."""
+    if "=?" not in value:
+        return value
+    try:
+        return str(make_header(decode_header(value)))
+    except Exception:
+        return value
+
+
+class GmailMessage:
+    """One Gmail API message. Headers and body are decoded on first access (thread-safe)."""
+
+    __slots__ = (
+        "id",
+        "thread_id",
+        "internal_date",
+        "snippet",
+        "label_ids",
+        "attachments",
+        "_headers",
+        "_decoded_headers",
+        "_body",
+        "_body_is_html",
+        "_decoded_body",
+    )
+
+    def __init__(self, raw):
+        payload = raw.get("payload") or {}
+        self.id = raw.get("id")
+        self.thread_id = raw.get("threadId") or self.id
+        try:
+            self.internal_date = int(raw.get("internalDate") or 0)
+        except (TypeError, ValueError):
+            self.internal_date = 0
+        self.snippet = raw.get("snippet", "")
+        self.label_ids = tuple(raw.get("labelIds") or ())
+        # One string per message rather than a tuple per header; split on first access
+        self._headers = "\x1e".join(
+            f"{header.get('name', '')}\x1f{header.get('value', '')}"
+            for header in payload.get("headers", ())
+        )
+        self._decoded_headers = None
+
+        # Keep only the encoded body part; everything else in the payload is dropped
+        plain, html, attachments = None, None, []
+        stack = [payload]
+        while stack:
+            part = stack.pop()
+            if part.get("filename"):
+                attachments.append(part["filename"])
+            else:
+                data = (part.get("body") or {}).get("data")
+                mime_type = part.get("mimeType", "")
+                if data and mime_type == "text/plain" and plain is None:
+                    plain = data
+                elif data and mime_type == "text/html" and html is None:
+                    html = data
+            # Reversed so parts are visited in document order
+            stack.extend(reversed(part.get("parts") or ()))
+        self._body = plain if plain is not None else html
+        self._body_is_html = plain is None and html is not None
+        self._decoded_body = None
+        self.attachments = tuple(attachments) if attachments else _NO_ATTACHMENTS
+
+    def header(self, name, default=""):
+        """Value of the first header called `name` (case-insensitive)."""
+        decoded = self._decoded_headers
+        if decoded is None:
+            with _decode_lock:
+                if self._decoded_headers is None:
+                    headers = {}
+                    for pair in self._headers.split("\x1e") if self._headers else ():
+                        key, _, value = pair.partition("\x1f")
+                        headers.setdefault(key.lower(), _decode_header_value(value))
+                    self._decoded_headers = headers
+                    self._headers = None
+                decoded = self._decoded_headers
+        return decoded.get(name.lower(), default)
+
+    @property
+    def subject(self):
+        return self.header("Subject")
+
+    @property
+    def sender(self):
+        return self.header("From")
+
+    @property
+    def to(self):
+        return self.header("To")
+
+    @property
+    def cc(self):
+        return self.header("Cc")
+
+    @property
+    def date(self):
+        return self.header("Date")
+
+    @property
+    def body(self):
+        """Plain-text body (tags stripped from HTML-only messages), or the snippet."""
+        decoded = self._decoded_body
+        if decoded is None:
+            with _decode_lock:
+                if self._decoded_body is None:
+                    if self._body is None:
+                        return self.snippet
+                    text = _decode_base64url(self._body)
+                    self._decoded_body = _TAG.sub("", text) if self._body_is_html else text
+                    self._body = None
+                decoded = self._decoded_body
+        return decoded
+
+    def addresses(self):
+        """Lower-cased email addresses in From, To and Cc."""
+        return {
+            address.lower()
+            for address in _EMAIL.findall(f"{self.sender} {self.to} {self.cc}")
+        }
+
+    def to_dict(self):
+        """The message shape the DSPy routes take."""
+        return {
+            "from": self.sender,
+            "to": self.to,
+            "timestamp": self.date,
+            "content": self.body,
+        }
+
+    def to_text(self):
+        """Plain-text rendering: headers, attachment names and body."""
+        lines = [f"{name}: {self.header(name)}" for name in ("From", "To", "Cc", "Subject", "Date")]
+        if self.attachments:
+            lines.append(f"Attachments: {', '.join(self.attachments)}")
+        lines.append("")
+        lines.append(self.body)
+        return "\n".join(lines)
+
+
+class Thread:
+    """Messages sharing a Gmail threadId, oldest first."""
+
+    __slots__ = ("id", "messages")
+
+    def __init__(self, thread_id, messages):
+        self.id = thread_id
+        self.messages = messages
+
+    @property
+    def subject(self):
+        return self.messages[0].subject if self.messages else ""
+
+    @property
+    def participants(self):
+        return sorted({address for message in self.messages for address in message.addresses()})
+
+    def to_dict(self, description=None):
+        """The email thread shape /categorize-email and /generate-todos take."""
+        return {
+            "id": self.id,
+            "subject": self.subject,
+            "participants": self.participants,
+            "description": self.messages[-1].snippet if description is None else description,
+            "messages": [message.to_dict() for message in self.messages],
+        }
+
+    def to_text(self):
+        """The plain-text thread /draft-email-reply takes."""
+        return "\n\n".join(
+            f"From: {message.sender}\nDate: {message.date}\nSubject: {message.subject}\n"
+            f"Body: {message.body}"
+            for message in self.messages
+        )
+
+
+def parse_message(raw):
+    return GmailMessage(raw)
+
+
+def parse_file(path):
+    """The messages in one inbox file: its thread if present, otherwise the message itself."""
+    with open(path, "r", encoding="utf-8") as f:
+        raw = json.load(f)
+    return [GmailMessage(item) for item in raw.get("threadEmails") or [raw]]
+
+
+def inbox_files(inbox_dir=INBOX_DIR):
+    return sorted(
+        path
+        for path in glob.glob(os.path.join(inbox_dir, "email_*.json"))
+        if os.path.basename(path)[len("email_") : -len(".json")].isdigit()
+    )
+
+
+def iter_messages(inbox_dir=INBOX_DIR):
+    """Stream messages file by file; messages repeated across files are yielded each time."""
+    for path in inbox_files(inbox_dir):
+        yield from parse_file(path)
+
+
+def _by_date(message):
+    return message.internal_date
+
+
+def build_threads(messages):
+    """{thread id: Thread}, deduplicating messages by id and ordering them by internalDate."""
+    by_thread = {}
+    for message in messages:
+        by_thread.setdefault(message.thread_id, {}).setdefault(message.id, message)
+    return {
+        thread_id: Thread(thread_id, sorted(unique.values(), key=_by_date))
+        for thread_id, unique in by_thread.items()
+    }
+
+
+class ThreadIndex:
+    """Threads of an inbox directory by Gmail thread id, refreshed incrementally."""
+
+    def __init__(self, inbox_dir=INBOX_DIR, rescan_seconds=RESCAN_SECONDS):
+        self.inbox_dir = inbox_dir
+        self.rescan_seconds = rescan_seconds
+        self._files = {}  # path -> ((size, mtime_ns), [GmailMessage])
+        self._thread_files = {}  # thread id -> {path}
+        self._threads = {}
+        self._scanned_at = None
+        self._lock = threading.Lock()
+
+    def refresh(self, force=False):
+        """Re-parse new and changed files and drop deleted ones. Returns the files parsed."""
+        with self._lock:
+            now = time.monotonic()
+            recent = self._scanned_at is not None and now - self._scanned_at < self.rescan_seconds
+            if recent and not force:
+                return 0
+            self._scanned_at = now
+
+            present = {}
+            for path in inbox_files(self.inbox_dir):
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                present[path] = (st.st_size, st.st_mtime_ns)
+
+            touched = set()
+            parsed = 0
+            for path in [path for path in self._files if path not in present]:
+                touched.update(self._forget(path))
+            for path, signature in present.items():
+                known = self._files.get(path)
+                if known is not None and known[0] == signature:
+                    continue
+                try:
+                    messages = parse_file(path)
+                except (OSError, ValueError):
+                    # Half-written file; picked up on a later scan
+                    continue
+                if known is not None:
+                    touched.update(self._forget(path))
+                self._files[path] = (signature, messages)
+                for message in messages:
+                    self._thread_files.setdefault(message.thread_id, set()).add(path)
+                    touched.add(message.thread_id)
+                parsed += 1
+
+            for thread_id in touched:
+                paths = self._thread_files.get(thread_id)
+                if not paths:
+                    self._thread_files.pop(thread_id, None)
+                    self._threads.pop(thread_id, None)
+                    continue
+                messages = (
+                    message
+                    for path in sorted(paths)
+                    for message in self._files[path][1]
+                    if message.thread_id == thread_id
+                )
+                self._threads[thread_id] = build_threads(messages)[thread_id]
+            return parsed
+
+    def _forget(self, path):
+        _, messages = self._files.pop(path)
+        thread_ids = {message.thread_id for message in messages}
+        for thread_id in thread_ids:
+            self._thread_files.get(thread_id, set()).discard(path)
+        return thread_ids
+
+    def get(self, thread_id):
+        self.refresh()
+        return self._threads.get(str(thread_id))
+
+    def get_many(self, thread_ids):
+        """{thread id: Thread or None} for each requested id."""
+        self.refresh()
+        return {thread_id: self._threads.get(str(thread_id)) for thread_id in thread_ids}
+
+    def thread_ids(self):
+        self.refresh()
+        return list(self._threads)
+
+    def stats(self):
+        return {
+            "files": len(self._files),
+            "threads": len(self._threads),
+            "messages": sum(len(thread.messages) for thread in self._threads.values()),
+        }
+
+    def __len__(self):
+        return len(self._threads)
+
+
+thread_index = ThreadIndex()
@@ -0,0 +1,423 @@
+"""Incremental AI analysis of the inbox, precomputed off the request path.
+
+The pipeline scans the inbox directory for email_*.json files (Gmail API
+messages), hashes their content, and analyzes only files that are new or whose
+hash changed: one AnalyzeEmail call per email produces the summary, inbox
+category, quick actions and matching workflow. Emails are analyzed in batches,
+several at a time, and each batch is written to the analysis store as soon as it
+finishes, so an interrupted run keeps its progress. Re-running over an unchanged
+inbox makes no LM calls. The hash also covers workflow_settings.json, so editing
+the workflows analyzes every email again rather than serving stale matches.
+
+The store is a SQLite table keyed by file name and indexed by thread, category
+and workflow, which the inbox routes read directly, so showing an email's
+analysis never waits on the LM. It can also be exported in the
+email_ai_analysis.json format.
+
+    python -m app.inbox_analysis                 # analyze new/changed emails once
+    python -m app.inbox_analysis --watch         # keep polling the inbox
+    python -m app.inbox_analysis --export PATH   # also write the JSON map
+
+create_app starts the watcher when INBOX_WATCH=1.
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from app import metrics, programs, structured_output
+from app import prompt_compaction as compaction
+from app.gmail_inbox import INBOX_DIR, GmailMessage, inbox_files
+from app.lm_loop import lm_loop
+
+_REPO_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+WORKFLOW_SETTINGS_PATH = os.getenv(
+    "WORKFLOW_SETTINGS_PATH",
+    os.path.join(_REPO_ROOT, "simulated_backend", "workflow_settings.json"),
+)
+DEFAULT_DB_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), ".analysis.db")
+
+BATCH_SIZE = int(os.getenv("ANALYSIS_BATCH_SIZE", "16"))
+CONCURRENCY = int(os.getenv("ANALYSIS_CONCURRENCY", "4"))
+WATCH_INTERVAL_SECONDS = float(os.getenv("INBOX_WATCH_INTERVAL", "5"))
+
+CATEGORIES = ("Critical", "Urgent", "Important", "IRB", "Other")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS analyses (
+    filename TEXT PRIMARY KEY,
+    content_hash TEXT NOT NULL,
+    message_id TEXT,
+    thread_id TEXT,
+    category TEXT,
+    workflow_id TEXT,
+    analysis TEXT NOT NULL,
+    model TEXT,
+    analyzed_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS analyses_thread ON analyses (thread_id);
+CREATE INDEX IF NOT EXISTS analyses_category ON analyses (category);
+CREATE INDEX IF NOT EXISTS analyses_workflow ON analyses (workflow_id);
+"""
+
+
+class AnalysisStore:
+    """Analysis results per email file, with the content hash they were computed from."""
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._initialized = False
+
+    @contextmanager
+    def _connect(self):
+        connection = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        connection.row_factory = sqlite3.Row
+        try:
+            if not self._initialized:
+                connection.execute("PRAGMA journal_mode=WAL")
+                connection.executescript(_SCHEMA)
+                self._initialized = True
+            yield connection
+        finally:
+            connection.close()
+
+    def hashes(self):
+        """{filename: content hash} for every analyzed file."""
+        with self._connect() as connection:
+            rows = connection.execute("SELECT filename, content_hash FROM analyses").fetchall()
+        return {row["filename"]: row["content_hash"] for row in rows}
+
+    def upsert_many(self, records):
+        """Store analyses given as dicts with the table's columns, in one transaction."""
+        if not records:
+            return
+        with self._connect() as connection:
+            connection.execute("BEGIN")
+            connection.executemany(
+                "INSERT OR REPLACE INTO analyses (filename, content_hash, message_id, thread_id, "
+                "category, workflow_id, analysis, model, analyzed_at) "
+                "VALUES (:filename, :content_hash, :message_id, :thread_id, :category, "
+                ":workflow_id, :analysis, :model, :analyzed_at)",
+                [dict(record, analysis=json.dumps(record["analysis"])) for record in records],
+            )
+            connection.execute("COMMIT")
+
+    def remove(self, filenames):
+        if not filenames:
+            return
+        with self._connect() as connection:
+            connection.executemany(
+                "DELETE FROM analyses WHERE filename = ?", [(filename,) for filename in filenames]
+            )
+
+    def get(self, filename):
+        with self._connect() as connection:
+            row = connection.execute(
+                "SELECT analysis FROM analyses WHERE filename = ?", (filename,)
+            ).fetchone()
+        return None if row is None else json.loads(row["analysis"])
+
+    def query(self, thread_id=None, category=None, workflow_id=None):
+        """{filename: analysis}, optionally filtered on the indexed columns."""
+        clauses, params = [], []
+        filters = (("thread_id", thread_id), ("category", category), ("workflow_id", workflow_id))
+        for column, value in filters:
+            if value is not None:
+                clauses.append(f"{column} = ?")
+                params.append(value)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        with self._connect() as connection:
+            rows = connection.execute(
+                f"SELECT filename, analysis FROM analyses {where} ORDER BY filename", params
+            ).fetchall()
+        return {row["filename"]: json.loads(row["analysis"]) for row in rows}
+
+    def version(self):
+        """Changes whenever an analysis is added, replaced or removed."""
+        with self._connect() as connection:
+            row = connection.execute(
+                "SELECT COUNT(*) AS n, MAX(analyzed_at) AS latest, "
+                "GROUP_CONCAT(content_hash, '') AS hashes FROM "
+                "(SELECT analyzed_at, content_hash FROM analyses ORDER BY filename)"
+            ).fetchone()
+        signature = f"{row['n']}:{row['latest']}:{row['hashes'] or ''}"
+        return hashlib.sha1(signature.encode("utf-8")).hexdigest()[:16]
+
+    def export(self, path):
+        """Write every analysis as an email_ai_analysis.json-style map (atomic replace)."""
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.query(), f, indent=2, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+
+def _load_workflows(path=WORKFLOW_SETTINGS_PATH):
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            workflows = json.load(f)
+    except (FileNotFoundError, ValueError):
+        return []
+    return [workflow for workflow in workflows if isinstance(workflow, dict) and workflow.get("id")]
+
+
+def _workflow_steps(workflow):
+    """The workflow's configured actions as not-yet-run steps, in action order.
+
+    Analysis only matches the workflow; a step's result is filled in when it runs.
+    """
+    actions = [action for action in workflow.get("actions", []) if isinstance(action, dict)]
+    actions.sort(key=lambda action: action.get("actionNumber", 0))
+    return [
+        {
+            "name": action.get("action", ""),
+            "result": "Awaiting approval" if action.get("approval") == "Yes" else "Pending",
+            "reasoning": action.get("description", ""),
+        }
+        for action in actions
+    ]
+
+
+def _settings_digest(workflows):
+    """Digest of the workflow settings that analyses are matched against."""
+    canonical = json.dumps(workflows, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()[:16]
+
+
+def _text(value):
+    """An LM output field as stripped text; missing or non-text values become ""."""
+    return value.strip() if isinstance(value, str) else ""
+
+
+class InboxPipeline:
+    """Analyze new and changed inbox files into an AnalysisStore."""
+
+    def __init__(
+        self,
+        inbox_dir,
+        store,
+        batch_size=BATCH_SIZE,
+        concurrency=CONCURRENCY,
+        export_path=None,
+        workflow_settings_path=WORKFLOW_SETTINGS_PATH,
+    ):
+        self.inbox_dir = inbox_dir
+        self.store = store
+        self.workflow_settings_path = workflow_settings_path
+        self.batch_size = max(1, batch_size)
+        self.concurrency = max(1, concurrency)
+        self.export_path = export_path
+        # path -> (size, mtime_ns, sha256), so untouched files are not re-read
+        self._file_hashes = {}
+        self._run_lock = threading.Lock()
+        self._watcher = None
+        self.last_run = None
+
+    def _hash(self, path):
+        st = os.stat(path)
+        cached = self._file_hashes.get(path)
+        if cached is not None and cached[:2] == (st.st_size, st.st_mtime_ns):
+            return cached[2]
+        with open(path, "rb") as f:
+            digest = hashlib.sha256(f.read()).hexdigest()
+        self._file_hashes[path] = (st.st_size, st.st_mtime_ns, digest)
+        return digest
+
+    def scan(self, workflows=None):
+        """Return (changed, removed): [(filename, path, hash)] to analyze and filenames to drop.
+
+        A file's hash combines its content with a digest of `workflows` (by default
+        the current workflow settings).
+        """
+        if workflows is None:
+            workflows = _load_workflows(self.workflow_settings_path)
+        settings = _settings_digest(workflows)
+        stored = self.store.hashes()
+        present = {}
+        for path in inbox_files(self.inbox_dir):
+            filename = os.path.basename(path)
+            try:
+                present[filename] = (path, f"{self._hash(path)}:{settings}")
+            except OSError:
+                continue
+        changed = [
+            (filename, path, digest)
+            for filename, (path, digest) in present.items()
+            if stored.get(filename) != digest
+        ]
+        removed = [filename for filename in stored if filename not in present]
+        return changed, removed
+
+    def _analyze(self, filename, path, digest, workflows):
+        import dspy
+
+        with open(path, "r", encoding="utf-8") as f:
+            message = GmailMessage(json.load(f))
+
+        budget = compaction.TOKEN_BUDGETS["analyze_email"]
+        workflows_json = json.dumps(
+            [
+                {key: workflow.get(key, "") for key in ("id", "name", "description")}
+                for workflow in workflows
+            ]
+        )
+        inputs = {
+            "email": compaction.compact_email_text(
+                message.to_text(), budget - compaction.estimate_tokens(workflows_json)
+            ),
+            "workflows": workflows_json,
+        }
+
+        program = programs.get_program("analyze_email")
+        model = getattr(programs.get_lm("analyze_email"), "model", None) or ""
+
+        async def call():
+            with dspy.track_usage() as usage:
+                result = await program.acall(**inputs)
+            return result, usage.get_total_tokens()
+
+        started = time.perf_counter()
+        try:
+            result, usage = lm_loop.run("analyze_email", call)
+        except Exception:
+            metrics.record_lm_call(
+                "AnalyzeEmail", time.perf_counter() - started, outcome="error", model=model
+            )
+            raise
+        metrics.record_lm_call(
+            "AnalyzeEmail", time.perf_counter() - started, usage=usage, model=model
+        )
+
+        category = _text(result.category)
+        analysis = {
+            "summary": _text(result.summary),
+            "category": category if category in CATEGORIES else "Other",
+            "quickActions": self._quick_actions(result),
+        }
+        workflow_id = _text(getattr(result, "workflow_id", None))
+        workflow = next((w for w in workflows if w["id"] == workflow_id), None)
+        if workflow is not None:
+            analysis["workflow"] = {
+                "workflowId": workflow["id"],
+                "status": "needs approval" if workflow.get("approval") == "Yes" else "pending",
+                "steps": _workflow_steps(workflow),
+            }
+
+        return {
+            "filename": filename,
+            "content_hash": digest,
+            "message_id": message.id,
+            "thread_id": message.thread_id,
+            "category": analysis["category"],
+            "workflow_id": workflow["id"] if workflow is not None else None,
+            "analysis": analysis,
+            "model": model,
+            "analyzed_at": time.time(),
+        }
+
+    @staticmethod
+    def _quick_actions(result):
+        try:
+            actions, _ = structured_output.parse_json_field(
+                result.quick_actions,
+                structured_output.QUICK_ACTION_SCHEMA,
+                "AnalyzeEmail",
+                "quick_actions",
+            )
+        except structured_output.StructuredOutputError:
+            return []
+        return actions
+
+    def run_once(self):
+        """Analyze whatever changed since the last run. Returns run statistics."""
+        with self._run_lock:
+            started = time.perf_counter()
+            workflows = _load_workflows(self.workflow_settings_path)
+            changed, removed = self.scan(workflows)
+            self.store.remove(removed)
+
+            analyzed, errors = 0, {}
+            for start in range(0, len(changed), self.batch_size):
+                batch = changed[start : start + self.batch_size]
+                records = []
+                with ThreadPoolExecutor(max_workers=min(self.concurrency, len(batch))) as pool:
+                    futures = {
+                        pool.submit(self._analyze, filename, path, digest, workflows): filename
+                        for filename, path, digest in batch
+                    }
+                    for future, filename in futures.items():
+                        try:
+                            records.append(future.result())
+                        except Exception as e:
+                            # Left out of the store, so the next run retries it
+                            errors[filename] = str(e)
+                # Persist each batch as it completes
+                self.store.upsert_many(records)
+                analyzed += len(records)
+
+            if self.export_path and (analyzed or removed):
+                self.store.export(self.export_path)
+
+            self.last_run = {
+                "changed": len(changed),
+                "analyzed": analyzed,
+                "removed": len(removed),
+                "failed": len(errors),
+                "errors": errors,
+                "lm_calls": analyzed + len(errors),
+                "seconds": round(time.perf_counter() - started, 3),
+                "finished_at": time.time(),
+            }
+            return self.last_run
+
+    def start_watching(self, interval=WATCH_INTERVAL_SECONDS):
+        """Poll the inbox on a background thread (once per process)."""
+
+        def watch():
+            while True:
+                try:
+                    self.run_once()
+                except Exception as e:
+                    self.last_run = {"error": str(e), "finished_at": time.time()}
+                time.sleep(interval)
+
+        if self._watcher is None or not self._watcher.is_alive():
+            self._watcher = threading.Thread(target=watch, name="inbox-watcher", daemon=True)
+            self._watcher.start()
+
+
+analysis_store = AnalysisStore(os.getenv("ANALYSIS_DB_PATH", DEFAULT_DB_PATH))
+inbox_pipeline = InboxPipeline(
+    INBOX_DIR, analysis_store, export_path=os.getenv("ANALYSIS_EXPORT_PATH") or None
+)
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Analyze new or changed inbox emails.")
+    parser.add_argument("--watch", action="store_true", help="keep polling the inbox for changes")
+    parser.add_argument("--interval", type=float, default=WATCH_INTERVAL_SECONDS)
+    parser.add_argument(
+        "--export", help="also write the analyses as an email_ai_analysis.json-style map"
+    )
+    args = parser.parse_args(argv)
+
+    if args.export:
+        inbox_pipeline.export_path = args.export
+
+    while True:
+        stats = inbox_pipeline.run_once()
+        print(json.dumps(stats), flush=True)
+        if not args.watch:
+            return 1 if stats["failed"] else 0
+        time.sleep(args.interval)
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
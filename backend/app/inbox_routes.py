@@ -0,0 +1,99 @@
+"""Inbox routes: Gmail threads (app.gmail_inbox) and precomputed analysis
+(app.inbox_analysis). None of them call the LM.
+"""
+
+from flask import Blueprint, jsonify, make_response, request
+
+from app.gmail_inbox import thread_index
+from app.inbox_analysis import CATEGORIES, analysis_store, inbox_pipeline
+from app.jobs import job_queue
+
+inbox_bp = Blueprint("inbox", __name__, url_prefix="/api/inbox")
+
+
+@inbox_bp.route("/threads/<thread_id>", methods=["GET"])
+def get_thread(thread_id):
+    """A Gmail thread in the shape /api/dspy/categorize-email takes as "email_thread"."""
+    try:
+        thread = thread_index.get(thread_id)
+        if thread is None:
+            return jsonify({"success": False, "error": f"No thread with id {thread_id}"}), 404
+
+        return jsonify({"success": True, "thread": thread.to_dict()}), 200
+
+    except Exception as e:
+        return jsonify({"success": False, "error": str(e)}), 500
+
+
+@inbox_bp.route("/analysis", methods=["GET"])
+def list_analyses():
+    """Analyses of the inbox emails, keyed by file name (email_ai_analysis.json format).
+
+    Query parameters (optional):
+        thread_id   - only emails of this Gmail thread
+        category    - Critical, Urgent, Important, IRB or Other
+        workflow_id - only emails matched to this workflow
+
+    Responses carry an ETag; a matching If-None-Match gets a 304.
+    """
+    try:
+        category = request.args.get("category")
+        if category is not None and category not in CATEGORIES:
+            return jsonify(
+                {"success": False, "error": f"'category' must be one of {', '.join(CATEGORIES)}"}
+            ), 400
+
+        etag = f"{analysis_store.version()}-{request.query_string.decode('utf-8')}"
+        if request.if_none_match.contains(etag):
+            response = make_response("", 304)
+        else:
+            analyses = analysis_store.query(
+                thread_id=request.args.get("thread_id"),
+                category=category,
+                workflow_id=request.args.get("workflow_id"),
+            )
+            response = jsonify({"success": True, "analyses": analyses})
+        response.set_etag(etag)
+        response.headers["Cache-Control"] = "no-cache"
+        return response
+
+    except Exception as e:
+        return jsonify({"success": False, "error": str(e)}), 500
+
+
+@inbox_bp.route("/analysis/<filename>", methods=["GET"])
+def get_analysis(filename):
+    """The analysis of one email file, e.g. email_001.json."""
+    try:
+        analysis = analysis_store.get(filename)
+        if analysis is None:
+            return jsonify({"success": False, "error": f"No analysis for {filename}"}), 404
+
+        return jsonify({"success": True, "filename": filename, "analysis": analysis}), 200
+
+    except Exception as e:
+        return jsonify({"success": False, "error": str(e)}), 500
+
+
+@inbox_bp.route("/analysis/refresh", methods=["POST"])
+def refresh_analysis():
+    """Queue a pipeline run over the inbox; returns 202 with the job (see /api/jobs)."""
+    try:
+        job = job_queue.submit("analyze_inbox", {})
+        response = jsonify({"success": True, "job": job, "last_run": inbox_pipeline.last_run})
+        response.status_code = 202
+        response.headers["Location"] = f"/api/jobs/{job['id']}"
+        return response
+
+    except Exception as e:
+        return jsonify({"success": False, "error": str(e)}), 500
+
+
+def _analyze_inbox(payload):
+    stats = inbox_pipeline.run_once()
+    if stats["failed"] and not stats["analyzed"]:
+        raise RuntimeError(f"Analysis failed for {stats['failed']} email(s)")
+    return stats
+
+
+job_queue.register("analyze_inbox", _analyze_inbox, priority="bulk")
@@ -0,0 +1,578 @@
+"""Background jobs for long-running AI operations.
+
+Submitting a job stores it in a SQLite table and returns its id at once; a small
+pool of worker threads runs queued jobs in priority order (interactive drafts
+ahead of bulk triage), so slow LM responses never hold an HTTP connection open.
+Clients poll GET /api/jobs/<id> or give a callback URL that receives the finished
+job as a JSON POST.
+
+Jobs that fail on a rate limit (HTTP 429 from the provider, or a full route
+queue) are retried with exponential backoff and jitter up to `max_attempts`.
+Queued jobs can be cancelled outright; a running job is marked for cancellation
+and its result discarded when the LM call returns.
+
+The table is shared by every worker process. Claiming a job is a single
+transaction, so each job runs once however many gunicorn workers poll the file.
+A job whose outcome could not be recorded is queued again by its worker. Jobs
+whose worker is gone are queued again too: at startup and then every minute, each
+process requeues running jobs of dead processes on its host and jobs claimed more
+than JOB_STALE_SECONDS ago by any host. A worker records an outcome only while it
+still holds the job's claim, so a requeued job's newer attempt is never overwritten.
+
+Payloads and results hold patient email content: the database file is created
+owner-only (0600), and finished jobs are deleted JOB_RETENTION_SECONDS after they
+finish (default 7 days; 0 keeps them).
+
+Callback URLs must be http(s) and may not resolve to a loopback, private,
+link-local or other non-public address, so a job cannot be made to POST into the
+internal network. JOB_CALLBACK_HOSTS (comma-separated host names) replaces that
+check with an allowlist.
+"""
+
+import ipaddress
+import json
+import os
+import random
+import socket
+import sqlite3
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+from contextlib import contextmanager
+from urllib.parse import urlparse
+
+DEFAULT_DB_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), ".jobs.db")
+
+WORKERS = int(os.getenv("JOB_WORKERS", "4"))
+MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "5"))
+BACKOFF_BASE_SECONDS = float(os.getenv("JOB_BACKOFF_BASE_SECONDS", "2"))
+BACKOFF_MAX_SECONDS = float(os.getenv("JOB_BACKOFF_MAX_SECONDS", "120"))
+STALE_SECONDS = float(os.getenv("JOB_STALE_SECONDS", "1800"))
+RETENTION_SECONDS = float(os.getenv("JOB_RETENTION_SECONDS", str(7 * 86400)))
+POLL_INTERVAL_SECONDS = 1.0
+RECOVER_INTERVAL_SECONDS = 60.0
+CALLBACK_ATTEMPTS = 3
+CALLBACK_TIMEOUT_SECONDS = 10
+CALLBACK_HOSTS = frozenset(
+    host.strip().lower() for host in os.getenv("JOB_CALLBACK_HOSTS", "").split(",") if host.strip()
+)
+
+# Owner-only permissions for the database file
+FILE_MODE = 0o600
+
+# Lower runs first
+PRIORITIES = {"interactive": 0, "normal": 5, "bulk": 10}
+
+STATUSES = ("queued", "running", "succeeded", "failed", "cancelled")
+TERMINAL_STATUSES = ("succeeded", "failed", "cancelled")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    priority INTEGER NOT NULL,
+    status TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    result TEXT,
+    error TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL,
+    run_after REAL NOT NULL,
+    cancel_requested INTEGER NOT NULL DEFAULT 0,
+    callback_url TEXT,
+    callback_status TEXT,
+    locked_by TEXT,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    claimed_at REAL,
+    finished_at REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_queue ON jobs (status, priority, run_after, created_at);
+"""
+
+# A worker's claim on a running job: a requeued job gets a new claim when run again
+_CLAIMED = "id = ? AND status = 'running' AND locked_by IS ? AND claimed_at IS ?"
+
+
+def _claim_of(row):
+    return (row["id"], row["locked_by"], row["claimed_at"])
+
+
+class RetryableJobError(Exception):
+    """Raised by a handler for a failure worth retrying later (e.g. a rate limit)."""
+
+
+def is_rate_limited(error):
+    """Whether `error` is a provider rate limit or an overloaded local route."""
+    from app.lm_loop import RouteBusy
+    from app.rate_limits import RateLimited
+
+    if isinstance(error, (RetryableJobError, RouteBusy, RateLimited)):
+        return True
+    status = getattr(error, "status_code", None)
+    if status is None:
+        status = getattr(getattr(error, "response", None), "status_code", None)
+    return status == 429 or type(error).__name__ == "RateLimitError"
+
+
+def parse_priority(value, default="normal"):
+    """Accept a priority name or an integer (lower runs first)."""
+    if value is None:
+        value = default
+    if isinstance(value, str) and value in PRIORITIES:
+        return PRIORITIES[value]
+    if isinstance(value, bool):
+        raise ValueError("priority must be a name or an integer")
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"priority must be one of {', '.join(PRIORITIES)} or an integer")
+
+
+def check_callback_url(url):
+    """Raise ValueError unless job results may be POSTed to `url` (see module docstring)."""
+    parsed = urlparse(str(url))
+    if parsed.scheme not in ("http", "https") or not parsed.hostname:
+        raise ValueError("'callback_url' must be an http(s) URL")
+    host = parsed.hostname.lower()
+    if CALLBACK_HOSTS:
+        if host not in CALLBACK_HOSTS:
+            raise ValueError(f"'callback_url' host {host} is not allowed")
+        return
+    try:
+        port = parsed.port or (443 if parsed.scheme == "https" else 80)
+        infos = socket.getaddrinfo(host, port, proto=socket.IPPROTO_TCP)
+    except (OSError, ValueError):
+        raise ValueError(f"'callback_url' host {host} cannot be resolved")
+    for info in infos:
+        address = ipaddress.ip_address(info[4][0].split("%", 1)[0])
+        if not address.is_global or address.is_multicast:
+            raise ValueError("'callback_url' must not point to a private or local address")
+
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    """Report redirects as errors: a redirect could lead past check_callback_url."""
+
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+_callback_opener = urllib.request.build_opener(_NoRedirect)
+
+
+def _row_to_job(row, include_payload=False):
+    job = {
+        "id": row["id"],
+        "kind": row["kind"],
+        "status": row["status"],
+        "priority": row["priority"],
+        "attempts": row["attempts"],
+        "max_attempts": row["max_attempts"],
+        "cancel_requested": bool(row["cancel_requested"]),
+        "created_at": row["created_at"],
+        "started_at": row["started_at"],
+        "finished_at": row["finished_at"],
+        "callback_url": row["callback_url"],
+        "callback_status": row["callback_status"],
+    }
+    if row["status"] == "queued" and row["run_after"] > time.time():
+        job["retry_at"] = row["run_after"]
+    if row["result"] is not None:
+        job["result"] = json.loads(row["result"])
+    if row["error"] is not None:
+        job["error"] = row["error"]
+    if include_payload:
+        job["payload"] = json.loads(row["payload"])
+    return job
+
+
+class JobQueue:
+    """SQLite-backed priority queue with a bounded pool of worker threads."""
+
+    def __init__(self, db_path, workers=WORKERS, max_attempts=MAX_ATTEMPTS):
+        self.db_path = db_path
+        self.workers = workers
+        self.max_attempts = max_attempts
+        # kind -> (fn, default priority, required payload fields, prepare)
+        self._handlers = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Condition(self._lock)
+        self._pid = None
+        self._initialized = False
+        self._next_recover = 0.0
+
+    def register(self, kind, fn, priority="normal", required_fields=(), prepare=None):
+        """Run `fn(payload)` for jobs of `kind`; it returns the JSON-serializable result.
+
+        `prepare(payload)`, if given, completes the payload in place at submission
+        (before `required_fields` are checked) and returns an error message if the
+        payload is invalid.
+        """
+        self._handlers[kind] = (fn, parse_priority(priority), tuple(required_fields), prepare)
+
+    @property
+    def kinds(self):
+        return sorted(self._handlers)
+
+    @contextmanager
+    def _connect(self):
+        # Autocommit; _claim opens its own transaction
+        connection = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        connection.row_factory = sqlite3.Row
+        try:
+            yield connection
+        finally:
+            connection.close()
+
+    def _init_db(self):
+        if self._initialized:
+            return
+        directory = os.path.dirname(self.db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # SQLite gives the -wal and -shm files the database file's permissions
+        os.close(os.open(self.db_path, os.O_RDWR | os.O_CREAT, FILE_MODE))
+        os.chmod(self.db_path, FILE_MODE)
+        with self._connect() as connection:
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.executescript(_SCHEMA)
+            columns = {row["name"] for row in connection.execute("PRAGMA table_info(jobs)")}
+            if "claimed_at" not in columns:
+                try:
+                    connection.execute("ALTER TABLE jobs ADD COLUMN claimed_at REAL")
+                except sqlite3.OperationalError:
+                    # Another process added it first
+                    pass
+        self._initialized = True
+
+    def start(self):
+        """Start the worker threads (once per process; restarted after a fork)."""
+        with self._lock:
+            if self._pid == os.getpid() or self.workers <= 0:
+                return
+            self._init_db()
+            self._recover()
+            self._next_recover = time.time() + RECOVER_INTERVAL_SECONDS
+            self._pid = os.getpid()
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._work, name=f"job-worker-{i}", daemon=True)
+                thread.start()
+
+    def _recover(self):
+        """Requeue running jobs that no live worker holds (see the module docstring).
+
+        Jobs that already used their last attempt fail instead, and jobs flagged
+        for cancellation are cancelled. Finished jobs past their retention are deleted.
+        """
+        host = socket.gethostname()
+        now = time.time()
+        with self._connect() as connection:
+            if RETENTION_SECONDS > 0:
+                connection.execute(
+                    "DELETE FROM jobs WHERE status IN ('succeeded', 'failed', 'cancelled') "
+                    "AND finished_at < ?",
+                    (now - RETENTION_SECONDS,),
+                )
+            rows = connection.execute(
+                "SELECT id, locked_by, claimed_at, COALESCE(claimed_at, started_at, 0) AS since "
+                "FROM jobs WHERE status = 'running'"
+            ).fetchall()
+        lost = [
+            _claim_of(row)
+            for row in rows
+            if row["since"] < now - STALE_SECONDS
+            or (
+                (row["locked_by"] or "").startswith(f"{host}:")
+                and not _process_exists(row["locked_by"])
+            )
+        ]
+        self._requeue(lost)
+
+    def _requeue(self, claims):
+        """Queue running jobs again, or fail/cancel them (see _recover).
+
+        `claims` are (id, locked_by, claimed_at) of the claims being given up; a job
+        claimed again since is left alone.
+        """
+        now = time.time()
+        finished = []
+        with self._connect() as connection:
+            for claim in claims:
+                cursor = connection.execute(
+                    "UPDATE jobs SET "
+                    "status = CASE WHEN cancel_requested THEN 'cancelled' "
+                    "WHEN attempts >= max_attempts THEN 'failed' ELSE 'queued' END, "
+                    "error = CASE WHEN cancel_requested THEN 'Cancelled' "
+                    "WHEN attempts >= max_attempts THEN 'Worker lost' ELSE error END, "
+                    "finished_at = CASE WHEN cancel_requested OR attempts >= max_attempts "
+                    "THEN ? END, "
+                    f"run_after = ?, locked_by = NULL WHERE {_CLAIMED}",
+                    (now, now, *claim),
+                )
+                if cursor.rowcount:
+                    finished.append(claim[0])
+        for job_id in finished:
+            job = self.get(job_id)
+            if job is not None and job["status"] in TERMINAL_STATUSES:
+                self._notify_callback(job_id)
+
+    def submit(self, kind, payload, priority=None, callback_url=None, max_attempts=None):
+        """Queue a job and return its description."""
+        if kind not in self._handlers:
+            raise ValueError(f"Unknown job kind '{kind}' (expected one of {', '.join(self.kinds)})")
+        _, default_priority, required_fields, prepare = self._handlers[kind]
+        if not isinstance(payload, dict):
+            raise ValueError("'payload' must be an object")
+        if prepare is not None:
+            error = prepare(payload)
+            if error:
+                raise ValueError(error)
+        missing_fields = [field for field in required_fields if field not in payload]
+        if missing_fields:
+            raise ValueError(f"Missing required fields: {', '.join(missing_fields)}")
+        priority = default_priority if priority is None else parse_priority(priority)
+        if callback_url is not None:
+            check_callback_url(callback_url)
+        self._init_db()
+        now = time.time()
+        job_id = uuid.uuid4().hex
+        with self._connect() as connection:
+            connection.execute(
+                "INSERT INTO jobs (id, kind, priority, status, payload, max_attempts, run_after, "
+                "callback_url, created_at) VALUES (?, ?, ?, 'queued', ?, ?, ?, ?, ?)",
+                (
+                    job_id,
+                    kind,
+                    priority,
+                    json.dumps(payload),
+                    max_attempts or self.max_attempts,
+                    now,
+                    callback_url,
+                    now,
+                ),
+            )
+        with self._wake:
+            self._wake.notify()
+        return self.get(job_id)
+
+    def get(self, job_id, include_payload=False):
+        self._init_db()
+        with self._connect() as connection:
+            row = connection.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return None if row is None else _row_to_job(row, include_payload)
+
+    def list_jobs(self, status=None, kind=None, limit=50):
+        self._init_db()
+        clauses, params = [], []
+        if status:
+            clauses.append("status = ?")
+            params.append(status)
+        if kind:
+            clauses.append("kind = ?")
+            params.append(kind)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        with self._connect() as connection:
+            rows = connection.execute(
+                f"SELECT * FROM jobs {where} ORDER BY created_at DESC LIMIT ?", (*params, limit)
+            ).fetchall()
+        return [_row_to_job(row) for row in rows]
+
+    def stats(self):
+        self._init_db()
+        with self._connect() as connection:
+            rows = connection.execute(
+                "SELECT status, COUNT(*) AS n FROM jobs GROUP BY status"
+            ).fetchall()
+        counts = {status: 0 for status in STATUSES}
+        counts.update({row["status"]: row["n"] for row in rows})
+        return {"workers": self.workers if self._pid == os.getpid() else 0, "jobs": counts}
+
+    def cancel(self, job_id):
+        """Cancel a queued job, or flag a running one. Returns the job, or None if unknown."""
+        self._init_db()
+        now = time.time()
+        with self._connect() as connection:
+            connection.execute(
+                "UPDATE jobs SET status = 'cancelled', finished_at = ?, error = 'Cancelled' "
+                "WHERE id = ? AND status = 'queued'",
+                (now, job_id),
+            )
+            connection.execute(
+                "UPDATE jobs SET cancel_requested = 1 WHERE id = ? AND status = 'running'",
+                (job_id,),
+            )
+        job = self.get(job_id)
+        if job is not None and job["status"] == "cancelled":
+            self._notify_callback(job_id)
+        return job
+
+    def _claim(self):
+        """Atomically move the next runnable job to 'running' and return its row."""
+        worker = f"{socket.gethostname()}:{os.getpid()}"
+        now = time.time()
+        with self._connect() as connection:
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                row = connection.execute(
+                    "SELECT id FROM jobs WHERE status = 'queued' AND run_after <= ? "
+                    "ORDER BY priority, run_after, created_at LIMIT 1",
+                    (now,),
+                ).fetchone()
+                if row is None:
+                    connection.execute("COMMIT")
+                    return None
+                connection.execute(
+                    "UPDATE jobs SET status = 'running', attempts = attempts + 1, locked_by = ?, "
+                    "started_at = COALESCE(started_at, ?), claimed_at = ? WHERE id = ?",
+                    (worker, now, now, row["id"]),
+                )
+                claimed = connection.execute(
+                    "SELECT * FROM jobs WHERE id = ?", (row["id"],)
+                ).fetchone()
+                connection.execute("COMMIT")
+                return claimed
+            except BaseException:
+                connection.execute("ROLLBACK")
+                raise
+
+    def _work(self):
+        while True:
+            try:
+                self._recover_periodically()
+                row = self._claim()
+            except sqlite3.Error:
+                row = None
+            if row is None:
+                with self._wake:
+                    self._wake.wait(POLL_INTERVAL_SECONDS)
+                continue
+            try:
+                self._run(row)
+            except Exception:
+                # Recording the outcome failed (e.g. the database stayed locked)
+                try:
+                    self._requeue([_claim_of(row)])
+                except sqlite3.Error:
+                    # Still 'running'; requeued by _recover once the claim is stale
+                    pass
+
+    def _recover_periodically(self):
+        with self._lock:
+            if time.time() < self._next_recover:
+                return
+            self._next_recover = time.time() + RECOVER_INTERVAL_SECONDS
+        self._recover()
+
+    def _run(self, row):
+        fn = self._handlers.get(row["kind"], (None,))[0]
+        try:
+            if fn is None:
+                raise ValueError(f"No handler for job kind '{row['kind']}'")
+            result = fn(json.loads(row["payload"]))
+        except Exception as e:
+            if is_rate_limited(e) and row["attempts"] < row["max_attempts"]:
+                from app import metrics, programs
+
+                metrics.lm_retries.inc(signature=programs.SIGNATURES.get(row["kind"], row["kind"]))
+                self._retry_later(row, e)
+                return
+            self._finish(row, "failed", error=str(e) or type(e).__name__)
+            return
+        self._finish(row, "succeeded", result=result)
+
+    def _retry_later(self, row, error):
+        attempts = row["attempts"]
+        # Exponential backoff with jitter
+        ceiling = min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * 2 ** (attempts - 1))
+        delay = random.uniform(ceiling / 2, ceiling)
+        # No sooner than the provider asked for
+        delay = max(delay, getattr(error, "retry_after", 0))
+        with self._connect() as connection:
+            cursor = connection.execute(
+                "UPDATE jobs SET "
+                "status = CASE WHEN cancel_requested THEN 'cancelled' ELSE 'queued' END, "
+                "finished_at = CASE WHEN cancel_requested THEN ? END, "
+                f"run_after = ?, error = ?, locked_by = NULL WHERE {_CLAIMED}",
+                (time.time(), time.time() + delay, f"Retrying after: {error}", *_claim_of(row)),
+            )
+        if not cursor.rowcount:
+            # The claim was lost (see _recover); the job belongs to another attempt now
+            return
+        job = self.get(row["id"])
+        if job is not None and job["status"] == "cancelled":
+            self._notify_callback(row["id"])
+
+    def _finish(self, row, status, result=None, error=None):
+        with self._connect() as connection:
+            cursor = connection.execute(
+                "UPDATE jobs SET status = CASE WHEN cancel_requested THEN 'cancelled' ELSE ? END, "
+                "result = CASE WHEN cancel_requested THEN NULL ELSE ? END, "
+                "error = CASE WHEN cancel_requested THEN 'Cancelled' ELSE ? END, "
+                f"finished_at = ?, locked_by = NULL WHERE {_CLAIMED}",
+                (
+                    status,
+                    None if result is None else json.dumps(result),
+                    error,
+                    time.time(),
+                    *_claim_of(row),
+                ),
+            )
+        if cursor.rowcount:
+            self._notify_callback(row["id"])
+
+    def _notify_callback(self, job_id):
+        job = self.get(job_id)
+        if job is None or not job["callback_url"]:
+            return
+        threading.Thread(
+            target=self._post_callback, args=(job,), name="job-callback", daemon=True
+        ).start()
+
+    def _post_callback(self, job):
+        body = json.dumps({"job": job}).encode("utf-8")
+        status = None
+        for attempt in range(CALLBACK_ATTEMPTS):
+            request = urllib.request.Request(
+                job["callback_url"],
+                data=body,
+                headers={"Content-Type": "application/json"},
+                method="POST",
+            )
+            try:
+                # Checked again at delivery, in case the host now resolves elsewhere
+                check_callback_url(job["callback_url"])
+            except ValueError as e:
+                status = f"blocked ({e})"
+                break
+            try:
+                with _callback_opener.open(request, timeout=CALLBACK_TIMEOUT_SECONDS) as response:
+                    status = f"delivered ({response.status})"
+                    break
+            except urllib.error.HTTPError as e:
+                status = f"failed ({e.code})"
+                if e.code < 500 and e.code != 429:
+                    break
+            except (urllib.error.URLError, OSError) as e:
+                status = f"failed ({e})"
+            if attempt + 1 < CALLBACK_ATTEMPTS:
+                time.sleep(BACKOFF_BASE_SECONDS * 2**attempt)
+        with self._connect() as connection:
+            connection.execute(
+                "UPDATE jobs SET callback_status = ? WHERE id = ?", (status, job["id"])
+            )
+
+
+def _process_exists(locked_by):
+    """Whether the process of a "host:pid" lock on this host is still alive."""
+    try:
+        os.kill(int(locked_by.rsplit(":", 1)[1]), 0)
+    except ProcessLookupError:
+        return False
+    except (PermissionError, ValueError):
+        pass
+    return True
+
+
+job_queue = JobQueue(os.getenv("JOBS_DB_PATH", DEFAULT_DB_PATH))
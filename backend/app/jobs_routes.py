@@ -0,0 +1,122 @@
+"""Background job routes: submit, poll, list and cancel (see app.jobs)."""
+
+from flask import Blueprint, jsonify, request
+
+from app.jobs import STATUSES, job_queue
+
+jobs_bp = Blueprint("jobs", __name__, url_prefix="/api/jobs")
+
+
+@jobs_bp.route("", methods=["POST"])
+def submit_job():
+    """Queue a long-running AI operation and return its id immediately.
+
+    Expected JSON payload:
+    {
+        "kind": "draft_email_reply" | "generate_todos" | "categorize_email",
+        "payload": { ...same body as the matching /api/dspy route... },
+        "priority": "interactive" | "normal" | "bulk" | 3,   (optional, lower runs first;
+                    defaults: drafts interactive, todos normal, categorization bulk)
+        "callback_url": "https://example.com/hooks/jobs"       (optional; must be a
+                    public address, or a host in JOB_CALLBACK_HOSTS)
+    }
+
+    Returns 202:
+    {
+        "success": true,
+        "job": {"id": "3f2a...", "kind": "draft_email_reply", "status": "queued", ...}
+    }
+
+    Poll GET /api/jobs/<id> until status is succeeded, failed or cancelled; the
+    result is the body the synchronous route would have returned. If a
+    callback_url is given, the finished job is POSTed to it as {"job": {...}}.
+    """
+    try:
+        data = request.get_json(silent=True)
+
+        if not data:
+            return jsonify({"success": False, "error": "No data provided"}), 400
+
+        missing_fields = [field for field in ("kind", "payload") if field not in data]
+        if missing_fields:
+            return jsonify(
+                {"success": False, "error": f"Missing required fields: {', '.join(missing_fields)}"}
+            ), 400
+
+        try:
+            job = job_queue.submit(
+                data["kind"],
+                data["payload"],
+                priority=data.get("priority"),
+                callback_url=data.get("callback_url"),
+            )
+        except ValueError as e:
+            return jsonify({"success": False, "error": str(e)}), 400
+
+        response = jsonify({"success": True, "job": job})
+        response.status_code = 202
+        response.headers["Location"] = f"/api/jobs/{job['id']}"
+        return response
+
+    except Exception as e:
+        return jsonify({"success": False, "error": str(e)}), 500
+
+
+@jobs_bp.route("", methods=["GET"])
+def list_jobs():
+    """List recent jobs, newest first.
+
+    Query parameters (optional):
+        status - one of queued, running, succeeded, failed, cancelled
+        kind   - job kind
+        limit  - at most this many jobs (default 50, max 500)
+    """
+    try:
+        status = request.args.get("status")
+        if status is not None and status not in STATUSES:
+            return jsonify(
+                {"success": False, "error": f"'status' must be one of {', '.join(STATUSES)}"}
+            ), 400
+
+        try:
+            limit = max(1, min(int(request.args.get("limit", 50)), 500))
+        except ValueError:
+            return jsonify({"success": False, "error": "'limit' must be an integer"}), 400
+
+        jobs = job_queue.list_jobs(status=status, kind=request.args.get("kind"), limit=limit)
+        return jsonify({"success": True, "jobs": jobs, "stats": job_queue.stats()}), 200
+
+    except Exception as e:
+        return jsonify({"success": False, "error": str(e)}), 500
+
+
+@jobs_bp.route("/<job_id>", methods=["GET"])
+def get_job(job_id):
+    """Current state of a job, with its result once it has succeeded."""
+    try:
+        job = job_queue.get(job_id)
+        if job is None:
+            return jsonify({"success": False, "error": f"No job with id {job_id}"}), 404
+
+        response = jsonify({"success": True, "job": job})
+        if job["status"] in ("queued", "running"):
+            # Hint for pollers
+            response.headers["Retry-After"] = "1"
+        return response, 200
+
+    except Exception as e:
+        return jsonify({"success": False, "error": str(e)}), 500
+
+
+@jobs_bp.route("/<job_id>", methods=["DELETE"])
+def cancel_job(job_id):
+    """Cancel a job. Queued jobs stop at once; running jobs discard their result."""
+    try:
+        job = job_queue.cancel(job_id)
+        if job is None:
+            return jsonify({"success": False, "error": f"No job with id {job_id}"}), 404
+
+        return jsonify({"success": True, "job": job}), 200
+
+    except Exception as e:
+        return jsonify({"success": False, "error": str(e)}), 500
@@ -0,0 +1,237 @@
+"""Content-addressed cache for DSPy prediction results.
+
+DSPy's own cache is disabled in dspy_routes.py, so repeated calls with identical
+inputs are cached here instead: an in-process LRU with a TTL, optionally backed by
+one JSON file per entry on disk so results survive restarts.
+
+Cached results are derived from patient email threads, so the disk tier is off
+unless LM_CACHE_DIR names a directory. That directory is created owner-only
+(0700), entries are written 0600, and files older than the TTL are deleted at startup,
+when read, and every 100 writes.
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+# Owner-only permissions for the disk tier
+DIR_MODE = 0o700
+FILE_MODE = 0o600
+
+
+def _normalize(value):
+    """Normalize an input value so cosmetic differences don't change the cache key."""
+    if isinstance(value, str):
+        text = value.replace("\r\n", "\n").strip()
+        if text[:1] in ("{", "["):
+            try:
+                return json.loads(text)
+            except ValueError:
+                pass
+        return text
+    return value
+
+
+class LMCache:
+    """Thread-safe LRU + TTL cache for prediction outputs, with optional disk persistence."""
+
+    def __init__(self, max_entries=1024, ttl_seconds=86400, cache_dir=None, max_disk_entries=10000):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.cache_dir = cache_dir
+        self.max_disk_entries = max_disk_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._writes_since_prune = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        if self.cache_dir:
+            try:
+                os.makedirs(self.cache_dir, mode=DIR_MODE, exist_ok=True)
+                # makedirs leaves an existing directory's mode alone
+                os.chmod(self.cache_dir, DIR_MODE)
+            except OSError:
+                # Read-only or otherwise unusable location: keep the memory tier only
+                self.cache_dir = None
+        if self.cache_dir:
+            # Drop what expired while the process was down
+            self._prune_disk()
+
+    @staticmethod
+    def make_key(signature_name, model, temperature, inputs):
+        """Hash the signature, model settings and normalized inputs into a cache key."""
+        payload = {
+            "signature": signature_name,
+            "model": model,
+            "temperature": temperature,
+            "inputs": {name: _normalize(value) for name, value in inputs.items()},
+        }
+        canonical = json.dumps(payload, sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def _expired(self, created):
+        return self.ttl_seconds is not None and time.time() - created > self.ttl_seconds
+
+    def get(self, key):
+        """Return the cached value for `key`, or None on a miss or expired entry."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                created, value = entry
+                if not self._expired(created):
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+
+        entry = self._read_disk(key)
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+                return None
+            created, value = entry
+            self._store(key, created, value)
+            self.hits += 1
+            self.disk_hits += 1
+            return value
+
+    def set(self, key, value):
+        """Store `value` (a JSON-serializable dict) under `key` in memory and on disk."""
+        created = time.time()
+        with self._lock:
+            self._store(key, created, value)
+        self._write_disk(key, created, value)
+
+    def delete(self, key):
+        """Drop `key` from both tiers, e.g. when a cached output turns out to be unusable."""
+        with self._lock:
+            self._entries.pop(key, None)
+        if self.cache_dir:
+            try:
+                os.remove(self._path(key))
+            except OSError:
+                pass
+
+    def clear(self):
+        """Remove every entry and reset the counters."""
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.disk_hits = self.misses = self.evictions = 0
+        if self.cache_dir:
+            for name in os.listdir(self.cache_dir):
+                if name.endswith(".json"):
+                    try:
+                        os.remove(os.path.join(self.cache_dir, name))
+                    except OSError:
+                        pass
+
+    def stats(self):
+        """Return hit/miss counters and current sizes."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl_seconds,
+                "disk_enabled": self.cache_dir is not None,
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+    def _store(self, key, created, value):
+        # Caller holds the lock
+        self._entries[key] = (created, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def _read_disk(self, key):
+        if not self.cache_dir:
+            return None
+        path = self._path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        if self._expired(entry.get("created", 0)):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            return None
+
+        try:
+            # Touch the file so disk pruning keeps recently used entries
+            os.utime(path)
+        except OSError:
+            pass
+        return entry["created"], entry["value"]
+
+    def _write_disk(self, key, created, value):
+        if not self.cache_dir:
+            return
+        path = self._path(key)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        try:
+            fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, FILE_MODE)
+            with open(fd, "w", encoding="utf-8") as f:
+                json.dump({"created": created, "value": value}, f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+        except (OSError, TypeError, ValueError):
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            return
+
+        self._writes_since_prune += 1
+        if self._writes_since_prune >= 100:
+            self._writes_since_prune = 0
+            self._prune_disk()
+
+    def _prune_disk(self):
+        """Delete expired files, then the least recently used ones beyond the bound."""
+        try:
+            paths = [
+                os.path.join(self.cache_dir, name)
+                for name in os.listdir(self.cache_dir)
+                if name.endswith(".json")
+            ]
+            if self.ttl_seconds is not None:
+                # A file's mtime is never before its entry was created
+                cutoff = time.time() - self.ttl_seconds
+                expired = {path for path in paths if os.path.getmtime(path) < cutoff}
+                for path in expired:
+                    os.remove(path)
+                paths = [path for path in paths if path not in expired]
+            if len(paths) <= self.max_disk_entries:
+                return
+            paths.sort(key=os.path.getmtime)
+            for path in paths[: len(paths) - self.max_disk_entries]:
+                os.remove(path)
+        except OSError:
+            pass
+
+
+lm_cache = LMCache(
+    max_entries=int(os.getenv("LM_CACHE_MAX_ENTRIES", "1024")),
+    ttl_seconds=int(os.getenv("LM_CACHE_TTL_SECONDS", "86400")),
+    # Unset or empty: memory only
+    cache_dir=os.getenv("LM_CACHE_DIR") or None,
+    max_disk_entries=int(os.getenv("LM_CACHE_MAX_DISK_ENTRIES", "10000")),
+)
@@ -0,0 +1,169 @@
+"""Shared asyncio event loop for LM calls.
+
+Flask views are synchronous, but the LM calls they make are mostly waiting on the
+network. Instead of running each blocking call on its own worker thread, views
+hand coroutines (DSPy `acall`, which uses litellm's async client) to one event loop
+running on a background thread, so many in-flight LM requests are multiplexed on
+that loop.
+
+Each route has a concurrency limit (LM calls in flight on the loop) and a queue
+depth (requests allowed to wait for a slot). Requests beyond limit + queue depth
+are rejected up front with RouteBusy, so slow LM routes cannot tie up every server
+thread and starve cheap routes such as /health or /api/data/load. Provider
+rate limits, shared by every route calling a model, are handled in app.rate_limits
+within the request's timeout.
+"""
+
+import asyncio
+import os
+import queue
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+from app import rate_limits
+
+
+def _parse_limits(spec):
+    """Parse "route=limit,route=limit" into a dict."""
+    limits = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        route, _, value = item.partition("=")
+        limits[route.strip()] = int(value)
+    return limits
+
+
+DEFAULT_CONCURRENCY = int(os.getenv("DSPY_CONCURRENCY_DEFAULT", "8"))
+ROUTE_CONCURRENCY = _parse_limits(os.getenv("DSPY_CONCURRENCY_LIMITS", ""))
+QUEUE_DEPTH = int(os.getenv("DSPY_QUEUE_DEPTH", "16"))
+REQUEST_TIMEOUT = float(os.getenv("DSPY_REQUEST_TIMEOUT", "120"))
+
+_STREAM_END = object()
+
+
+class RouteBusy(Exception):
+    """Raised when a route already has as many requests as it can run or queue."""
+
+    def __init__(self, route, retry_after=1):
+        super().__init__(f"Too many concurrent '{route}' requests, retry shortly")
+        self.route = route
+        self.retry_after = retry_after
+
+
+class LMEventLoop:
+    """A background event loop with per-route concurrency limits."""
+
+    def __init__(self, default_limit=DEFAULT_CONCURRENCY, limits=None, queue_depth=QUEUE_DEPTH):
+        self.default_limit = default_limit
+        self.limits = dict(limits or {})
+        self.queue_depth = queue_depth
+        self._loop = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._semaphores = {}
+        self._admitted = defaultdict(int)
+
+    def limit_for(self, route):
+        return self.limits.get(route, self.default_limit)
+
+    def _ensure_loop(self):
+        # Started lazily, and restarted after a fork (e.g. gunicorn workers)
+        with self._lock:
+            if self._loop is not None and self._pid == os.getpid():
+                return self._loop
+            loop = asyncio.new_event_loop()
+            thread = threading.Thread(target=loop.run_forever, name="lm-event-loop", daemon=True)
+            thread.start()
+            self._loop = loop
+            self._pid = os.getpid()
+            self._semaphores = {}
+            return loop
+
+    def _semaphore(self, route):
+        # Only called on the loop thread, so no lock is needed
+        semaphore = self._semaphores.get(route)
+        if semaphore is None:
+            semaphore = self._semaphores[route] = asyncio.Semaphore(self.limit_for(route))
+        return semaphore
+
+    async def _limited(self, route, coro_fn, timeout):
+        # Bounds the provider rate-limit waits and retries of this request's LM calls
+        rate_limits.deadline.set(time.monotonic() + timeout)
+        rate_limits.route.set(route)
+        async with self._semaphore(route):
+            return await coro_fn()
+
+    def admit(self, route):
+        """Admit one request for `route`, raising RouteBusy if its queue is full.
+
+        Every successful admit must be paired with release(route).
+        """
+        with self._lock:
+            if self._admitted[route] >= self.limit_for(route) + self.queue_depth:
+                raise RouteBusy(route)
+            self._admitted[route] += 1
+
+    def release(self, route):
+        with self._lock:
+            self._admitted[route] -= 1
+
+    @contextmanager
+    def admission(self, route):
+        """Context manager form of admit/release."""
+        self.admit(route)
+        try:
+            yield
+        finally:
+            self.release(route)
+
+    def submit(self, route, coro_fn, timeout=REQUEST_TIMEOUT):
+        """Schedule `coro_fn()` on the loop under `route`'s limit; returns a concurrent Future.
+
+        LM calls made by `coro_fn` give up waiting on provider rate limits after `timeout`.
+        """
+        return asyncio.run_coroutine_threadsafe(
+            self._limited(route, coro_fn, timeout), self._ensure_loop()
+        )
+
+    def run(self, route, coro_fn, timeout=REQUEST_TIMEOUT):
+        """Run `coro_fn()` on the loop under `route`'s limit and block for its result."""
+        future = self.submit(route, coro_fn, timeout)
+        try:
+            return future.result(timeout)
+        except BaseException:
+            future.cancel()
+            raise
+
+    def stream(self, route, agen_fn):
+        """Iterate the async generator `agen_fn()` on the loop, yielding items synchronously."""
+        items = queue.Queue()
+
+        async def pump():
+            try:
+                async for item in agen_fn():
+                    items.put(item)
+            except BaseException as e:
+                items.put(e)
+                raise
+            finally:
+                items.put(_STREAM_END)
+
+        future = self.submit(route, pump)
+        try:
+            while True:
+                try:
+                    item = items.get(timeout=REQUEST_TIMEOUT)
+                except queue.Empty:
+                    raise TimeoutError(f"No output from '{route}' within {REQUEST_TIMEOUT}s")
+                if item is _STREAM_END:
+                    break
+                if isinstance(item, BaseException):
+                    raise item
+                yield item
+        finally:
+            # Client disconnected or timed out: stop the producer
+            future.cancel()
+
+
+lm_loop = LMEventLoop(limits=ROUTE_CONCURRENCY)
@@ -0,0 +1,405 @@
+"""Request and LM-call instrumentation, exposed in Prometheus text format.
+
+Each request is timed as a whole and in phases (parsing the payload, building
+the prompt, waiting on the LM...), labelled by route. LM calls are recorded per
+signature and model: latency, outcome, prompt/completion tokens, estimated cost,
+JSON-parse failures of structured outputs and their repairs, retries, cascade
+escalations, and provider rate limits with the time calls waited for capacity.
+GET /metrics renders everything for a Prometheus scrape; with
+METRICS_SERVER_TIMING=1 responses also carry a Server-Timing header with the
+phases of that request, which browser dev tools display directly.
+
+No client library is needed: counters and histograms are kept in process, so
+each gunicorn worker reports its own series.
+"""
+
+import contextvars
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+SERVER_TIMING = os.getenv("METRICS_SERVER_TIMING", "0") == "1"
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+TOKEN_BUCKETS = (100, 250, 500, 1000, 2000, 4000, 8000, 16000, 32000)
+
+
+def _parse_prices(spec):
+    """Parse "model=input:output,..." (USD per million tokens) into a dict."""
+    prices = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        model, _, value = item.rpartition("=")
+        prompt_price, _, completion_price = value.partition(":")
+        prices[model.strip()] = (float(prompt_price), float(completion_price or prompt_price))
+    return prices
+
+
+# USD per million prompt and completion tokens; LM_PRICES adds or overrides models
+MODEL_PRICES = {
+    "gemini/gemini-2.0-flash-lite": (0.075, 0.30),
+    "gemini/gemini-2.0-flash": (0.10, 0.40),
+    "gemini/gemini-2.5-flash-lite": (0.10, 0.40),
+    "gemini/gemini-2.5-flash": (0.30, 2.50),
+    "gemini/gemini-2.5-pro": (1.25, 10.00),
+    **_parse_prices(os.getenv("LM_PRICES", "")),
+}
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    pairs.extend(f'{name}="{_escape(value)}"' for name, value in extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value):
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class Counter:
+    """A monotonically increasing value per label set."""
+
+    kind = "counter"
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def values(self):
+        """{label values: value}."""
+        with self._lock:
+            return dict(self._values)
+
+    def samples(self):
+        for key, value in sorted(self.values().items()):
+            yield self.name, _format_labels(self.labels, key), value
+
+
+class Histogram:
+    """Cumulative bucket counts, sum and count per label set."""
+
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        self._values = {}  # label values -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[i] += 1
+            state[-2] += value
+            state[-1] += 1
+
+    def totals(self):
+        """{label values: (sum, count)}."""
+        with self._lock:
+            return {key: (state[-2], state[-1]) for key, state in self._values.items()}
+
+    def samples(self):
+        with self._lock:
+            values = {key: list(state) for key, state in self._values.items()}
+        for key, state in sorted(values.items()):
+            for bound, count in zip(self.buckets, state):
+                yield f"{self.name}_bucket", _format_labels(
+                    self.labels, key, [("le", _format_value(bound))]
+                ), count
+            yield f"{self.name}_bucket", _format_labels(self.labels, key, [("le", "+Inf")]), state[
+                -1
+            ]
+            yield f"{self.name}_sum", _format_labels(self.labels, key), state[-2]
+            yield f"{self.name}_count", _format_labels(self.labels, key), state[-1]
+
+
+class Registry:
+    """The set of metrics rendered on /metrics."""
+
+    def __init__(self):
+        self._metrics = []
+
+    def counter(self, name, documentation, labels=()):
+        metric = Counter(name, documentation, labels)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name, documentation, labels=(), buckets=LATENCY_BUCKETS):
+        metric = Histogram(name, documentation, labels, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{labels} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+http_requests = registry.counter(
+    "clinbox_http_requests_total",
+    "HTTP requests by route, method and status.",
+    ("route", "method", "status"),
+)
+http_duration = registry.histogram(
+    "clinbox_http_request_duration_seconds",
+    "Time to serve a request, including streamed bodies.",
+    ("route",),
+)
+http_response_bytes = registry.histogram(
+    "clinbox_http_response_bytes",
+    "Response body size (non-streamed responses).",
+    ("route",),
+    SIZE_BUCKETS,
+)
+request_phase = registry.histogram(
+    "clinbox_request_phase_seconds", "Time spent in each phase of a request.", ("route", "phase")
+)
+lm_calls = registry.counter(
+    "clinbox_lm_calls_total",
+    "LM calls by signature, model and outcome (ok, error, timeout, cache_hit, coalesced).",
+    ("signature", "model", "outcome"),
+)
+lm_latency = registry.histogram(
+    "clinbox_lm_call_seconds",
+    "Latency of LM calls, per signature and model.",
+    ("signature", "model"),
+)
+lm_prompt_tokens = registry.histogram(
+    "clinbox_lm_prompt_tokens", "Prompt tokens per LM call.", ("signature", "model"), TOKEN_BUCKETS
+)
+lm_completion_tokens = registry.histogram(
+    "clinbox_lm_completion_tokens",
+    "Completion tokens per LM call.",
+    ("signature", "model"),
+    TOKEN_BUCKETS,
+)
+json_parse_failures = registry.counter(
+    "clinbox_json_parse_failures_total",
+    "Structured LM outputs that were not valid JSON.",
+    ("signature", "field"),
+)
+lm_retries = registry.counter(
+    "clinbox_lm_retries_total", "LM calls repeated after a failure, per signature.", ("signature",)
+)
+output_repairs = registry.counter(
+    "clinbox_output_repairs_total",
+    "Structured output fields fixed after a parse or validation failure, "
+    "by method (local, lm) and result.",
+    ("signature", "field", "method", "result"),
+)
+output_repair_latency = registry.histogram(
+    "clinbox_output_repair_seconds",
+    "Time spent on LM repair calls for structured outputs.",
+    ("signature",),
+)
+lm_rate_limits = registry.counter(
+    "clinbox_lm_rate_limits_total",
+    "Provider 429/overloaded responses, by whether the call was retried or gave up "
+    "(see app.rate_limits).",
+    ("model", "action"),
+)
+lm_throttle_seconds = registry.histogram(
+    "clinbox_lm_throttle_seconds",
+    "Time LM calls waited for rate-limit or concurrency capacity.",
+    ("model",),
+)
+lm_cost = registry.counter(
+    "clinbox_lm_cost_usd_total",
+    "Estimated LM spend from token usage (see LM_PRICES).",
+    ("signature", "model"),
+)
+lm_cascade = registry.counter(
+    "clinbox_lm_cascade_total",
+    "Cheap-model first tries by result (accepted, low_confidence, invalid, error).",
+    ("signature", "result"),
+)
+todo_runs = registry.counter(
+    "clinbox_todo_runs_total",
+    "generate_todos requests by mode (full, delta, unchanged; see app.todo_digests).",
+    ("mode",),
+)
+
+
+class RequestMetrics:
+    """Timings collected for one request, for the histograms and Server-Timing."""
+
+    def __init__(self, route, method):
+        self.route = route
+        self.method = method
+        self.started = time.perf_counter()
+        self.phases = []  # (phase, seconds), in completion order
+        self.finished = False
+
+    def add_phase(self, phase, seconds):
+        self.phases.append((phase, seconds))
+        request_phase.observe(seconds, route=self.route, phase=phase)
+
+    def server_timing(self):
+        totals = {}
+        for phase, seconds in self.phases:
+            totals[phase] = totals.get(phase, 0.0) + seconds
+        entries = [f"{phase};dur={seconds * 1000:.1f}" for phase, seconds in totals.items()]
+        entries.append(f"app;dur={(time.perf_counter() - self.started) * 1000:.1f}")
+        return ", ".join(entries)
+
+
+# The request being served; copied into worker threads with contextvars.copy_context()
+_current = contextvars.ContextVar("request_metrics", default=None)
+
+
+def current():
+    return _current.get()
+
+
+@contextmanager
+def phase(name):
+    """Time a block as phase `name` of the current request (a no-op outside requests)."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        request_metrics = _current.get()
+        if request_metrics is not None:
+            request_metrics.add_phase(name, time.perf_counter() - started)
+
+
+def record_lm_call(signature, seconds, outcome="ok", usage=None, model=""):
+    """Record one LM call. `usage` is DSPy's {model: {"prompt_tokens", "completion_tokens"}}."""
+    lm_calls.inc(signature=signature, model=model, outcome=outcome)
+    if outcome in ("cache_hit", "coalesced"):
+        # Served without an LM call of its own
+        return
+    lm_latency.observe(seconds, signature=signature, model=model)
+    for usage_model, tokens in (usage or {}).items():
+        prompt_tokens = tokens.get("prompt_tokens")
+        completion_tokens = tokens.get("completion_tokens")
+        if prompt_tokens is not None:
+            lm_prompt_tokens.observe(prompt_tokens, signature=signature, model=usage_model)
+        if completion_tokens is not None:
+            lm_completion_tokens.observe(completion_tokens, signature=signature, model=usage_model)
+        price = MODEL_PRICES.get(usage_model)
+        if price is not None:
+            cost = ((prompt_tokens or 0) * price[0] + (completion_tokens or 0) * price[1]) / 1e6
+            lm_cost.inc(cost, signature=signature, model=usage_model)
+
+
+def model_report():
+    """Per-model LM calls, mean latency, tokens and cost, and cascade escalation rates."""
+    report = {}
+
+    def entry(model):
+        return report.setdefault(
+            model,
+            {
+                "calls": 0,
+                "mean_latency_ms": None,
+                "prompt_tokens": 0,
+                "completion_tokens": 0,
+                "cost_usd": 0.0,
+            },
+        )
+
+    for (_, model, outcome), count in lm_calls.values().items():
+        if outcome not in ("cache_hit", "coalesced"):
+            entry(model)["calls"] += count
+    latency = {}
+    for (_, model), (total, count) in lm_latency.totals().items():
+        seconds, calls = latency.get(model, (0.0, 0))
+        latency[model] = (seconds + total, calls + count)
+    for model, (seconds, calls) in latency.items():
+        entry(model)["mean_latency_ms"] = round(seconds / calls * 1000, 1) if calls else None
+    for histogram, field in (
+        (lm_prompt_tokens, "prompt_tokens"),
+        (lm_completion_tokens, "completion_tokens"),
+    ):
+        for (_, model), (total, _) in histogram.totals().items():
+            entry(model)[field] += int(total)
+    for (_, model), cost in lm_cost.values().items():
+        entry(model)["cost_usd"] = round(entry(model)["cost_usd"] + cost, 6)
+
+    cascade = {}
+    for (signature, result), count in lm_cascade.values().items():
+        cascade.setdefault(signature, {"attempts": 0})
+        cascade[signature][result] = count
+        cascade[signature]["attempts"] += count
+    for counts in cascade.values():
+        escalated = counts["attempts"] - counts.get("accepted", 0)
+        counts["escalation_rate"] = round(escalated / counts["attempts"], 4)
+
+    return {"models": report, "cascade": cascade}
+
+
+def init_app(app):
+    """Time every request of `app` and add Server-Timing headers if enabled."""
+    from flask import g, request
+
+    def finish(request_metrics, status):
+        if request_metrics.finished:
+            return
+        request_metrics.finished = True
+        elapsed = time.perf_counter() - request_metrics.started
+        http_duration.observe(elapsed, route=request_metrics.route)
+        http_requests.inc(route=request_metrics.route, method=request_metrics.method, status=status)
+        from app.profiler import profiler
+
+        profiler.end_request()
+
+    @app.before_request
+    def start_request_metrics():
+        route = request.url_rule.rule if request.url_rule is not None else "unmatched"
+        request_metrics = RequestMetrics(route, request.method)
+        g.request_metrics = request_metrics
+        g.request_metrics_token = _current.set(request_metrics)
+        from app.profiler import profiler
+
+        profiler.begin_request(route)
+
+    @app.after_request
+    def finish_request_metrics(response):
+        request_metrics = g.get("request_metrics")
+        if request_metrics is None:
+            return response
+        if SERVER_TIMING:
+            response.headers["Server-Timing"] = request_metrics.server_timing()
+        if not response.is_streamed:
+            http_response_bytes.observe(
+                response.calculate_content_length() or 0, route=request_metrics.route
+            )
+        # Streamed bodies are still being produced; finish once the server closes the response
+        response.call_on_close(lambda: finish(request_metrics, response.status_code))
+        return response
+
+    @app.teardown_request
+    def teardown_request_metrics(error):
+        request_metrics = g.get("request_metrics")
+        if request_metrics is not None and error is not None:
+            finish(request_metrics, 500)
+        token = g.get("request_metrics_token")
+        if token is not None:
+            _current.reset(token)
@@ -0,0 +1,56 @@
+"""Metrics and profiler endpoints."""
+
+from flask import Blueprint, Response, jsonify, request
+
+from app.metrics import registry
+from app.profiler import profiler
+
+metrics_bp = Blueprint("metrics", __name__)
+
+
+@metrics_bp.route("/metrics", methods=["GET"])
+def prometheus_metrics():
+    """Request, phase and LM-call metrics in Prometheus text exposition format."""
+    return Response(registry.render(), mimetype="text/plain; version=0.0.4")
+
+
+@metrics_bp.route("/metrics/profiler", methods=["GET"])
+def profiler_status():
+    """Profiler state, or the sampled stacks with ?format=collapsed."""
+    if request.args.get("format") == "collapsed":
+        return Response(profiler.collapsed(), mimetype="text/plain")
+    return jsonify({"success": True, "profiler": profiler.status()}), 200
+
+
+@metrics_bp.route("/metrics/profiler", methods=["POST"])
+def configure_profiler():
+    """Switch the sampling profiler on or off.
+
+    Expected JSON payload (all optional):
+    {
+        "enabled": true,
+        "interval_ms": 10,    (time between samples)
+        "slow_ms": 250,       (only requests running longer than this are sampled)
+        "reset": true         (discard stacks collected so far)
+    }
+    """
+    data = request.get_json(silent=True) or {}
+
+    try:
+        interval_ms = int(data["interval_ms"]) if "interval_ms" in data else None
+        slow_ms = int(data["slow_ms"]) if "slow_ms" in data else None
+    except (TypeError, ValueError):
+        return (
+            jsonify({"success": False, "error": "'interval_ms' and 'slow_ms' must be integers"}),
+            400,
+        )
+
+    profiler.configure(interval_ms=interval_ms, slow_ms=slow_ms)
+    if data.get("reset"):
+        profiler.reset()
+    if data.get("enabled") is True:
+        profiler.start()
+    elif data.get("enabled") is False:
+        profiler.stop()
+
+    return jsonify({"success": True, "profiler": profiler.status()}), 200
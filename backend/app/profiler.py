@@ -0,0 +1,123 @@
+"""Sampling profiler for slow requests, switchable at runtime.
+
+When enabled, a background thread wakes every `interval_ms` and captures the
+Python stack of each request thread that has been running for longer than
+`slow_ms`. Stacks are counted per route in collapsed form ("route;frame;frame N"),
+which flamegraph.pl and speedscope read directly. Fast requests are never
+sampled, and nothing runs while the profiler is off.
+
+Controlled through /metrics/profiler, or enabled at startup with PROFILER_ENABLED=1.
+"""
+
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+MAX_DEPTH = 64
+
+
+def _frame_label(frame):
+    code = frame.f_code
+    return f"{os.path.basename(code.co_filename)}:{code.co_name}"
+
+
+class SamplingProfiler:
+    """Periodically samples the stacks of in-flight slow requests."""
+
+    def __init__(self, interval_ms=10, slow_ms=250, max_stacks=10000):
+        self.interval_ms = interval_ms
+        self.slow_ms = slow_ms
+        self.max_stacks = max_stacks
+        self._active = {}  # thread ident -> (route, start time)
+        self._stacks = Counter()
+        self._samples = 0
+        self._lock = threading.Lock()
+        self._stop = None
+        self._thread = None
+
+    @property
+    def enabled(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def begin_request(self, route):
+        # Always tracked (a dict write), so enabling mid-request still sees it
+        self._active[threading.get_ident()] = (route, time.perf_counter())
+
+    def end_request(self):
+        self._active.pop(threading.get_ident(), None)
+
+    def configure(self, interval_ms=None, slow_ms=None):
+        # Read by the sampling thread on its next wake-up
+        if interval_ms is not None:
+            self.interval_ms = max(1, int(interval_ms))
+        if slow_ms is not None:
+            self.slow_ms = max(0, int(slow_ms))
+
+    def start(self):
+        with self._lock:
+            if self.enabled:
+                return
+            self._stop = threading.Event()
+            self._thread = threading.Thread(
+                target=self._run, args=(self._stop,), name="sampling-profiler", daemon=True
+            )
+            self._thread.start()
+
+    def stop(self):
+        with self._lock:
+            if self._stop is not None:
+                self._stop.set()
+            self._thread = None
+
+    def reset(self):
+        with self._lock:
+            self._stacks.clear()
+            self._samples = 0
+
+    def _run(self, stop):
+        while not stop.wait(self.interval_ms / 1000):
+            now = time.perf_counter()
+            slow_after = self.slow_ms / 1000
+            frames = sys._current_frames()
+            for ident, (route, started) in list(self._active.items()):
+                frame = frames.get(ident)
+                if frame is None or now - started < slow_after:
+                    continue
+                labels = []
+                while frame is not None and len(labels) < MAX_DEPTH:
+                    labels.append(_frame_label(frame))
+                    frame = frame.f_back
+                stack = ";".join([route] + labels[::-1])
+                with self._lock:
+                    if stack in self._stacks or len(self._stacks) < self.max_stacks:
+                        self._stacks[stack] += 1
+                    self._samples += 1
+            del frames
+
+    def collapsed(self):
+        """Sampled stacks in collapsed format, most frequent first."""
+        with self._lock:
+            stacks = self._stacks.most_common()
+        return "".join(f"{stack} {count}\n" for stack, count in stacks)
+
+    def status(self):
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "interval_ms": self.interval_ms,
+                "slow_ms": self.slow_ms,
+                "samples": self._samples,
+                "distinct_stacks": len(self._stacks),
+                "requests_in_flight": len(self._active),
+            }
+
+
+profiler = SamplingProfiler(
+    interval_ms=int(os.getenv("PROFILER_INTERVAL_MS", "10")),
+    slow_ms=int(os.getenv("PROFILER_SLOW_MS", "250")),
+)
+
+if os.getenv("PROFILER_ENABLED", "0") == "1":
+    profiler.start()
@@ -0,0 +1,235 @@
+"""Shared DSPy programs for the DSPy routes, built once and reused.
+
+Importing dspy (and litellm underneath it) takes seconds, so this module does not
+import it at load time. The LM and one DSPy module per signature (ChainOfThought,
+or Predict for single-step programs) are created on first use, or ahead of time by
+the warm-up thread that create_app starts, and every request reuses them.
+
+The LM is bound to the programs with Module.set_lm rather than through
+dspy.settings.configure, because DSPy only lets the first thread that configures
+it change global settings and the warm-up thread must not claim that role.
+
+Every route uses DSPY_MODEL unless DSPY_MODELS names another model for it
+("route=model,route=model"). With DSPY_CASCADE_MODEL set, categorization first
+runs on that cheaper model and only escalates to the route's model when the
+answer is invalid or below DSPY_CASCADE_MIN_CONFIDENCE (see dspy_routes). Each
+model's client is shared and rate-limited as a whole (app.rate_limits).
+"""
+
+import os
+import threading
+import time
+
+
+def _parse_models(spec):
+    """Parse "route=model,route=model" into a dict."""
+    models = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        route, _, model = item.partition("=")
+        models[route.strip()] = model.strip()
+    return models
+
+
+DEFAULT_MODEL = os.getenv("DSPY_MODEL", "gemini/gemini-2.5-flash-lite")
+ROUTE_MODELS = _parse_models(os.getenv("DSPY_MODELS", ""))
+CASCADE_MODEL = os.getenv("DSPY_CASCADE_MODEL", "")
+CASCADE_MIN_CONFIDENCE = float(os.getenv("DSPY_CASCADE_MIN_CONFIDENCE", "70"))
+
+# Roughly process start: app/__init__.py imports this module before anything else
+_module_loaded_at = time.perf_counter()
+
+# Route-facing program name -> signature class in app.dspy_signatures
+SIGNATURES = {
+    "draft_email_reply": "DraftEmailReply",
+    "categorize_email": "CategorizeEmailThread",
+    "generate_todos": "GenerateTodos",
+    "update_todos": "UpdateTodos",
+    "analyze_email": "AnalyzeEmail",
+    "repair_output": "RepairStructuredOutput",
+}
+
+# Programs that run as a single Predict step rather than ChainOfThought
+SINGLE_STEP = {"repair_output"}
+
+_lock = threading.Lock()
+_lm = None
+_route_lms = {}  # program name -> LM, for routes with their own model
+_cascade_lm = None
+_lm_replaced = False  # set_lm() took over every program; configured models are not created
+_programs = {}
+_error = None
+_timings = {}
+_warm_up_thread = None
+
+
+def _ms(seconds):
+    return round(seconds * 1000, 3)
+
+
+def _client(model):
+    """A dspy.LM for `model` behind its provider rate limits (see app.rate_limits)."""
+    import dspy
+    from app import rate_limits
+
+    # Retries are left to the rate limiter, which knows the request's deadline
+    return rate_limits.rate_limited(dspy.LM(model, temperature=0.0, cache=False, num_retries=0))
+
+
+def _load():
+    """Import dspy, create the LM and build every program. Safe to call repeatedly."""
+    global _lm, _cascade_lm, _programs, _error
+
+    if _programs:
+        return
+
+    with _lock:
+        if _programs:
+            return
+
+        try:
+            started = time.perf_counter()
+
+            # Disable DSPy cache before importing to prevent permissions issues
+            os.environ["DSPY_CACHE_DISABLED"] = "1"
+            os.environ["DSPY_CACHE_TYPE"] = "none"
+
+            from dotenv import load_dotenv
+            import dspy
+            from app import dspy_signatures
+
+            imported = time.perf_counter()
+
+            # Initialize DSPY with your LLM provider
+            load_dotenv("../.env")
+            # Use Gemini 2.5 Flash - API key should be in .env as GEMINI_API_KEY
+            api_key = os.getenv("GEMINI_API_KEY") or os.getenv("GOOGLE_API_KEY")
+            if api_key:
+                # Set GOOGLE_API_KEY for DSPy if it's not already set
+                if not os.getenv("GOOGLE_API_KEY"):
+                    os.environ["GOOGLE_API_KEY"] = api_key
+            if _lm is None:
+                _lm = _client(DEFAULT_MODEL)
+            # One client per distinct model, shared by the routes that use it
+            if not _lm_replaced:
+                lms = {_lm.model: _lm}
+                for route, model in ROUTE_MODELS.items():
+                    if route in SIGNATURES and route not in _route_lms:
+                        if model not in lms:
+                            lms[model] = _client(model)
+                        _route_lms[route] = lms[model]
+                if CASCADE_MODEL and _cascade_lm is None:
+                    _cascade_lm = lms.get(CASCADE_MODEL) or _client(CASCADE_MODEL)
+
+            lm_ready = time.perf_counter()
+
+            programs = {}
+            build_ms = {}
+            for name, signature_name in SIGNATURES.items():
+                build_started = time.perf_counter()
+                module = dspy.Predict if name in SINGLE_STEP else dspy.ChainOfThought
+                programs[name] = module(getattr(dspy_signatures, signature_name))
+                programs[name].set_lm(_route_lms.get(name, _lm))
+                build_ms[name] = _ms(time.perf_counter() - build_started)
+
+            finished = time.perf_counter()
+            _timings.update(
+                {
+                    "import_ms": _ms(imported - started),
+                    "lm_init_ms": _ms(lm_ready - imported),
+                    # What each request used to pay before programs were shared
+                    "program_build_ms": build_ms,
+                    "warm_up_ms": _ms(finished - started),
+                    "ready_since_start_ms": _ms(finished - _module_loaded_at),
+                }
+            )
+            _programs = programs
+            _error = None
+        except Exception as e:
+            _error = str(e)
+            raise
+
+
+def get_lm(name=None):
+    """Return the LM of program `name` (the default LM if None), loading dspy if needed."""
+    _load()
+    return _route_lms.get(name, _lm)
+
+
+def get_cascade_lm():
+    """Return the cheap first-try LM for categorization, or None without a cascade."""
+    _load()
+    return _cascade_lm
+
+
+def set_lm(lm, name=None):
+    """Replace the LM of program `name`, or of every program (e.g. with a local stub for
+    benchmarks). Replacing every program's LM also turns off the cascade; re-enable it
+    with set_cascade_lm."""
+    global _lm, _cascade_lm, _lm_replaced
+    with _lock:
+        if name is None:
+            _lm = lm
+            _route_lms.clear()
+            _cascade_lm = None
+            _lm_replaced = True
+        else:
+            _route_lms[name] = lm
+        for program_name, program in _programs.items():
+            program.set_lm(_route_lms.get(program_name, _lm))
+
+
+def set_cascade_lm(lm):
+    """Use `lm` as the cheap first try for categorization (None disables the cascade)."""
+    global _cascade_lm
+    with _lock:
+        _cascade_lm = lm
+
+
+def models():
+    """Model name per program, and the cascade configuration."""
+    return {
+        "routes": {
+            name: getattr(_route_lms.get(name, _lm), "model", ROUTE_MODELS.get(name, DEFAULT_MODEL))
+            for name in SIGNATURES
+        },
+        "cascade": {
+            "model": getattr(_cascade_lm, "model", CASCADE_MODEL or None),
+            "min_confidence": CASCADE_MIN_CONFIDENCE,
+        },
+    }
+
+
+def get_program(name):
+    """Return the shared DSPy module for `name` (a key of SIGNATURES)."""
+    _load()
+    return _programs[name]
+
+
+def start_warm_up():
+    """Load dspy and build the programs on a background thread (once per process)."""
+    global _warm_up_thread
+
+    def warm_up():
+        try:
+            _load()
+        except Exception:
+            # Recorded in _error and reported by readiness(); requests retry on first use
+            pass
+
+    with _lock:
+        if _warm_up_thread is None and not _programs:
+            _warm_up_thread = threading.Thread(target=warm_up, name="dspy-warm-up", daemon=True)
+            _warm_up_thread.start()
+
+
+def readiness():
+    """Report whether the LM client and programs are built, with cold-start timings."""
+    ready = bool(_programs)
+    status = "ready" if ready else ("failed" if _error else "warming")
+    return {
+        "status": status,
+        "ready": ready,
+        "error": _error,
+        "programs": sorted(_programs),
+        "timings": dict(_timings),
+    }
@@ -0,0 +1,251 @@
+"""Token-budgeted compaction of email threads and documents before they reach the LM.
+
+Long CRO threads repeat themselves: every reply quotes the previous message and
+carries a signature block, and the same message often appears in several threads.
+This module strips that noise, deduplicates messages, and then trims what is left
+to a per-route token budget, keeping the first message (context) and the most
+recent ones (current state). Document raw_text is cut down to the chunks that
+best match the todo / thread.
+
+Token counts are estimated at ~4 characters per token, which is close enough for
+budgeting and needs no tokenizer.
+"""
+
+import hashlib
+import json
+import os
+import re
+
+# Per-route prompt budgets in estimated tokens
+TOKEN_BUDGETS = {
+    "categorize_email": int(os.getenv("PROMPT_BUDGET_CATEGORIZE_EMAIL", "4000")),
+    "draft_email_reply": int(os.getenv("PROMPT_BUDGET_DRAFT_EMAIL_REPLY", "8000")),
+    "generate_todos": int(os.getenv("PROMPT_BUDGET_GENERATE_TODOS", "12000")),
+    "analyze_email": int(os.getenv("PROMPT_BUDGET_ANALYZE_EMAIL", "4000")),
+}
+
+CHARS_PER_TOKEN = 4
+# Size of the raw_text windows scored against the query
+DOCUMENT_CHUNK_CHARS = 800
+
+_QUOTE_HEADER = re.compile(
+    r"^\s*(On .{0,200}wrote:|-{2,}\s*Original Message\s*-{2,}|_{5,}|From: .+\s+Sent: .+)\s*$",
+    re.IGNORECASE,
+)
+_SIGN_OFF = re.compile(
+    r"^\s*(best|kind|warm)?\s*(regards|wishes|thanks|thank you|sincerely|cheers)[,!.]?\s*$",
+    re.IGNORECASE,
+)
+_WORD = re.compile(r"[a-z0-9][a-z0-9\-]+")
+_STOPWORDS = frozenset(
+    "the and for that this with from have will are was were been has had not but you your "
+    "our can all any please thanks regards would could should into about there their".split()
+)
+
+
+def estimate_tokens(value):
+    """Estimate the token count of a string, or of any value as it would be JSON-encoded."""
+    if not isinstance(value, str):
+        value = json.dumps(value, ensure_ascii=False)
+    return (len(value) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def _truncate(text, max_tokens):
+    max_chars = max(0, max_tokens) * CHARS_PER_TOKEN
+    if len(text) <= max_chars:
+        return text
+    return text[: max(0, max_chars - 16)].rstrip() + " [...truncated]"
+
+
+def strip_quoted_reply(text):
+    """Drop quoted earlier messages ("> ..." lines and everything after "On ... wrote:")."""
+    kept = []
+    for line in text.splitlines():
+        if _QUOTE_HEADER.match(line):
+            break
+        if line.lstrip().startswith(">"):
+            continue
+        kept.append(line)
+    return "\n".join(kept).strip()
+
+
+def strip_signature(text):
+    """Drop a trailing signature block ("-- " delimiter or a sign-off near the end)."""
+    lines = text.splitlines()
+    for i, line in enumerate(lines):
+        if line.rstrip() == "--":
+            return "\n".join(lines[:i]).strip()
+    # A sign-off followed only by a few short lines (name, title, phone...)
+    for i in range(len(lines) - 1, max(-1, len(lines) - 8), -1):
+        if _SIGN_OFF.match(lines[i]):
+            if all(len(tail) <= 60 for tail in lines[i + 1 :]):
+                return "\n".join(lines[:i]).strip()
+            break
+    return text.strip()
+
+
+def clean_message_text(text):
+    return strip_signature(strip_quoted_reply(text or ""))
+
+
+def message_digest(message):
+    """Hash of a message's sender and content, ignoring whitespace, case and timestamps."""
+    content = re.sub(r"\s+", " ", message.get("content", "")).strip().lower()
+    return hashlib.sha1(f"{message.get('from', '')}|{content}".encode("utf-8")).hexdigest()
+
+
+def clean_messages(messages, seen=None):
+    """Strip quotes/signatures and drop repeated messages.
+
+    `seen` can be shared across threads so a message copied into several threads is
+    only sent once.
+    """
+    seen = set() if seen is None else seen
+    cleaned = []
+    for message in messages:
+        message = dict(message, content=clean_message_text(message.get("content", "")))
+        digest = message_digest(message)
+        if digest in seen:
+            continue
+        seen.add(digest)
+        cleaned.append(message)
+    return cleaned
+
+
+def fit_messages(messages, budget):
+    """Trim a message list to `budget` tokens.
+
+    Keeps the first message and as many of the most recent ones as fit, replacing
+    the dropped middle with a marker; a message that alone exceeds what is left is
+    truncated.
+    """
+    if estimate_tokens(messages) <= budget or not messages:
+        return messages
+
+    first, rest = messages[0], messages[1:]
+    first = dict(first, content=_truncate(first.get("content", ""), budget // 3))
+    remaining = budget - estimate_tokens(first)
+
+    recent = []
+    for message in reversed(rest):
+        cost = estimate_tokens(message)
+        if cost > remaining:
+            if not recent and remaining > 50:
+                # Always keep some of the latest message
+                content = _truncate(message.get("content", ""), remaining - 30)
+                message = dict(message, content=content)
+                recent.append(message)
+            break
+        recent.append(message)
+        remaining -= cost
+    recent.reverse()
+
+    omitted = len(rest) - len(recent)
+    marker = []
+    if omitted:
+        marker = [
+            {
+                "from": "",
+                "to": "",
+                "timestamp": "",
+                "content": f"[{omitted} earlier messages omitted]",
+            }
+        ]
+    return [first] + marker + recent
+
+
+def compact_thread(thread, budget, seen=None):
+    """Return a copy of `thread` with cleaned messages fitted to `budget` tokens."""
+    messages = clean_messages(thread.get("messages", []), seen)
+    overhead = estimate_tokens({key: value for key, value in thread.items() if key != "messages"})
+    return dict(thread, messages=fit_messages(messages, max(0, budget - overhead)))
+
+
+def compact_threads(threads, budget):
+    """Compact several threads, deduplicating messages across them and sharing `budget`."""
+    seen = set()
+    cleaned = [
+        dict(thread, messages=clean_messages(thread.get("messages", []), seen))
+        for thread in threads
+    ]
+    if not cleaned or estimate_tokens(cleaned) <= budget:
+        return cleaned
+    per_thread = budget // len(cleaned)
+    return [compact_thread(thread, per_thread, seen=set()) for thread in cleaned]
+
+
+def compact_email_text(text, budget):
+    """Compact a pre-formatted thread string: drop quoted lines, then trim the middle."""
+    kept = [
+        line
+        for line in text.splitlines()
+        if not line.lstrip().startswith(">") and not _QUOTE_HEADER.match(line)
+    ]
+    text = "\n".join(kept)
+    if estimate_tokens(text) <= budget:
+        return text
+    # Keep the opening (who/what) and the end (latest messages)
+    max_chars = budget * CHARS_PER_TOKEN
+    head = max_chars // 3
+    tail = max_chars - head - 40
+    return f"{text[:head].rstrip()}\n[... earlier messages omitted ...]\n{text[-tail:].lstrip()}"
+
+
+def _terms(text):
+    return {term for term in _WORD.findall(text.lower()) if term not in _STOPWORDS}
+
+
+def select_relevant_text(raw_text, query_terms, budget):
+    """Keep the `budget` tokens of `raw_text` whose chunks best overlap `query_terms`."""
+    if estimate_tokens(raw_text) <= budget:
+        return raw_text
+
+    chunks = [
+        raw_text[i : i + DOCUMENT_CHUNK_CHARS]
+        for i in range(0, len(raw_text), DOCUMENT_CHUNK_CHARS)
+    ]
+    ranked = sorted(
+        range(len(chunks)),
+        key=lambda i: (-len(_terms(chunks[i]) & query_terms), i),
+    )
+    chosen, used = [], 0
+    for i in ranked:
+        cost = estimate_tokens(chunks[i])
+        if used + cost > budget:
+            continue
+        chosen.append(i)
+        used += cost
+    # Present the selected chunks in document order
+    return " [...] ".join(chunks[i].strip() for i in sorted(chosen))
+
+
+def compact_documents(documents, query, budget):
+    """Trim document raw_text to the parts most relevant to `query`, within `budget`."""
+    if not documents or estimate_tokens(documents) <= budget:
+        return documents
+
+    query_terms = _terms(query)
+    overhead = estimate_tokens(
+        [
+            {k: v for k, v in doc.items() if k != "raw_text"} if isinstance(doc, dict) else doc
+            for doc in documents
+        ]
+    )
+    per_document = max(0, budget - overhead) // len(documents)
+    return [
+        (
+            dict(doc, raw_text=select_relevant_text(doc["raw_text"], query_terms, per_document))
+            if isinstance(doc, dict) and isinstance(doc.get("raw_text"), str)
+            else doc
+        )
+        for doc in documents
+    ]
+
+
+def token_report(route, before, after):
+    """Metadata block comparing estimated prompt tokens before and after compaction."""
+    return {
+        "prompt_tokens_before": sum(estimate_tokens(value) for value in before.values()),
+        "prompt_tokens_after": sum(estimate_tokens(value) for value in after.values()),
+        "token_budget": TOKEN_BUDGETS[route],
+    }
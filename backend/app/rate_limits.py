@@ -0,0 +1,376 @@
+"""Provider rate limits for LM calls.
+
+Every LM the programs use is wrapped in a RateLimitedLM, which sends its calls
+through the ModelLimiter of its model, shared by every route that uses the model:
+
+- Token buckets for requests and tokens per minute (LM_RPM / LM_TPM, or per model
+  in LM_RATE_LIMITS) make calls wait for capacity instead of running into 429s.
+  Tokens are reserved from an estimate of the prompt plus the average completion,
+  and settled against the usage the provider reports.
+- An adaptive (AIMD) concurrency limit, starting at LM_MAX_CONCURRENCY: it grows
+  by one for every limit's worth of successful calls, halves on a 429, and drops
+  by a quarter when a call takes LM_LATENCY_SPIKE_FACTOR times the running average
+  of its route. Routes sharing a model differ widely in prompt and output size, so
+  each keeps its own baseline. Calls over the limit queue in order.
+- 429s and overloaded responses are retried with full-jitter exponential backoff
+  (or the provider's Retry-After), but only while the wait fits in the request's
+  deadline, which app.lm_loop sets from the request timeout.
+
+A call that cannot get capacity or a successful retry in time raises RateLimited.
+The DSPy routes answer it with a 429 and Retry-After, and background jobs
+requeue it, so clients back off instead of retrying into the same limit.
+
+Waits happen on the shared event loop (app.lm_loop). Synchronous LM calls are
+passed straight through.
+"""
+
+import asyncio
+import collections
+import contextvars
+import os
+import random
+import threading
+import time
+
+from app import metrics
+from app.prompt_compaction import estimate_tokens
+
+
+def _parse_rate_limits(spec):
+    """Parse "model=rpm:tpm,model=rpm:tpm" into {model: (rpm, tpm)}."""
+    limits = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        model, _, values = item.rpartition("=")
+        rpm, _, tpm = values.partition(":")
+        limits[model.strip()] = (float(rpm or 0), float(tpm or 0))
+    return limits
+
+
+# 0 means unlimited
+DEFAULT_RPM = float(os.getenv("LM_RPM", "0"))
+DEFAULT_TPM = float(os.getenv("LM_TPM", "0"))
+MODEL_RATE_LIMITS = _parse_rate_limits(os.getenv("LM_RATE_LIMITS", ""))
+MAX_CONCURRENCY = int(os.getenv("LM_MAX_CONCURRENCY", "32"))
+MIN_CONCURRENCY = int(os.getenv("LM_MIN_CONCURRENCY", "1"))
+MAX_RETRIES = int(os.getenv("LM_MAX_RETRIES", "6"))
+RETRY_BASE_SECONDS = float(os.getenv("LM_RETRY_BASE_SECONDS", "0.5"))
+RETRY_MAX_SECONDS = float(os.getenv("LM_RETRY_MAX_SECONDS", "30"))
+LATENCY_SPIKE_FACTOR = float(os.getenv("LM_LATENCY_SPIKE_FACTOR", "3"))
+DEFAULT_TIMEOUT = float(os.getenv("DSPY_REQUEST_TIMEOUT", "120"))
+
+# Calls of a route needed before its latency spikes are judged against its average
+_LATENCY_WARM_UP_CALLS = 10
+_RETRYABLE_STATUSES = (429, 503, 529)
+
+# time.monotonic() by which the current request's LM work must finish
+deadline = contextvars.ContextVar("lm_deadline", default=None)
+# Route (program name) of the current request's LM work, for per-route latency baselines
+route = contextvars.ContextVar("lm_route", default="")
+
+
+class RateLimited(Exception):
+    """The provider's rate limit left no capacity for this call before its deadline."""
+
+    def __init__(self, model, retry_after=1.0, reason="rate limited"):
+        # Whole seconds, as sent in Retry-After
+        retry_after = max(1, int(retry_after + 0.999))
+        super().__init__(f"Model '{model}' is {reason}, retry in {retry_after}s")
+        self.model = model
+        self.retry_after = retry_after
+
+
+def is_retryable(error):
+    """Whether `error` is a provider 429 or an overloaded response worth retrying."""
+    status = getattr(error, "status_code", None)
+    if status is None:
+        status = getattr(getattr(error, "response", None), "status_code", None)
+    return status in _RETRYABLE_STATUSES or type(error).__name__ == "RateLimitError"
+
+
+def _retry_after(error):
+    """Seconds from the provider's Retry-After header, if it sent one."""
+    response = getattr(error, "response", None)
+    try:
+        return float(response.headers["retry-after"])
+    except (AttributeError, KeyError, TypeError, ValueError):
+        return None
+
+
+class TokenBucket:
+    """`per_minute` units refilled continuously.
+
+    Bursts are capped at ten seconds' worth, so no sliding minute (which is how
+    providers count) sees much more than `per_minute`.
+    """
+
+    def __init__(self, per_minute):
+        self.per_minute = per_minute
+        self.capacity = max(1.0, per_minute / 6)
+        self._rate = per_minute / 60
+        self._available = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self._available = min(self.capacity, self._available + (now - self._updated) * self._rate)
+        self._updated = now
+
+    def reserve(self, amount):
+        """Take `amount` now, possibly going into debt; returns seconds until it is covered."""
+        amount = min(amount, self.capacity)
+        with self._lock:
+            self._refill(time.monotonic())
+            self._available -= amount
+            return 0.0 if self._available >= 0 else -self._available / self._rate
+
+    def refund(self, amount):
+        """Give back units (negative `amount` takes more), e.g. to settle an estimate."""
+        with self._lock:
+            self._refill(time.monotonic())
+            self._available = min(self.capacity, self._available + amount)
+
+    @property
+    def available(self):
+        with self._lock:
+            self._refill(time.monotonic())
+            return self._available
+
+
+class AdaptiveConcurrency:
+    """AIMD concurrency limit; waiters are served in order. Used on the event loop only."""
+
+    def __init__(self, maximum=MAX_CONCURRENCY, minimum=MIN_CONCURRENCY):
+        self.maximum = max(1, maximum)
+        self.minimum = max(1, min(minimum, self.maximum))
+        self.limit = float(self.maximum)
+        self.in_flight = 0
+        self._waiters = collections.deque()
+
+    async def acquire(self, timeout):
+        """Wait up to `timeout` seconds for a slot; returns False if none came free."""
+        if self.in_flight < int(self.limit) and not self._waiters:
+            self.in_flight += 1
+            return True
+        if timeout <= 0:
+            return False
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await asyncio.wait_for(waiter, timeout)
+            return True
+        except asyncio.TimeoutError:
+            # Granted in the same iteration as the timeout
+            return waiter.done() and not waiter.cancelled()
+        except BaseException:
+            if waiter.done() and not waiter.cancelled():
+                # Granted just as the caller was cancelled
+                self.release()
+            raise
+        finally:
+            if not waiter.done() or waiter.cancelled():
+                try:
+                    self._waiters.remove(waiter)
+                except ValueError:
+                    pass
+
+    def release(self):
+        self.in_flight -= 1
+        self._wake()
+
+    def _wake(self):
+        while self._waiters and self.in_flight < int(self.limit):
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                self.in_flight += 1
+                waiter.set_result(None)
+
+    def increase(self):
+        """Additive increase: one more slot per `limit` successful calls."""
+        self.limit = min(self.maximum, self.limit + 1 / self.limit)
+        self._wake()
+
+    def decrease(self, factor):
+        self.limit = max(self.minimum, self.limit * factor)
+
+
+class ModelLimiter:
+    """Request/token buckets, adaptive concurrency and retries for one model."""
+
+    def __init__(self, model, rpm=0, tpm=0, max_concurrency=MAX_CONCURRENCY):
+        self.model = model
+        self.requests = TokenBucket(rpm) if rpm else None
+        self.tokens = TokenBucket(tpm) if tpm else None
+        self.concurrency = AdaptiveConcurrency(max_concurrency)
+        self.latency = None  # running average of successful calls, seconds
+        self.route_latency = {}  # route -> (running average, successful calls)
+        self.completion_tokens = 256.0  # running average, added to prompt estimates
+        self._last_decrease = 0.0
+        self.stats = collections.Counter()
+
+    def _decrease(self, factor, reason):
+        # At most once per typical call duration, so one burst of errors or slow
+        # responses counts as a single congestion signal
+        now = time.monotonic()
+        if now - self._last_decrease < (self.latency or 1.0):
+            return
+        self._last_decrease = now
+        self.concurrency.decrease(factor)
+        self.stats[f"decreased_{reason}"] += 1
+
+    def _on_success(self, seconds, usage, reserved, call_route=""):
+        average, calls = self.route_latency.get(call_route, (seconds, 0))
+        if calls >= _LATENCY_WARM_UP_CALLS and seconds > LATENCY_SPIKE_FACTOR * average:
+            self._decrease(0.75, "latency")
+        self.route_latency[call_route] = (0.9 * average + 0.1 * seconds, calls + 1)
+        self.latency = seconds if self.latency is None else 0.9 * self.latency + 0.1 * seconds
+        self.concurrency.increase()
+
+        completion = usage.get("completion_tokens")
+        total = usage.get("total_tokens")
+        if completion:
+            self.completion_tokens = 0.9 * self.completion_tokens + 0.1 * completion
+        if self.tokens is not None and total:
+            self.tokens.refund(reserved - total)
+
+    async def _wait_for_capacity(self, tokens, until):
+        """Reserve a request and `tokens`, then take a concurrency slot, before `until`."""
+        waits = []
+        if self.requests is not None:
+            waits.append((self.requests, 1, self.requests.reserve(1)))
+        if self.tokens is not None:
+            waits.append((self.tokens, tokens, self.tokens.reserve(tokens)))
+        wait = max((seconds for _, _, seconds in waits), default=0.0)
+        if time.monotonic() + wait > until:
+            for bucket, amount, _ in waits:
+                bucket.refund(amount)
+            self.stats["rejected"] += 1
+            raise RateLimited(self.model, wait, "at its requests/tokens per minute limit")
+        if wait:
+            self.stats["throttled"] += 1
+            metrics.lm_throttle_seconds.observe(wait, model=self.model)
+            await asyncio.sleep(wait)
+
+        started = time.monotonic()
+        if not await self.concurrency.acquire(until - started):
+            self.stats["rejected"] += 1
+            raise RateLimited(self.model, self.latency or 1.0, "at its concurrency limit")
+        if time.monotonic() - started > 0.001:
+            metrics.lm_throttle_seconds.observe(time.monotonic() - started, model=self.model)
+
+    async def call(self, fn, prompt_tokens):
+        """Await `fn()` (one provider call) within the limits, retrying 429s until the deadline."""
+        until = deadline.get() or time.monotonic() + DEFAULT_TIMEOUT
+        attempt = 0
+        while True:
+            reserved = int(prompt_tokens + self.completion_tokens)
+            await self._wait_for_capacity(reserved, until)
+            started = time.monotonic()
+            try:
+                response = await fn()
+            except Exception as e:
+                self.concurrency.release()
+                if not is_retryable(e):
+                    raise
+                if self.tokens is not None:
+                    # A rejected call used no tokens
+                    self.tokens.refund(reserved)
+                attempt += 1
+                self.stats["rate_limited"] += 1
+                self._decrease(0.5, "rate_limit")
+                delay = _retry_after(e)
+                if delay is None:
+                    cap = min(RETRY_MAX_SECONDS, RETRY_BASE_SECONDS * 2 ** (attempt - 1))
+                    delay = random.uniform(0, cap)
+                if attempt > MAX_RETRIES or time.monotonic() + delay > until:
+                    metrics.lm_rate_limits.inc(model=self.model, action="gave_up")
+                    raise RateLimited(self.model, delay) from e
+                metrics.lm_rate_limits.inc(model=self.model, action="retried")
+                await asyncio.sleep(delay)
+                continue
+
+            self.concurrency.release()
+            usage = dict(getattr(response, "usage", None) or {})
+            self._on_success(time.monotonic() - started, usage, reserved, route.get())
+            return response
+
+    def snapshot(self):
+        return {
+            "concurrency_limit": round(self.concurrency.limit, 2),
+            "in_flight": self.concurrency.in_flight,
+            "queued": len(self.concurrency._waiters),
+            "rpm": self.requests.per_minute if self.requests else None,
+            "tpm": self.tokens.per_minute if self.tokens else None,
+            "tokens_available": round(self.tokens.available) if self.tokens else None,
+            "average_latency_ms": round(self.latency * 1000, 1) if self.latency else None,
+            "average_latency_ms_by_route": {
+                name or "unknown": round(average * 1000, 1)
+                for name, (average, _) in sorted(self.route_latency.items())
+            },
+            **self.stats,
+        }
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def limiter_for(model):
+    """The process-wide limiter of `model`, created with its configured limits."""
+    with _limiters_lock:
+        limiter = _limiters.get(model)
+        if limiter is None:
+            rpm, tpm = MODEL_RATE_LIMITS.get(model, (DEFAULT_RPM, DEFAULT_TPM))
+            limiter = _limiters[model] = ModelLimiter(model, rpm=rpm, tpm=tpm)
+        return limiter
+
+
+def snapshot():
+    """{model: limiter state} for every model called so far."""
+    with _limiters_lock:
+        limiters = dict(_limiters)
+    return {model: limiter.snapshot() for model, limiter in limiters.items()}
+
+
+_lm_class = None
+
+
+def rate_limited(lm, limiter=None):
+    """Wrap the DSPy LM `lm` so its async calls go through limiter_for(lm.model).
+
+    A given `limiter` becomes the model's shared limiter instead.
+    """
+    global _lm_class
+    if _lm_class is None:
+        # Deferred: importing dspy is slow (see app.programs)
+        import dspy
+
+        class RateLimitedLM(dspy.BaseLM):
+            def __init__(self, lm, limiter):
+                super().__init__(model=lm.model, model_type=lm.model_type, cache=False)
+                # Shared, so cache keys and per-call overrides see the wrapped LM's settings
+                self.kwargs = lm.kwargs
+                self.lm = lm
+                self.limiter = limiter
+
+            def forward(self, prompt=None, messages=None, **kwargs):
+                return self.lm.forward(prompt=prompt, messages=messages, **kwargs)
+
+            async def aforward(self, prompt=None, messages=None, **kwargs):
+                prompt_tokens = estimate_tokens(messages if messages is not None else prompt or "")
+                return await self.limiter.call(
+                    lambda: self.lm.aforward(prompt=prompt, messages=messages, **kwargs),
+                    prompt_tokens,
+                )
+
+            def __getattr__(self, name):
+                # Anything else (e.g. provider, num_retries) comes from the wrapped LM
+                lm = self.__dict__.get("lm")
+                if lm is None:
+                    raise AttributeError(name)
+                return getattr(lm, name)
+
+        _lm_class = RateLimitedLM
+    if limiter is not None:
+        with _limiters_lock:
+            _limiters[lm.model] = limiter
+    return _lm_class(lm, limiter or limiter_for(lm.model))
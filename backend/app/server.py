@@ -0,0 +1,56 @@
+"""Production server entry point.
+
+Runs the app under gunicorn with threaded (gthread) workers instead of the Flask
+debug server. Request threads that wait on LM calls only block on a future while
+the calls themselves run on the shared event loop (app.lm_loop), so a modest
+thread pool per worker serves many concurrent drafts, and per-route admission
+limits keep threads free for cheap routes.
+
+    python -m app.server
+
+Configured through environment variables:
+    HOST / PORT           bind address (default 0.0.0.0:5001)
+    WEB_CONCURRENCY       worker processes (default 2)
+    GUNICORN_THREADS      threads per worker (default 32)
+    GUNICORN_TIMEOUT      worker timeout in seconds (default 180)
+"""
+
+import os
+
+from gunicorn.app.base import BaseApplication
+
+
+class ProductionServer(BaseApplication):
+    """Embed gunicorn so the app factory runs inside each worker process."""
+
+    def __init__(self, options):
+        self.options = options
+        super().__init__()
+
+    def load_config(self):
+        for key, value in self.options.items():
+            self.cfg.set(key, value)
+
+    def load(self):
+        # Build the app after fork so warm-up and event-loop threads live in the worker
+        from app import create_app
+
+        app = create_app()
+        app.config["DEBUG"] = False
+        return app
+
+
+def main():
+    options = {
+        "bind": f"{os.getenv('HOST', '0.0.0.0')}:{os.getenv('PORT', '5001')}",
+        "workers": int(os.getenv("WEB_CONCURRENCY", "2")),
+        "worker_class": "gthread",
+        "threads": int(os.getenv("GUNICORN_THREADS", "32")),
+        "timeout": int(os.getenv("GUNICORN_TIMEOUT", "180")),
+        "accesslog": "-",
+    }
+    ProductionServer(options).run()
+
+
+if __name__ == "__main__":
+    main()
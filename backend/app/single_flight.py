@@ -0,0 +1,71 @@
+"""Single-flight coalescing of identical concurrent LM calls.
+
+When several users open the same thread, the frontend sends identical requests
+within moments of each other. The first request for a key runs the call; any
+identical request that arrives while it is in flight waits for that call and
+gets the same result (or exception) instead of starting its own. Nothing is kept
+once the call finishes; repeated calls after that are lm_cache's job.
+"""
+
+import threading
+from collections import defaultdict
+from concurrent.futures import Future
+
+
+class SingleFlight:
+    """Share one in-flight call among concurrent callers with the same key."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._in_flight = {}  # key -> Future
+        self._counts = defaultdict(lambda: {"calls": 0, "coalesced": 0})
+
+    def do(self, key, fn, label="", timeout=None):
+        """Run `fn()` for `key`, or wait for the identical call already running.
+
+        Returns (result, shared) where shared is True if another caller ran it.
+        Waiting callers raise whatever the running call raised, or TimeoutError
+        after `timeout` seconds.
+        """
+        with self._lock:
+            future = self._in_flight.get(key)
+            leader = future is None
+            if leader:
+                future = self._in_flight[key] = Future()
+                self._counts[label]["calls"] += 1
+            else:
+                self._counts[label]["coalesced"] += 1
+
+        if not leader:
+            return future.result(timeout), True
+
+        try:
+            result = fn()
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result, False
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+
+    def stats(self):
+        with self._lock:
+            by_label = {label: dict(counts) for label, counts in self._counts.items()}
+            in_flight = len(self._in_flight)
+        calls = sum(counts["calls"] for counts in by_label.values())
+        coalesced = sum(counts["coalesced"] for counts in by_label.values())
+        return {
+            "in_flight": in_flight,
+            "calls": calls,
+            "coalesced": coalesced,
+            "coalesced_ratio": (
+                round(coalesced / (calls + coalesced), 4) if calls + coalesced else 0.0
+            ),
+            "by_signature": by_label,
+        }
+
+
+lm_single_flight = SingleFlight()
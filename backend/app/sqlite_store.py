@@ -0,0 +1,442 @@
+"""SQLite storage for the problems/threads document.
+
+A drop-in alternative to data_store.JsonDocumentStore. Problems and threads are
+rows keyed by id, with their status and urgency in indexed columns, and thread
+messages live in their own table. Every write (a whole-document save or a
+patch) is one transaction that also bumps a version counter, which is what
+loads and ETags compare against. The database runs in WAL mode, so readers in
+any worker process see a consistent snapshot while another process writes, and
+writers queue on SQLite's lock instead of racing on a file.
+
+Like the JSON store, the assembled document is cached in memory and rebuilt
+only when the version counter moves; single records are read straight from the
+table when the cache is stale. Backups go through SQLite's online backup API.
+
+    python -m app.sqlite_store import src/data/coms.json   # migrate a coms.json
+    python -m app.sqlite_store export coms.json            # write it back out
+    python -m app.sqlite_store backup
+"""
+
+import datetime
+import json
+import os
+import sqlite3
+import threading
+import uuid
+from contextlib import contextmanager
+
+from app.data_store import COLLECTIONS, _build_index, apply_patch, validate_document
+
+_REPO_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+DEFAULT_DB_PATH = os.path.join(_REPO_ROOT, "src", "data", "coms.db")
+
+# Record fields copied into indexed columns
+INDEXED_FIELDS = ("status", "urgency")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS problems (
+    id TEXT PRIMARY KEY,
+    position INTEGER NOT NULL,
+    status TEXT,
+    urgency TEXT,
+    data TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS threads (
+    id TEXT PRIMARY KEY,
+    position INTEGER NOT NULL,
+    status TEXT,
+    urgency TEXT,
+    message_count INTEGER,
+    data TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS messages (
+    thread_id TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    data TEXT NOT NULL,
+    PRIMARY KEY (thread_id, position)
+);
+CREATE INDEX IF NOT EXISTS problems_position ON problems (position);
+CREATE INDEX IF NOT EXISTS problems_status ON problems (status);
+CREATE INDEX IF NOT EXISTS problems_urgency ON problems (urgency);
+CREATE INDEX IF NOT EXISTS threads_position ON threads (position);
+CREATE INDEX IF NOT EXISTS threads_status ON threads (status);
+CREATE INDEX IF NOT EXISTS threads_urgency ON threads (urgency);
+"""
+
+
+def _indexed_value(record, field):
+    value = record.get(field)
+    return None if value is None else str(value)
+
+
+class SqliteDocumentStore:
+    """Problems, threads and messages in SQLite tables, versioned per write."""
+
+    def __init__(self, db_path, seed_path=None):
+        self.db_path = db_path
+        # coms.json imported when the database is first created and still empty
+        self.seed_path = seed_path
+        self._initialized = False
+        self._init_lock = threading.Lock()
+        # (version, document, id index) of the last full load or local write
+        self._cached = None
+
+    @contextmanager
+    def _connect(self):
+        if not self._initialized:
+            os.makedirs(os.path.dirname(os.path.abspath(self.db_path)), exist_ok=True)
+        # Autocommit; writes open their own BEGIN IMMEDIATE transaction
+        connection = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        connection.row_factory = sqlite3.Row
+        try:
+            if not self._initialized:
+                self._init_db(connection)
+            yield connection
+        finally:
+            connection.close()
+
+    def _init_db(self, connection):
+        with self._init_lock:
+            if self._initialized:
+                return
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.executescript(_SCHEMA)
+            # The epoch keeps versions of a recreated database from matching old ETags
+            connection.execute(
+                "INSERT OR IGNORE INTO meta (key, value) VALUES ('epoch', ?)",
+                (uuid.uuid4().hex[:8],),
+            )
+            connection.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('version', '0')")
+            if self.seed_path and os.path.exists(self.seed_path):
+                self._seed(connection)
+            self._initialized = True
+
+    def _seed(self, connection):
+        with open(self.seed_path, "r", encoding="utf-8") as f:
+            document = json.load(f)
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            # Skipped if anything was ever written, e.g. another worker seeded it first
+            if self._read_version(connection).endswith("-0"):
+                self._replace(connection, document)
+                self._bump_version(connection)
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+
+    @contextmanager
+    def _write(self, connection):
+        """Run a write transaction on `connection` that bumps the version.
+
+        Yields (version before, version after).
+        """
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            version_before = self._read_version(connection)
+            self._bump_version(connection)
+            yield version_before, self._read_version(connection)
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+
+    @staticmethod
+    def _bump_version(connection):
+        connection.execute(
+            "UPDATE meta SET value = CAST(value AS INTEGER) + 1 WHERE key = 'version'"
+        )
+
+    @staticmethod
+    def _read_version(connection):
+        rows = connection.execute(
+            "SELECT key, value FROM meta WHERE key IN ('epoch', 'version')"
+        ).fetchall()
+        values = {row["key"]: row["value"] for row in rows}
+        return f"{values['epoch']}-{values['version']}"
+
+    def exists(self):
+        if not os.path.exists(self.db_path):
+            return False
+        with self._connect() as connection:
+            return any(
+                connection.execute(f"SELECT 1 FROM {collection} LIMIT 1").fetchone()
+                for collection in COLLECTIONS
+            )
+
+    def load(self):
+        """Return the current document. It is shared with the cache and must not be mutated."""
+        return self.load_versioned()[0]
+
+    def load_versioned(self):
+        """Return (document, version); the version changes whenever the data does."""
+        with self._connect() as connection:
+            # One read transaction so the document matches its version
+            connection.execute("BEGIN")
+            try:
+                version = self._read_version(connection)
+                cached = self._cached
+                if cached is not None and cached[0] == version:
+                    return cached[1], version
+                document = self._read_document(connection)
+            finally:
+                connection.execute("COMMIT")
+        self._cached = (version, document, _build_index(document))
+        return document, version
+
+    def get_record(self, collection, record_id):
+        """Return (record or None, version) for one problem or thread by id."""
+        with self._connect() as connection:
+            connection.execute("BEGIN")
+            try:
+                version = self._read_version(connection)
+                cached = self._cached
+                if cached is not None and cached[0] == version:
+                    return cached[2][collection].get(str(record_id)), version
+                rows = self._select(connection, collection, "WHERE id = ?", (str(record_id),))
+            finally:
+                connection.execute("COMMIT")
+        return (rows[0] if rows else None), version
+
+    def query(self, collection, status=None, urgency=None):
+        """Return (records, version): the records of `collection` matching every given filter."""
+        clauses, params = [], []
+        for column, value in (("status", status), ("urgency", urgency)):
+            if value is not None:
+                clauses.append(f"{column} = ?")
+                params.append(str(value))
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        with self._connect() as connection:
+            connection.execute("BEGIN")
+            try:
+                version = self._read_version(connection)
+                records = self._select(connection, collection, where, params)
+            finally:
+                connection.execute("COMMIT")
+        return records, version
+
+    def save(self, document):
+        """Replace the whole document in one transaction.
+
+        Raises ValueError if a problem or thread has no id.
+        """
+        error = validate_document(document)
+        if error:
+            raise ValueError(error)
+        with self._connect() as connection:
+            with self._write(connection) as (_, version):
+                self._replace(connection, document)
+        self._cached = (version, document, _build_index(document))
+
+    def patch(self, patch):
+        """Apply a patch (see data_store.apply_patch) in one transaction.
+
+        Changes are written directly, so nothing is left pending and this returns 0.
+        """
+        deleted = patch.get("deleted", {})
+        with self._connect() as connection, self._write(connection) as (version_before, version):
+            for collection in COLLECTIONS:
+                removed = [str(record_id) for record_id in deleted.get(collection, [])]
+                self._delete(connection, collection, removed)
+                changed = patch.get(collection, [])
+                if changed:
+                    row = connection.execute(
+                        f"SELECT COALESCE(MAX(position), -1) + 1 AS next FROM {collection}"
+                    ).fetchone()
+                    self._upsert(connection, collection, changed, row["next"])
+
+        # Fold the patch into the cached copy rather than re-reading the tables
+        cached = self._cached
+        if cached is not None and cached[0] == version_before:
+            # Copy the lists so readers holding the previous document are unaffected
+            document = {
+                key: list(value) if isinstance(value, list) else value
+                for key, value in cached[1].items()
+            }
+            apply_patch(document, patch)
+            self._cached = (version, document, _build_index(document))
+        return 0
+
+    def compact(self):
+        """Checkpoint the WAL into the database file."""
+        with self._connect() as connection:
+            connection.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+    def backup(self, backup_path=None):
+        """Copy the database with the online backup API and return the copy's path.
+
+        Writers in other processes are not blocked while the copy is taken.
+        """
+        if backup_path is None:
+            timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+            base, ext = os.path.splitext(self.db_path)
+            backup_path = f"{base}_backup_{timestamp}{ext}"
+        target = sqlite3.connect(backup_path)
+        try:
+            with self._connect() as connection:
+                connection.backup(target)
+        finally:
+            target.close()
+        return backup_path
+
+    def import_json(self, path):
+        """Replace the contents with a coms.json document; returns the record counts."""
+        with open(path, "r", encoding="utf-8") as f:
+            document = json.load(f)
+        error = validate_document(document)
+        if error:
+            raise ValueError(f"{error} (in {path})")
+        self.save(document)
+        return {collection: len(document.get(collection, [])) for collection in COLLECTIONS}
+
+    def export_json(self, path):
+        """Write the document as coms.json (write to a temp file, then rename)."""
+        from app.data_store import JsonDocumentStore
+
+        JsonDocumentStore._atomic_write(path, self.load())
+
+    def _replace(self, connection, document):
+        for table in ("problems", "threads", "messages"):
+            connection.execute(f"DELETE FROM {table}")
+        for collection in COLLECTIONS:
+            self._upsert(connection, collection, document.get(collection, []), 0)
+
+    def _read_document(self, connection):
+        return {collection: self._select(connection, collection) for collection in COLLECTIONS}
+
+    def _select(self, connection, collection, where="", params=()):
+        if collection == "problems":
+            rows = connection.execute(
+                f"SELECT data FROM problems {where} ORDER BY position", params
+            ).fetchall()
+            return [json.loads(row["data"]) for row in rows]
+
+        rows = connection.execute(
+            f"SELECT id, message_count, data FROM threads {where} ORDER BY position", params
+        ).fetchall()
+        with_messages = [row["id"] for row in rows if row["message_count"] is not None]
+        messages = {thread_id: [] for thread_id in with_messages}
+        if not where:
+            message_rows = connection.execute(
+                "SELECT thread_id, data FROM messages ORDER BY thread_id, position"
+            ).fetchall()
+        else:
+            message_rows = []
+            # Stay under SQLite's bound-parameter limit
+            for start in range(0, len(with_messages), 500):
+                chunk = with_messages[start : start + 500]
+                message_rows.extend(
+                    connection.execute(
+                        f"SELECT thread_id, data FROM messages WHERE thread_id IN "
+                        f"({', '.join('?' * len(chunk))}) ORDER BY thread_id, position",
+                        chunk,
+                    ).fetchall()
+                )
+        for row in message_rows:
+            if row["thread_id"] in messages:
+                messages[row["thread_id"]].append(json.loads(row["data"]))
+
+        threads = []
+        for row in rows:
+            thread = json.loads(row["data"])
+            if row["message_count"] is not None:
+                thread["messages"] = messages[row["id"]]
+            threads.append(thread)
+        return threads
+
+    def _delete(self, connection, collection, record_ids):
+        if not record_ids:
+            return
+        params = [(record_id,) for record_id in record_ids]
+        connection.executemany(f"DELETE FROM {collection} WHERE id = ?", params)
+        if collection == "threads":
+            connection.executemany("DELETE FROM messages WHERE thread_id = ?", params)
+
+    def _upsert(self, connection, collection, records, next_position):
+        """Insert or replace records by id; existing ids keep their position."""
+        existing = {}
+        if next_position:
+            ids = [str(record["id"]) for record in records]
+            for start in range(0, len(ids), 500):
+                chunk = ids[start : start + 500]
+                existing.update(
+                    (row["id"], row["position"])
+                    for row in connection.execute(
+                        f"SELECT id, position FROM {collection} WHERE id IN "
+                        f"({', '.join('?' * len(chunk))})",
+                        chunk,
+                    )
+                )
+
+        rows, message_rows = [], []
+        for record in records:
+            record_id = str(record["id"])
+            position = existing.get(record_id)
+            if position is None:
+                position = existing[record_id] = next_position
+                next_position += 1
+            row = [record_id, position] + [_indexed_value(record, f) for f in INDEXED_FIELDS]
+            if collection == "threads":
+                messages = record.get("messages")
+                if isinstance(messages, list):
+                    record = {key: value for key, value in record.items() if key != "messages"}
+                    message_rows.extend(
+                        (record_id, index, json.dumps(message, ensure_ascii=False))
+                        for index, message in enumerate(messages)
+                    )
+                    row.append(len(messages))
+                else:
+                    row.append(None)
+            row.append(json.dumps(record, ensure_ascii=False))
+            rows.append(row)
+
+        columns = ["id", "position", *INDEXED_FIELDS]
+        if collection == "threads":
+            columns.append("message_count")
+            connection.executemany(
+                "DELETE FROM messages WHERE thread_id = ?", [(row[0],) for row in rows]
+            )
+            connection.executemany(
+                "INSERT INTO messages (thread_id, position, data) VALUES (?, ?, ?)", message_rows
+            )
+        columns.append("data")
+        connection.executemany(
+            f"INSERT OR REPLACE INTO {collection} ({', '.join(columns)}) "
+            f"VALUES ({', '.join('?' * len(columns))})",
+            rows,
+        )
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Manage the SQLite problems/threads database.")
+    parser.add_argument("--db", default=os.getenv("DATA_DB_PATH", DEFAULT_DB_PATH))
+    commands = parser.add_subparsers(dest="command", required=True)
+    import_parser = commands.add_parser("import", help="replace the database with a coms.json")
+    import_parser.add_argument("path")
+    export_parser = commands.add_parser("export", help="write the database out as coms.json")
+    export_parser.add_argument("path")
+    backup_parser = commands.add_parser("backup", help="online backup of the database")
+    backup_parser.add_argument("path", nargs="?")
+    args = parser.parse_args(argv)
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.db)), exist_ok=True)
+    store = SqliteDocumentStore(args.db)
+    if args.command == "import":
+        print(json.dumps({"db": args.db, **store.import_json(args.path)}))
+    elif args.command == "export":
+        store.export_json(args.path)
+        print(json.dumps({"db": args.db, "path": args.path}))
+    else:
+        print(json.dumps({"db": args.db, "backup_path": store.backup(args.path)}))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
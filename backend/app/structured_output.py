@@ -0,0 +1,244 @@
+"""Parsing, validation and repair of the JSON fields the signatures return.
+
+Several output fields are JSON held in a string (GenerateTodos.todos,
+DraftEmailReply.references, AnalyzeEmail.quick_actions). Models wrap them in
+code fences, leave trailing commas, add commentary after them, or get cut off
+at the token limit. parse_json_field handles those locally first: it extracts
+the JSON, cuts a truncated array back to its last complete item, and validates
+each item against a small schema, coercing what it can and dropping items that
+lack required fields.
+
+Only when nothing usable is left does it make one repair call. That call is a
+single Predict step of RepairStructuredOutput, given just the broken field and
+the error, instead of re-running the whole chain-of-thought. Repairs are counted
+per signature, field and method, with the latency of repair calls, in
+app.metrics.
+"""
+
+import json
+import re
+import time
+
+from app import metrics, programs
+from app.lm_loop import lm_loop
+from app.rate_limits import RateLimited
+
+_FENCE = re.compile(r"```(?:json|JSON)?\s*(.*?)(?:```|$)", re.DOTALL)
+_TRAILING_COMMA = re.compile(r",(\s*[\]}])")
+
+TODO_SCHEMA = {
+    "description": {"required": True},
+    "priority": {"choices": ("High", "Medium", "Low"), "default": "Medium"},
+    "tag": {"default": ""},
+    "reasoning": {"default": ""},
+}
+REFERENCE_SCHEMA = {
+    "type": {"default": "document"},
+    "title": {"required": True},
+    "date": {},
+    "source": {},
+}
+QUICK_ACTION_SCHEMA = {
+    "action": {"required": True},
+}
+
+
+class StructuredOutputError(ValueError):
+    """An output field is not valid JSON of the expected shape, even after repair."""
+
+
+def _close_truncated(text):
+    """Cut JSON that stops mid-value back to its last complete element and close it.
+
+    Returns None if no element was completed.
+    """
+    closers = []
+    in_string = escaped = False
+    cut = None  # (end index, closers still open there)
+    for index, char in enumerate(text):
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = True
+        elif char in "[{":
+            closers.append("]" if char == "[" else "}")
+        elif char in "]}":
+            if not closers:
+                return None
+            closers.pop()
+            if not closers:
+                return text[: index + 1]
+            cut = (index + 1, list(closers))
+        elif char == ",":
+            cut = (index, list(closers))
+    if cut is None:
+        return None
+    end, still_open = cut
+    return text[:end].rstrip().rstrip(",") + "".join(reversed(still_open))
+
+
+def extract_json(value):
+    """Parse a JSON value out of an LM output string.
+
+    Returns (value, repaired), where repaired says whether fences, surrounding
+    text, trailing commas or truncation had to be dealt with.
+    """
+    if isinstance(value, (list, dict)):
+        return value, False
+    text = str(value or "").strip()
+    try:
+        return json.loads(text), False
+    except ValueError:
+        pass
+
+    fenced = _FENCE.search(text)
+    if fenced:
+        text = fenced.group(1).strip()
+    starts = [index for index in (text.find("["), text.find("{")) if index >= 0]
+    if not starts:
+        raise StructuredOutputError("No JSON array or object in output")
+    text = text[min(starts) :]
+
+    decoder = json.JSONDecoder()
+    without_commas = _TRAILING_COMMA.sub(r"\1", text)
+    candidates = [text, without_commas]
+    closed = _close_truncated(without_commas)
+    if closed is not None:
+        candidates.append(_TRAILING_COMMA.sub(r"\1", closed))
+
+    error = None
+    for candidate in candidates:
+        try:
+            # raw_decode ignores commentary after the value
+            parsed, _ = decoder.raw_decode(candidate)
+            return parsed, True
+        except ValueError as e:
+            error = e
+    raise StructuredOutputError(f"Invalid JSON: {error}")
+
+
+def validate_items(data, schema):
+    """Coerce `data` into a list of objects matching `schema`.
+
+    Returns (items, dropped). Values are stripped strings, choices are matched
+    case-insensitively (falling back to the default), missing optional fields take
+    their default or are left out, and items missing a required field are dropped.
+    """
+    if isinstance(data, dict):
+        lists = [value for value in data.values() if isinstance(value, list)]
+        # {"todos": [...]} rather than [...]; otherwise a single item
+        data = lists[0] if len(lists) == 1 else [data]
+    if not isinstance(data, list):
+        raise StructuredOutputError(f"Expected a JSON array, got {type(data).__name__}")
+
+    required = [name for name, spec in schema.items() if spec.get("required")]
+    items, dropped = [], 0
+    for raw in data:
+        if isinstance(raw, str) and len(required) == 1:
+            raw = {required[0]: raw}
+        if not isinstance(raw, dict):
+            dropped += 1
+            continue
+        item = {}
+        for name, spec in schema.items():
+            value = raw.get(name)
+            value = "" if value is None else str(value).strip()
+            if value and "choices" in spec:
+                value = next(
+                    (choice for choice in spec["choices"] if choice.lower() == value.lower()), ""
+                )
+            if value:
+                item[name] = value
+            elif "default" in spec:
+                item[name] = spec["default"]
+        if all(item.get(name) for name in required):
+            items.append(item)
+        else:
+            dropped += 1
+    return items, dropped
+
+
+def _field_description(signature, field):
+    from app import dspy_signatures
+
+    output_field = getattr(dspy_signatures, signature).output_fields[field]
+    return (output_field.json_schema_extra or {}).get("desc", field)
+
+
+def _repair_call(signature, field, broken, error):
+    """One RepairStructuredOutput call for a single field; returns its fixed output."""
+    import dspy
+
+    program = programs.get_program("repair_output")
+    model = getattr(programs.get_lm("repair_output"), "model", None) or ""
+    inputs = {
+        "field_description": _field_description(signature, field),
+        "broken_output": str(broken),
+        "error": str(error),
+    }
+
+    async def call():
+        with dspy.track_usage() as usage:
+            result = await program.acall(**inputs)
+        return result, usage.get_total_tokens()
+
+    started = time.perf_counter()
+    try:
+        result, usage = lm_loop.run("repair_output", call)
+    except Exception:
+        metrics.record_lm_call(
+            "RepairStructuredOutput", time.perf_counter() - started, outcome="error", model=model
+        )
+        raise
+    finally:
+        metrics.output_repair_latency.observe(time.perf_counter() - started, signature=signature)
+    metrics.record_lm_call(
+        "RepairStructuredOutput", time.perf_counter() - started, usage=usage, model=model
+    )
+    return result.fixed_output
+
+
+def parse_json_field(value, schema, signature, field, repair=True):
+    """Parse and validate the JSON list in output `field` of `signature`.
+
+    Returns (items, repair), where repair is None if the value was clean, "local" if
+    it was fixed without the LM (including dropped invalid items), or "lm" if a
+    repair call was needed. Raises StructuredOutputError if nothing usable is left.
+    """
+    try:
+        data, repaired = extract_json(value)
+        items, dropped = validate_items(data, schema)
+        if dropped and not items:
+            raise StructuredOutputError(f"None of the {dropped} items have the required fields")
+    except StructuredOutputError as e:
+        metrics.json_parse_failures.inc(signature=signature, field=field)
+        if not repair:
+            raise
+        try:
+            fixed = _repair_call(signature, field, value, e)
+            items, _ = validate_items(extract_json(fixed)[0], schema)
+        except RateLimited:
+            # Surfaces as a 429 rather than as unparseable output
+            metrics.output_repairs.inc(
+                signature=signature, field=field, method="lm", result="rate_limited"
+            )
+            raise
+        except Exception as repair_error:
+            metrics.output_repairs.inc(
+                signature=signature, field=field, method="lm", result="failed"
+            )
+            raise StructuredOutputError(f"{e}; repair failed: {repair_error}") from repair_error
+        metrics.output_repairs.inc(signature=signature, field=field, method="lm", result="ok")
+        return items, "lm"
+
+    if repaired or dropped:
+        if repaired:
+            metrics.json_parse_failures.inc(signature=signature, field=field)
+        metrics.output_repairs.inc(signature=signature, field=field, method="local", result="ok")
+        return items, "local"
+    return items, None
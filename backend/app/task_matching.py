@@ -0,0 +1,146 @@
+"""Cheap candidate selection of existing tasks for email categorization.
+
+Instead of sending every open task to CategorizeEmailThread, existing tasks are
+scored against the thread on signals that are reliable in clinical ops mail:
+shared patient/subject IDs (e.g. "patient 203-012"), shared participants, and
+lexical similarity of the subject and body to the task subject/summary. Only the top-N
+candidates go to the LM, and a sufficiently clear winner is assigned without an
+LM call at all.
+"""
+
+import math
+import os
+import re
+from collections import Counter
+
+TOP_N = int(os.getenv("TASK_CANDIDATES_TOP_N", "10"))
+# Score above which (with enough margin over the runner-up) the LM is skipped
+ASSIGN_THRESHOLD = float(os.getenv("TASK_MATCH_THRESHOLD", "0.7"))
+ASSIGN_MARGIN = float(os.getenv("TASK_MATCH_MARGIN", "0.15"))
+
+WEIGHTS = {"patient_id": 0.45, "lexical": 0.25, "subject": 0.2, "participants": 0.1}
+
+# Site-subject number ("203-012"), not part of a phone number ("(650) 555-2345",
+# "650-555-2345") or a longer number. Only counted after a word naming a patient
+# or subject, so bare fragments like "555-1234" or "202-2024" are ignored.
+_ID = r"(?<![\d()-])(?<!\(\d{3}\) )\d{3}-\d{3,4}(?![-.]?\d)"
+_PATIENT_ID = re.compile(
+    r"\b(?:patients?|subjects?|participants?|pts?|subj|screening)\b"
+    r"[\s.:#]*(?:id|no|number)?[\s.:#]*"
+    rf"({_ID}(?:\s*(?:,|/|&|and|or)\s*{_ID})*)",
+    re.IGNORECASE,
+)
+_ID_IN_LIST = re.compile(_ID)
+_EMAIL = re.compile(r"[\w.+-]+@[\w-]+(?:\.[\w-]+)+")
+_WORD = re.compile(r"[a-z][a-z0-9]{2,}")
+_STOPWORDS = frozenset(
+    "the and for that this with from have will are was were been has had not but you your our "
+    "can all any please thanks regards would could should into about there their re fw fwd "
+    "subject study team".split()
+)
+
+
+def _words(text):
+    return [word for word in _WORD.findall(text.lower()) if word not in _STOPWORDS]
+
+
+def _thread_text(thread):
+    parts = [thread.get("subject", ""), thread.get("description", "")]
+    parts.extend(message.get("content", "") for message in thread.get("messages", []))
+    return "\n".join(str(part) for part in parts)
+
+
+def _thread_participants(thread):
+    people = {str(person).lower() for person in thread.get("participants", [])}
+    for message in thread.get("messages", []):
+        people.update(_EMAIL.findall(f"{message.get('from', '')} {message.get('to', '')}".lower()))
+    return people
+
+
+def patient_ids(text):
+    """Patient/subject IDs mentioned in `text`, e.g. {"203-012"} for "Patient 203-012"."""
+    return {pid for ids in _PATIENT_ID.findall(text) for pid in _ID_IN_LIST.findall(ids)}
+
+
+def _cosine(a, b):
+    if not a or not b:
+        return 0.0
+    dot = sum(count * b.get(word, 0) for word, count in a.items())
+    norm = math.sqrt(sum(c * c for c in a.values())) * math.sqrt(sum(c * c for c in b.values()))
+    return dot / norm if norm else 0.0
+
+
+def _jaccard(a, b):
+    return len(a & b) / len(a | b) if a and b else 0.0
+
+
+def score_tasks(thread, tasks):
+    """Score every task against the thread, best first.
+
+    Returns a list of (score, task, signals) where signals explains the score.
+    """
+    text = _thread_text(thread)
+    thread_ids = patient_ids(text)
+    thread_words = Counter(_words(text))
+    subject_words = set(_words(thread.get("subject", "")))
+    participants = _thread_participants(thread)
+
+    scored = []
+    for task in tasks:
+        if not isinstance(task, dict):
+            continue
+        task_text = f"{task.get('subject', '')}\n{task.get('summary', '')}"
+        shared_ids = thread_ids & patient_ids(task_text)
+        task_participants = {str(person).lower() for person in task.get("participants", [])}
+
+        signals = {
+            "patient_id": 1.0 if shared_ids else 0.0,
+            "lexical": _cosine(thread_words, Counter(_words(task_text))),
+            "subject": _jaccard(subject_words, set(_words(task.get("subject", "")))),
+            "participants": _jaccard(participants, task_participants),
+        }
+        score = sum(WEIGHTS[name] * value for name, value in signals.items())
+        signals = {name: round(value, 3) for name, value in signals.items()}
+        if shared_ids:
+            signals["shared_ids"] = sorted(shared_ids)
+        scored.append((round(score, 4), task, signals))
+
+    scored.sort(key=lambda item: -item[0])
+    return scored
+
+
+def select_candidates(thread, tasks, top_n=TOP_N):
+    """Pick the tasks worth showing the LM, and a deterministic match if one is clear.
+
+    Returns (candidates, match) where match is (score, task, signals) or None.
+    """
+    scored = score_tasks(thread, tasks)
+    match = None
+    if scored:
+        best = scored[0]
+        runner_up = scored[1][0] if len(scored) > 1 else 0.0
+        if best[0] >= ASSIGN_THRESHOLD and best[0] - runner_up >= ASSIGN_MARGIN:
+            match = best
+    return [task for _, task, _ in scored[:top_n]], match
+
+
+def deterministic_recommendation(match):
+    """Build an assign_existing recommendation for a clear match without calling the LM."""
+    score, task, signals = match
+    reasons = []
+    if signals.get("shared_ids"):
+        reasons.append(f"shares patient/subject ID {', '.join(signals['shared_ids'])}")
+    if signals["subject"]:
+        reasons.append(f"subject overlap {signals['subject']:.2f}")
+    if signals["lexical"]:
+        reasons.append(f"content similarity {signals['lexical']:.2f}")
+    if signals["participants"]:
+        reasons.append(f"participant overlap {signals['participants']:.2f}")
+    return {
+        "action": "assign_existing",
+        "task_id": str(task.get("id", "")),
+        "confidence": str(min(100, round(score * 100))),
+        "reasoning": f"Matched task '{task.get('subject', '')}' by rule: "
+        + "; ".join(reasons)
+        + ".",
+    }
@@ -0,0 +1,226 @@
+"""What generate_todos has already analyzed, per task, for incremental runs.
+
+After a successful run, the digest of a task records the hashes of the thread
+messages it saw (sender and cleaned content, see prompt_compaction.message_digest),
+the existing todos it was given, a hash of the task context and user profile, and
+the coverage assessment and summary it returned. The next call for the task is
+planned against that digest:
+
+    unchanged - no new messages, and todos were only added: the previous analysis
+                still holds, so the route answers "comprehensive" without an LM call
+    delta     - some messages are new: only those are sent (UpdateTodos), with a
+                compact summary of what was covered before
+    full      - no digest, the task or user profile changed, todos were edited or
+                removed, or none of the messages were seen before: GenerateTodos
+                over every thread, as without digests
+
+Digests are keyed by task id and user profile, since suggestions are tailored to
+the user, and kept in SQLite (TODO_DIGEST_DB_PATH) so every worker shares them.
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import time
+from contextlib import contextmanager
+
+from app import prompt_compaction as compaction
+
+DEFAULT_DB_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), ".todo_digests.db")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS todo_digests (
+    task_key TEXT PRIMARY KEY,
+    digest TEXT NOT NULL,
+    updated_at REAL NOT NULL
+);
+"""
+
+
+def _hash(value):
+    return hashlib.sha1(json.dumps(value, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def task_key(task, user_profile):
+    """Digest key for `task` as seen by `user_profile`, or None if the task has no id."""
+    if not isinstance(task, dict) or task.get("id") in (None, ""):
+        return None
+    return _hash([str(task["id"]), user_profile or {}])
+
+
+def context_hash(task, user_profile):
+    """Changes when the task details or the user profile change."""
+    fields = ("subject", "summary", "urgency", "status")
+    return _hash([{field: task.get(field, "") for field in fields}, user_profile or {}])
+
+
+def todo_hash(todo):
+    """Identifies a todo by its description and tag; status changes don't count."""
+    if not isinstance(todo, dict):
+        return _hash(todo)
+    description = " ".join(str(todo.get("description", "")).split()).lower()
+    return _hash([description, str(todo.get("tag", ""))])
+
+
+def _thread_key(thread, index):
+    return str(thread.get("id", thread.get("name", index)))
+
+
+def _message_hash(message):
+    return compaction.message_digest(
+        dict(message, content=compaction.clean_message_text(message.get("content", "")))
+    )
+
+
+def message_hashes(threads):
+    """[(thread key, [message hash, ...]), ...] for a list of email threads, in order.
+
+    Listed by position rather than keyed by thread, so threads sharing an id stay
+    separate and line up with the request.
+    """
+    return [
+        (_thread_key(thread, index), [_message_hash(m) for m in thread.get("messages", [])])
+        for index, thread in enumerate(threads)
+    ]
+
+
+class TodoPlan:
+    """How to run generate_todos for one request (see the module docstring)."""
+
+    def __init__(self, mode, key, digest, hashes, delta_threads=None, reason=""):
+        self.mode = mode
+        self.key = key
+        self.previous = digest
+        self.hashes = hashes  # [(thread key, [message hash])] of this request, in order
+        self.delta_threads = delta_threads or []
+        self.reason = reason
+
+    @property
+    def new_messages(self):
+        return sum(len(thread["messages"]) for thread in self.delta_threads)
+
+    @property
+    def analyzed_messages(self):
+        return len(self.previous["messages"]) if self.previous else 0
+
+    def prior_coverage(self):
+        """Compact summary of the previous analysis, for UpdateTodos."""
+        previous = self.previous or {}
+        seen = set(previous.get("messages", []))
+        return {
+            "coverage_assessment": previous.get("coverage_assessment", ""),
+            "summary": previous.get("summary", ""),
+            "threads": [
+                {"thread": thread_key, "analyzed_messages": sum(1 for h in hashes if h in seen)}
+                for thread_key, hashes in self.hashes
+            ],
+        }
+
+    def metadata(self):
+        return {
+            "mode": self.mode,
+            "reason": self.reason,
+            "new_messages": self.new_messages,
+            "analyzed_messages": self.analyzed_messages,
+        }
+
+
+class TodoDigestStore:
+    """Digests of analyzed todo inputs, one JSON document per task key."""
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._initialized = False
+
+    @contextmanager
+    def _connect(self):
+        connection = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        connection.row_factory = sqlite3.Row
+        try:
+            if not self._initialized:
+                connection.execute("PRAGMA journal_mode=WAL")
+                connection.executescript(_SCHEMA)
+                self._initialized = True
+            yield connection
+        finally:
+            connection.close()
+
+    def get(self, key):
+        with self._connect() as connection:
+            row = connection.execute(
+                "SELECT digest FROM todo_digests WHERE task_key = ?", (key,)
+            ).fetchone()
+        return None if row is None else json.loads(row["digest"])
+
+    def put(self, key, digest):
+        with self._connect() as connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO todo_digests (task_key, digest, updated_at) "
+                "VALUES (?, ?, ?)",
+                (key, json.dumps(digest), time.time()),
+            )
+
+    def plan(self, data, force_full=False):
+        """Plan the run for a generate_todos payload against its stored digest."""
+        task, user_profile = data["task"], data.get("user_profile", {})
+        threads = [thread for thread in data["email_threads"] if isinstance(thread, dict)]
+        key = task_key(task, user_profile)
+        hashes = message_hashes(threads)
+        if key is None:
+            return TodoPlan("full", None, None, hashes, reason="task has no id")
+        if force_full:
+            return TodoPlan("full", key, None, hashes, reason="requested")
+
+        digest = self.get(key)
+        if digest is None:
+            return TodoPlan("full", key, None, hashes, reason="first run")
+        if digest.get("context") != context_hash(task, user_profile):
+            return TodoPlan("full", key, digest, hashes, reason="task or user profile changed")
+        todos = {todo_hash(todo) for todo in data["existing_todos"]}
+        if not set(digest.get("todos", [])) <= todos:
+            return TodoPlan("full", key, digest, hashes, reason="todos edited or removed")
+
+        seen = set(digest.get("messages", []))
+        delta_threads = []
+        any_seen = False
+        for thread, (_, thread_hashes) in zip(threads, hashes):
+            # A message copied into several threads only counts as new once
+            new = []
+            for message, message_hash in zip(thread.get("messages", []), thread_hashes):
+                if message_hash in seen:
+                    any_seen = True
+                else:
+                    seen.add(message_hash)
+                    new.append(message)
+            if new:
+                earlier = len(thread_hashes) - len(new)
+                delta_threads.append(dict(thread, messages=new, earlier_messages=earlier))
+
+        if not delta_threads:
+            return TodoPlan("unchanged", key, digest, hashes, reason="no new messages")
+        if not any_seen:
+            return TodoPlan("full", key, digest, hashes, reason="no previously analyzed messages")
+        return TodoPlan("delta", key, digest, hashes, delta_threads, reason="new messages")
+
+    def record(self, todo_plan, data, coverage_assessment, summary):
+        """Store the digest of a successful run of `todo_plan`."""
+        if todo_plan.key is None:
+            return
+        messages = {h for _, hashes in todo_plan.hashes for h in hashes}
+        if todo_plan.mode == "delta":
+            # Messages analyzed earlier but no longer in the request stay covered
+            messages.update(todo_plan.previous.get("messages", []))
+        self.put(
+            todo_plan.key,
+            {
+                "context": context_hash(data["task"], data.get("user_profile", {})),
+                "todos": sorted({todo_hash(todo) for todo in data["existing_todos"]}),
+                "messages": sorted(messages),
+                "coverage_assessment": coverage_assessment,
+                "summary": summary,
+            },
+        )
+
+
+todo_digests = TodoDigestStore(os.getenv("TODO_DIGEST_DB_PATH", DEFAULT_DB_PATH))
@@ -0,0 +1,454 @@
+"""Indexed, incrementally updated workflow run events.
+
+Events ({"id", "workflowId", "workflowName", "eventDescription", "date",
+"status", "triggerEmail"}) come from simulated_backend/workflows.json plus an
+append-only JSON-lines log next to it, which POST /api/workflows/events writes to.
+The index keeps only compact columns per event, in arrays: its timestamp, codes
+for its workflow, status and trigger email, and where to read it from. Event
+bodies from the log are read back by byte offset when a page is returned, so
+memory stays at a few dozen bytes per event however large the log grows.
+
+For every workflow, status and trigger email (and for all events), a posting list
+holds its events sorted by time. A query picks the filter whose posting list has
+the fewest events in the requested time range (two bisections each), walks that
+range newest first, and checks the other filters against the code arrays. Pages
+continue from a cursor rather than an offset, so deep pages cost the same as the
+first.
+
+The log is re-read from the last offset when its size changes, at most every
+WORKFLOW_RESCAN_SECONDS, so events appended by other worker processes show up
+without a reload. A changed workflows.json, or a truncated log, triggers a
+rebuild.
+"""
+
+import bisect
+import datetime
+import json
+import os
+import re
+import threading
+import time
+import uuid
+from array import array
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - non-POSIX platforms
+    fcntl = None
+
+_REPO_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+EVENTS_PATH = os.getenv(
+    "WORKFLOW_EVENTS_PATH", os.path.join(_REPO_ROOT, "simulated_backend", "workflows.json")
+)
+SETTINGS_PATH = os.getenv(
+    "WORKFLOW_SETTINGS_PATH",
+    os.path.join(_REPO_ROOT, "simulated_backend", "workflow_settings.json"),
+)
+RESCAN_SECONDS = float(os.getenv("WORKFLOW_RESCAN_SECONDS", "1"))
+
+MAX_PAGE_SIZE = 500
+REQUIRED_FIELDS = ("workflowId", "status", "date")
+
+_DURATION = re.compile(r"^(\d+(?:\.\d+)?)([smhdw])$")
+_DURATION_SECONDS = {"s": 1, "m": 60, "h": 3600, "d": 86400, "w": 604800}
+
+
+def parse_time(value):
+    """Epoch seconds from an ISO 8601 date or date-time; naive values are taken as UTC."""
+    parsed = datetime.datetime.fromisoformat(str(value).strip().replace("Z", "+00:00"))
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=datetime.timezone.utc)
+    return parsed.timestamp()
+
+
+def parse_duration(value):
+    """Seconds in "30m", "24h", "7d" and the like."""
+    match = _DURATION.match(str(value).strip())
+    if not match:
+        raise ValueError(f"Invalid duration {value!r}; use e.g. 30m, 24h or 7d")
+    return float(match.group(1)) * _DURATION_SECONDS[match.group(2)]
+
+
+def validate_event(event):
+    """Return an error message if `event` cannot be indexed, otherwise None."""
+    if not isinstance(event, dict):
+        return "Every event must be an object"
+    missing = [field for field in REQUIRED_FIELDS if not event.get(field)]
+    if missing:
+        return f"Event is missing {', '.join(missing)}"
+    try:
+        parse_time(event["date"])
+    except (TypeError, ValueError):
+        return f"Invalid date {event['date']!r}"
+    return None
+
+
+class _Codes:
+    """Interns the values of one field as small integers."""
+
+    def __init__(self):
+        self.values = []
+        self.codes = {}
+
+    def code(self, value):
+        code = self.codes.get(value)
+        if code is None:
+            code = self.codes[value] = len(self.values)
+            self.values.append(value)
+        return code
+
+
+class _Postings:
+    """Event rows sorted by (time, row)."""
+
+    __slots__ = ("times", "rows")
+
+    def __init__(self):
+        self.times = array("d")
+        self.rows = array("q")
+
+    def add(self, timestamp, row):
+        if not self.times or timestamp >= self.times[-1]:
+            self.times.append(timestamp)
+            self.rows.append(row)
+            return
+        # Out of order (e.g. a backfilled event): rare, so an insert is fine
+        position = bisect.bisect_right(self.times, timestamp)
+        self.times.insert(position, timestamp)
+        self.rows.insert(position, row)
+
+    def __len__(self):
+        return len(self.rows)
+
+
+class WorkflowEventIndex:
+    """Workflow events by workflow, status, trigger email and time."""
+
+    def __init__(self, events_path=EVENTS_PATH, log_path=None, rescan_seconds=RESCAN_SECONDS):
+        self.events_path = events_path
+        base, _ = os.path.splitext(events_path)
+        self.log_path = log_path or f"{base}.log.jsonl"
+        self.lock_path = f"{base}.lock"
+        self.rescan_seconds = rescan_seconds
+        self._lock = threading.RLock()
+        self._scanned_at = None
+        self._reset()
+
+    def _reset(self):
+        self._base_signature = None
+        self._base_events = []  # events from workflows.json, by row
+        self._log_offset = 0  # bytes of the log already indexed
+        self._log_offsets = array("q")  # log row -> byte offset of its line
+        self._times = array("d")
+        self._workflow_codes = array("l")
+        self._status_codes = array("l")
+        self._trigger_codes = array("l")  # -1 without a trigger email
+        self._workflows = _Codes()
+        self._statuses = _Codes()
+        self._triggers = _Codes()
+        self._all = _Postings()
+        self._by_workflow = []  # code -> _Postings
+        self._by_status = []
+        self._by_trigger = []
+        self._names = {}  # workflow id -> latest workflowName
+        self._counts = {}  # (workflow code, status code) -> events
+        self._version = uuid.uuid4().hex[:8]
+
+    # Loading
+
+    def refresh(self, force=False):
+        """Index events appended to the log since the last refresh; rebuild if the
+        base file changed or the log was truncated. Returns the events added."""
+        with self._lock:
+            now = time.monotonic()
+            recent = self._scanned_at is not None and now - self._scanned_at < self.rescan_seconds
+            if recent and not force:
+                return 0
+            self._scanned_at = now
+
+            added = 0
+            signature = self._signature(self.events_path)
+            try:
+                log_size = os.path.getsize(self.log_path)
+            except OSError:
+                log_size = 0
+            if signature != self._base_signature or log_size < self._log_offset:
+                self._reset()
+                self._base_signature = signature
+                added += self._load_base()
+            if log_size > self._log_offset:
+                added += self._read_log()
+            return added
+
+    @staticmethod
+    def _signature(path):
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        return (st.st_ino, st.st_size, st.st_mtime_ns)
+
+    def _load_base(self):
+        try:
+            with open(self.events_path, "r", encoding="utf-8") as f:
+                events = json.load(f)
+        except (OSError, ValueError):
+            # Missing or half-written; retried on the next scan
+            self._base_signature = None
+            return 0
+        added = 0
+        for event in events if isinstance(events, list) else []:
+            if validate_event(event) is None:
+                self._base_events.append(event)
+                self._add(event, len(self._base_events) - 1)
+                added += 1
+        return added
+
+    def _read_log(self):
+        added = 0
+        with open(self.log_path, "rb") as f:
+            f.seek(self._log_offset)
+            offset = self._log_offset
+            for line in f:
+                if not line.endswith(b"\n"):
+                    # Still being written; picked up on a later scan
+                    break
+                try:
+                    event = json.loads(line)
+                except ValueError:
+                    event = None
+                if event is not None and validate_event(event) is None:
+                    self._log_offsets.append(offset)
+                    self._add(event, len(self._base_events) + len(self._log_offsets) - 1)
+                    added += 1
+                offset += len(line)
+            self._log_offset = offset
+        return added
+
+    def _add(self, event, row):
+        timestamp = parse_time(event["date"])
+        workflow = self._workflows.code(str(event["workflowId"]))
+        status = self._statuses.code(str(event["status"]))
+        trigger = event.get("triggerEmail")
+        trigger = -1 if not trigger else self._triggers.code(str(trigger))
+
+        self._times.append(timestamp)
+        self._workflow_codes.append(workflow)
+        self._status_codes.append(status)
+        self._trigger_codes.append(trigger)
+        self._all.add(timestamp, row)
+        for postings, code in (
+            (self._by_workflow, workflow),
+            (self._by_status, status),
+            (self._by_trigger, trigger),
+        ):
+            if code < 0:
+                continue
+            if code == len(postings):
+                postings.append(_Postings())
+            postings[code].add(timestamp, row)
+        if event.get("workflowName"):
+            self._names[str(event["workflowId"])] = event["workflowName"]
+        self._counts[(workflow, status)] = self._counts.get((workflow, status), 0) + 1
+
+    # Writing
+
+    @contextmanager
+    def _locked(self):
+        """Serialize appends across processes, where supported."""
+        if fcntl is None:
+            yield
+            return
+        with open(self.lock_path, "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def append(self, events):
+        """Append validated events to the log and index them. Events without an id
+        get one. Returns the stored events."""
+        stored = []
+        for event in events:
+            event = dict(event)
+            event.setdefault("id", f"wf_event_{uuid.uuid4().hex[:12]}")
+            event.setdefault("triggerEmail", None)
+            stored.append(event)
+        data = "".join(json.dumps(event, ensure_ascii=False) + "\n" for event in stored)
+        with self._locked():
+            with open(self.log_path, "ab") as f:
+                f.write(data.encode("utf-8"))
+                f.flush()
+                os.fsync(f.fileno())
+        self.refresh(force=True)
+        return stored
+
+    # Reading
+
+    def _events(self, rows):
+        """Materialize `rows`, reading log events with one open file."""
+        base = len(self._base_events)
+        log_rows = [row for row in rows if row >= base]
+        from_log = {}
+        if log_rows:
+            with open(self.log_path, "rb") as f:
+                for row in sorted(log_rows):
+                    f.seek(self._log_offsets[row - base])
+                    from_log[row] = json.loads(f.readline())
+        return [self._base_events[row] if row < base else from_log[row] for row in rows]
+
+    def _postings_for(self, codes, postings, value):
+        code = codes.codes.get(value)
+        return None if code is None else postings[code]
+
+    def query(
+        self,
+        workflow_id=None,
+        status=None,
+        trigger_email=None,
+        since=None,
+        until=None,
+        limit=50,
+        cursor=None,
+    ):
+        """Events matching every given filter, newest first.
+
+        `status` may be a list (any of). `since`/`until` are epoch seconds
+        (inclusive/exclusive). Returns (events, next cursor or None).
+        """
+        self.refresh()
+        statuses = [status] if isinstance(status, str) else list(status or [])
+        limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+        with self._lock:
+            candidates = [self._all]
+            wanted = {}
+            for name, codes, postings, value in (
+                ("workflow", self._workflows, self._by_workflow, workflow_id),
+                ("trigger", self._triggers, self._by_trigger, trigger_email),
+            ):
+                if value is None:
+                    continue
+                found = self._postings_for(codes, postings, value)
+                if found is None:
+                    return [], None
+                candidates.append(found)
+                wanted[name] = codes.codes[value]
+            if statuses:
+                known = self._statuses.codes
+                status_codes = {known[s] for s in statuses if s in known}
+                if not status_codes:
+                    return [], None
+                wanted["status"] = status_codes
+                if len(status_codes) == 1:
+                    candidates.append(self._by_status[next(iter(status_codes))])
+
+            # Position bounds of the time range (and cursor) in each posting list
+            upper_time, upper_row = until, None
+            if cursor is not None:
+                cursor_time, cursor_row = cursor
+                if upper_time is None or cursor_time <= upper_time:
+                    upper_time, upper_row = cursor_time, cursor_row
+
+            def bounds(postings):
+                lo = 0 if since is None else bisect.bisect_left(postings.times, since)
+                if upper_time is None:
+                    hi = len(postings)
+                elif upper_row is None:
+                    hi = bisect.bisect_left(postings.times, upper_time)
+                else:
+                    hi = bisect.bisect_right(postings.times, upper_time)
+                return lo, hi
+
+            # Walk the posting list with the fewest events in range
+            postings, (lo, hi) = min(
+                ((p, bounds(p)) for p in candidates), key=lambda item: item[1][1] - item[1][0]
+            )
+
+            rows = []
+            workflow_code = wanted.get("workflow")
+            trigger_code = wanted.get("trigger")
+            status_codes = wanted.get("status")
+            position = hi - 1
+            while position >= lo and len(rows) <= limit:
+                row = postings.rows[position]
+                position -= 1
+                if upper_row is not None and postings.times[position + 1] == upper_time:
+                    # Same timestamp as the cursor: only rows before it
+                    if row >= upper_row:
+                        continue
+                if workflow_code is not None and self._workflow_codes[row] != workflow_code:
+                    continue
+                if trigger_code is not None and self._trigger_codes[row] != trigger_code:
+                    continue
+                if status_codes is not None and self._status_codes[row] not in status_codes:
+                    continue
+                rows.append(row)
+
+            next_cursor = None
+            if len(rows) > limit:
+                rows = rows[:limit]
+                last = rows[-1]
+                next_cursor = (self._times[last], last)
+            return self._events(rows), next_cursor
+
+    def workflows(self):
+        """Per workflow id: its latest name, event count and counts by status."""
+        self.refresh()
+        with self._lock:
+            summary = {}
+            for (workflow, status), count in self._counts.items():
+                workflow_id = self._workflows.values[workflow]
+                entry = summary.setdefault(
+                    workflow_id,
+                    {"name": self._names.get(workflow_id), "events": 0, "statuses": {}},
+                )
+                entry["events"] += count
+                entry["statuses"][self._statuses.values[status]] = count
+            for workflow_id, entry in summary.items():
+                postings = self._by_workflow[self._workflows.codes[workflow_id]]
+                entry["last_event_at"] = postings.times[-1] if len(postings) else None
+            return summary
+
+    def version(self):
+        """Changes whenever events are added or the index is rebuilt."""
+        self.refresh()
+        with self._lock:
+            return f"{self._version}-{len(self._times)}"
+
+    def stats(self):
+        with self._lock:
+            return {
+                "events": len(self._times),
+                "from_log": len(self._log_offsets),
+                "workflows": len(self._workflows.values),
+                "statuses": len(self._statuses.values),
+                "trigger_emails": len(self._triggers.values),
+            }
+
+    def __len__(self):
+        return len(self._times)
+
+
+def encode_cursor(cursor):
+    return None if cursor is None else f"{cursor[0]!r}:{cursor[1]}"
+
+
+def decode_cursor(value):
+    timestamp, _, row = str(value).rpartition(":")
+    return float(timestamp), int(row)
+
+
+def load_settings(path=SETTINGS_PATH):
+    """Workflow definitions from workflow_settings.json ([] if missing)."""
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            settings = json.load(f)
+    except (OSError, ValueError):
+        return []
+    return settings if isinstance(settings, list) else []
+
+
+workflow_events = WorkflowEventIndex()
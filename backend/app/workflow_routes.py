@@ -0,0 +1,145 @@
+"""Workflow routes: definitions from workflow_settings.json and the indexed event
+log (app.workflow_events). None of them call the LM.
+"""
+
+import hashlib
+import time
+
+from flask import Blueprint, jsonify, make_response, request
+
+from app.workflow_events import (
+    MAX_PAGE_SIZE,
+    decode_cursor,
+    encode_cursor,
+    load_settings,
+    parse_duration,
+    parse_time,
+    validate_event,
+    workflow_events,
+)
+
+workflows_bp = Blueprint("workflows", __name__, url_prefix="/api/workflows")
+
+
+def _etag(*parts):
+    key = ":".join([workflow_events.version(), *parts])
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()[:16]
+
+
+def _conditional(etag, build_body):
+    if request.if_none_match.contains(etag):
+        response = make_response("", 304)
+    else:
+        response = build_body()
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = "no-cache"
+    return response
+
+
+@workflows_bp.route("", methods=["GET"])
+def list_workflows():
+    """Workflow definitions, each with its event count and counts by status.
+
+    Workflows that only appear in the event log are listed with their event name.
+    """
+    try:
+
+        def build():
+            summary = workflow_events.workflows()
+            workflows = []
+            for definition in load_settings():
+                events = summary.pop(definition.get("id"), None)
+                workflows.append(dict(definition, events=events or {"events": 0, "statuses": {}}))
+            for workflow_id, events in summary.items():
+                workflows.append({"id": workflow_id, "name": events["name"], "events": events})
+            return jsonify({"success": True, "workflows": workflows})
+
+        return _conditional(_etag("workflows"), build)
+
+    except Exception as e:
+        return jsonify({"success": False, "error": str(e)}), 500
+
+
+@workflows_bp.route("/events", methods=["GET"])
+def list_events():
+    """Workflow events, newest first, one page at a time.
+
+    Query parameters (all optional):
+        workflow_id   - only this workflow's events
+        status        - completed, pending_approval, in_progress, ...; repeat or
+                        comma-separate for any of several
+        trigger_email - only events triggered by this email
+        since / until - ISO 8601 date or date-time (until is exclusive)
+        last          - instead of since, a window ending now: 30m, 24h, 7d, ...
+        limit         - page size (default 50, at most 500)
+        cursor        - "next_cursor" of the previous page
+
+    Responses carry an ETag; a matching If-None-Match gets a 304.
+    """
+    try:
+        args = request.args
+        try:
+            statuses = [s for value in args.getlist("status") for s in value.split(",") if s]
+            since = parse_time(args["since"]) if args.get("since") else None
+            until = parse_time(args["until"]) if args.get("until") else None
+            if args.get("last"):
+                if since is not None:
+                    return jsonify(
+                        {"success": False, "error": "Pass either 'since' or 'last', not both"}
+                    ), 400
+                since = time.time() - parse_duration(args["last"])
+            limit = int(args.get("limit", 50))
+            cursor = decode_cursor(args["cursor"]) if args.get("cursor") else None
+        except ValueError as e:
+            return jsonify({"success": False, "error": str(e)}), 400
+        if not 1 <= limit <= MAX_PAGE_SIZE:
+            return jsonify(
+                {"success": False, "error": f"'limit' must be between 1 and {MAX_PAGE_SIZE}"}
+            ), 400
+
+        def build():
+            events, next_cursor = workflow_events.query(
+                workflow_id=args.get("workflow_id"),
+                status=statuses,
+                trigger_email=args.get("trigger_email"),
+                since=since,
+                until=until,
+                limit=limit,
+                cursor=cursor,
+            )
+            return jsonify(
+                {"success": True, "events": events, "next_cursor": encode_cursor(next_cursor)}
+            )
+
+        # "last" windows move with the clock, so they are not cacheable
+        if args.get("last"):
+            return build()
+        return _conditional(_etag(request.query_string.decode("utf-8")), build)
+
+    except Exception as e:
+        return jsonify({"success": False, "error": str(e)}), 500
+
+
+@workflows_bp.route("/events", methods=["POST"])
+def append_events():
+    """Append one event (an object) or several (an array) to the event log.
+
+    Each event needs workflowId, status and an ISO 8601 date; an id is generated if
+    missing. Returns the stored events.
+    """
+    try:
+        data = request.get_json()
+        if not data:
+            return jsonify({"success": False, "error": "No data provided"}), 400
+
+        events = data if isinstance(data, list) else [data]
+        for event in events:
+            error = validate_event(event)
+            if error:
+                return jsonify({"success": False, "error": error}), 400
+
+        stored = workflow_events.append(events)
+        return jsonify({"success": True, "events": stored}), 201
+
+    except Exception as e:
+        return jsonify({"success": False, "error": str(e)}), 500
@@ -0,0 +1,6 @@
+"""Offline benchmarks for the backend.
+
+Drives the Flask routes against a deterministic stub LM and a synthetic corpus
+built from simulated_backend/simulated_inbox, so latency, throughput and memory
+can be measured without network access or API keys. See benchmarks.run.
+"""
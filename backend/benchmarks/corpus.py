@@ -0,0 +1,106 @@
+"""Synthetic benchmark corpus built from the simulated inbox.
+
+The 15 Gmail-API-shaped emails in simulated_backend/simulated_inbox are decoded
+into the thread shape the routes accept, then replicated with fresh ids, subject
+numbers and patient IDs up to the requested size. Generation is seeded, so two
+runs with the same arguments produce the same corpus.
+"""
+
+import copy
+import json
+import os
+import random
+import re
+
+from app import gmail_inbox
+
+INBOX_DIR = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))),
+    "simulated_backend",
+    "simulated_inbox",
+)
+
+_PATIENT_ID = re.compile(r"\b(\d{3})-(\d{3,4})\b")
+
+
+def load_seed_threads(inbox_dir=INBOX_DIR):
+    """Decode the simulated inbox into route-shaped threads, one per email file."""
+    analysis_path = os.path.join(inbox_dir, "email_ai_analysis.json")
+    analysis = {}
+    if os.path.exists(analysis_path):
+        with open(analysis_path, "r", encoding="utf-8") as f:
+            analysis = json.load(f)
+
+    threads = []
+    for path in gmail_inbox.inbox_files(inbox_dir):
+        # One thread per file: the file's message plus its threadEmails
+        thread = next(iter(gmail_inbox.build_threads(gmail_inbox.parse_file(path)).values()))
+        description = analysis.get(os.path.basename(path), {}).get("summary")
+        threads.append(thread.to_dict(description=description))
+    return threads
+
+
+def _remap_ids(text, rng_state):
+    """Replace patient/subject IDs consistently within one synthetic thread."""
+    mapping, rng = rng_state
+
+    def replace(match):
+        original = match.group(0)
+        if original not in mapping:
+            mapping[original] = f"{rng.randint(100, 999)}-{rng.randint(100, 999):03d}"
+        return mapping[original]
+
+    return _PATIENT_ID.sub(replace, text)
+
+
+def build_threads(count, seed=0, inbox_dir=INBOX_DIR):
+    """`count` threads: the seed threads first, then seeded variations of them."""
+    seeds = load_seed_threads(inbox_dir)
+    if not seeds:
+        raise FileNotFoundError(f"No email_*.json files in {inbox_dir}")
+    rng = random.Random(seed)
+
+    threads = []
+    for index in range(count):
+        thread = copy.deepcopy(seeds[index % len(seeds)])
+        if index >= len(seeds):
+            state = ({}, rng)
+            thread["id"] = f"{thread['id']}-{index}"
+            thread["subject"] = _remap_ids(f"{thread['subject']} (#{index})", state)
+            thread["description"] = _remap_ids(thread["description"], state)
+            for message in thread["messages"]:
+                message["content"] = _remap_ids(message["content"], state)
+        threads.append(thread)
+    return threads
+
+
+def build_tasks(threads, count, seed=0):
+    """`count` existing tasks, each derived from one of `threads`.
+
+    Threads a task was derived from usually match it clearly enough for the
+    deterministic categorization path; the rest go to the LM.
+    """
+    rng = random.Random(seed)
+    sources = rng.sample(threads, min(count, len(threads)))
+    return [
+        {
+            "id": index + 1,
+            "subject": thread["subject"],
+            "summary": thread["description"],
+            "participants": thread["participants"],
+            "status": "In Progress",
+            "urgency": rng.choice(["Low", "Medium", "High"]),
+        }
+        for index, thread in enumerate(sources)
+    ]
+
+
+def build_document(threads, tasks):
+    """A coms.json-shaped document holding `tasks` as problems and `threads`."""
+    return {
+        "problems": [dict(task, threadIds=[]) for task in tasks],
+        "threads": [
+            dict(thread, id=index + 1, sourceId=thread["id"])
+            for index, thread in enumerate(threads)
+        ],
+    }
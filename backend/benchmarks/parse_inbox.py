@@ -0,0 +1,156 @@
+"""Time and memory of parsing a large Gmail inbox with app.gmail_inbox.
+
+Writes a synthetic inbox of `--messages` Gmail API messages to a temporary
+directory, `--thread-size` messages per email_NNN.json file (the file's message
+plus its threadEmails), by copying the simulated inbox with fresh message and
+thread ids. Then reports, separately:
+
+    index   - parsing every file into a ThreadIndex (headers and bodies still encoded)
+    headers - decoding the headers of every message
+    bodies  - decoding every body
+    lookup  - thread lookups by id
+
+    python -m benchmarks.parse_inbox --messages 100000 --output parse.json
+"""
+
+import argparse
+import copy
+import gc
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from app import gmail_inbox
+from benchmarks.run import _rss_mb
+
+
+def write_inbox(directory, messages, thread_size, inbox_dir=gmail_inbox.INBOX_DIR):
+    """Write `messages` synthetic messages to `directory`; returns the number of files."""
+    seeds = []
+    for path in gmail_inbox.inbox_files(inbox_dir):
+        with open(path, "r", encoding="utf-8") as f:
+            raw = json.load(f)
+        raw.pop("threadEmails", None)
+        raw.pop("raw", None)
+        seeds.append(raw)
+    if not seeds:
+        raise FileNotFoundError(f"No email_*.json files in {inbox_dir}")
+
+    files = 0
+    for start in range(0, messages, thread_size):
+        thread_id = f"t{start:08x}"
+        thread = []
+        for offset in range(min(thread_size, messages - start)):
+            index = start + offset
+            message = copy.copy(seeds[index % len(seeds)])
+            message["id"] = f"m{index:08x}"
+            message["threadId"] = thread_id
+            message["internalDate"] = str(1700000000000 + index * 1000)
+            thread.append(message)
+        files += 1
+        with open(os.path.join(directory, f"email_{files:06d}.json"), "w", encoding="utf-8") as f:
+            json.dump(dict(thread[-1], threadEmails=thread), f)
+    return files
+
+
+def _measure(fn, trace):
+    gc.collect()
+    if trace:
+        tracemalloc.start()
+    started = time.perf_counter()
+    result = fn()
+    seconds = time.perf_counter() - started
+    peak_mb = None
+    if trace:
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        peak_mb = round(peak / 1024 / 1024, 1)
+    return result, seconds, peak_mb
+
+
+def run(args):
+    directory = tempfile.mkdtemp(prefix="clinbox-inbox-")
+    try:
+        started = time.perf_counter()
+        files = write_inbox(directory, args.messages, args.thread_size)
+        elapsed = time.perf_counter() - started
+        print(f"wrote {args.messages} messages in {files} files ({elapsed:.1f}s)")
+
+        rss_before = _rss_mb()
+        index = gmail_inbox.ThreadIndex(directory, rescan_seconds=0)
+        _, seconds, peak_mb = _measure(lambda: index.refresh(force=True), args.tracemalloc)
+        stats = index.stats()
+        results = {
+            "index": {
+                "seconds": round(seconds, 3),
+                "messages_per_second": round(stats["messages"] / seconds),
+                "rss_growth_mb": round(_rss_mb() - rss_before, 1),
+                "tracemalloc_peak_mb": peak_mb,
+                **stats,
+            }
+        }
+
+        threads = list(index._threads.values())
+        messages = [message for thread in threads for message in thread.messages]
+
+        def decode(attribute):
+            for message in messages:
+                getattr(message, attribute)
+
+        for name, attribute in (("headers", "subject"), ("bodies", "body")):
+            rss_before = _rss_mb()
+            _, seconds, peak_mb = _measure(lambda: decode(attribute), args.tracemalloc)
+            results[name] = {
+                "seconds": round(seconds, 3),
+                "messages_per_second": round(len(messages) / seconds),
+                "rss_growth_mb": round(_rss_mb() - rss_before, 1),
+                "tracemalloc_peak_mb": peak_mb,
+            }
+
+        thread_ids = [thread.id for thread in threads]
+        _, seconds, _ = _measure(
+            lambda: [index._threads.get(thread_id) for thread_id in thread_ids], False
+        )
+        results["lookup"] = {
+            "seconds": round(seconds, 3),
+            "lookups_per_second": round(len(thread_ids) / seconds),
+        }
+        results["rss_mb"] = _rss_mb()
+        return results
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark Gmail inbox parsing.")
+    parser.add_argument("--messages", type=int, default=100000)
+    parser.add_argument("--thread-size", type=int, default=5, help="messages per file/thread")
+    parser.add_argument(
+        "--tracemalloc", action="store_true", help="also report peak Python allocations (slower)"
+    )
+    parser.add_argument("--output", help="write the JSON report here")
+    args = parser.parse_args(argv)
+
+    results = run(args)
+    report = {
+        "meta": {
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "args": vars(args),
+        },
+        "results": results,
+    }
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,529 @@
+"""Benchmark the API routes offline and write machine-readable results.
+
+Every LM call goes to benchmarks.stub_lm.StubLM, the data routes use a temporary
+copy of a synthetic coms.json (in SQLite, or as JSON with --data-backend json),
+and the LM cache is bypassed unless --cache is given, so results measure the
+backend itself plus the configured stub latency.
+
+    python -m benchmarks.run --threads 10000 --requests 200 --latency-ms 50
+    python -m benchmarks.run --server --concurrency 16 --output after.json
+    python -m benchmarks.run --compare before.json --output after.json
+
+Per route it reports latency percentiles (ms), throughput (requests/s), errors
+and process memory (RSS, and Python allocations with --tracemalloc). --compare
+prints the change against an earlier results file and exits with status 1 if
+any route's p50 or p99 regressed by more than --threshold percent.
+"""
+
+import argparse
+import http.client
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+
+# Configure the app before it is imported: no background warm-up with the real
+# LM, no on-disk LM cache, no background job workers
+os.environ.setdefault("DSPY_WARM_UP", "0")
+os.environ.setdefault("LM_CACHE_DIR", "")
+os.environ.setdefault("JOB_WORKERS", "0")
+
+from benchmarks import corpus  # noqa: E402
+
+RESULTS_VERSION = 1
+
+
+class Scenario:
+    """One benchmarked route: how to build the i-th request."""
+
+    def __init__(self, name, method, path, build, headers=None):
+        self.name = name
+        self.method = method
+        self.path = path
+        self.build = build  # index -> (query string, JSON body or None)
+        self.headers = headers or {}
+
+
+def _thread_text(thread):
+    return "\n\n".join(
+        f"From: {message['from']}\nTo: {message['to']}\nDate: {message['timestamp']}\n"
+        f"Subject: {thread['subject']}\nBody: {message['content']}"
+        for message in thread["messages"]
+    )
+
+
+def build_scenarios(threads, tasks, args, etag):
+    """The scenarios to run, keyed by name, in run order."""
+    extra = {} if args.cache else {"bypass_cache": True}
+    profile = {"name": "Alex Johnson", "role": "Clinical Operations Lead"}
+    n = len(threads)
+
+    def categorize(i):
+        return "", dict(
+            extra, email_thread=threads[i % n], existing_tasks=tasks, user_profile=profile
+        )
+
+    def categorize_batch(i):
+        start = (i * args.batch_size) % n
+        batch = [threads[(start + j) % n] for j in range(args.batch_size)]
+        return "", dict(extra, email_threads=batch, existing_tasks=tasks, user_profile=profile)
+
+    def draft(i):
+        thread = threads[i % n]
+        return "", dict(
+            extra,
+            email_thread=_thread_text(thread),
+            todo_description=f"Reply to: {thread['subject']}",
+            user_profile=profile,
+        )
+
+    def todos(i):
+        task = tasks[i % len(tasks)]
+        related = [threads[(i + j) % n] for j in range(3)]
+        return "", dict(
+            extra, task=task, email_threads=related, existing_todos=[], user_profile=profile
+        )
+
+    def todos_incremental(i):
+        # Revisits a few tasks; on every other visit one new message has arrived
+        index = i % args.incremental_tasks
+        visit = i // args.incremental_tasks
+        related = [threads[(index + j) % n] for j in range(3)]
+        followups = [
+            {
+                "from": "site.coordinator@example.com",
+                "to": "cra@example.com",
+                "timestamp": "",
+                "content": (
+                    f"Follow-up {k + 1} on {related[0]['subject']}: please confirm the next step."
+                ),
+            }
+            for k in range((visit + 1) // 2)
+        ]
+        related[0] = dict(related[0], messages=related[0]["messages"] + followups)
+        return "", dict(
+            task=tasks[index], email_threads=related, existing_todos=[], user_profile=profile
+        )
+
+    def patch(i):
+        thread = dict(
+            threads[i % n], id=(i % n) + 1, description=f"Updated in benchmark request {i}"
+        )
+        return "", {"threads": [thread]}
+
+    scenarios = [
+        Scenario("categorize_email", "POST", "/api/dspy/categorize-email", categorize),
+        Scenario(
+            "categorize_email_batch", "POST", "/api/dspy/categorize-email/batch", categorize_batch
+        ),
+        Scenario("draft_email_reply", "POST", "/api/dspy/draft-email-reply", draft),
+        Scenario("draft_email_reply_stream", "POST", "/api/dspy/draft-email-reply/stream", draft),
+        Scenario("generate_todos", "POST", "/api/dspy/generate-todos", todos),
+        Scenario(
+            "generate_todos_incremental", "POST", "/api/dspy/generate-todos", todos_incremental
+        ),
+        Scenario("data_load", "GET", "/api/data/load", lambda i: ("", None)),
+        Scenario(
+            "data_load_not_modified",
+            "GET",
+            "/api/data/load",
+            lambda i: ("", None),
+            headers={"If-None-Match": f'"{etag}"'},
+        ),
+        Scenario(
+            "data_load_thread",
+            "GET",
+            "/api/data/load",
+            lambda i: (f"thread_id={(i % n) + 1}", None),
+        ),
+        Scenario(
+            "data_query",
+            "GET",
+            "/api/data/query",
+            lambda i: ("collection=problems&urgency=High", None),
+        ),
+        Scenario("data_patch", "POST", "/api/data/patch", patch),
+    ]
+    return {scenario.name: scenario for scenario in scenarios}
+
+
+class TestClientTransport:
+    """Send requests through Flask's test client (no sockets)."""
+
+    def __init__(self, app):
+        self.app = app
+
+    def request(self, method, path, query, body, headers):
+        # Test clients are cheap; one per request keeps worker threads independent
+        client = self.app.test_client()
+        response = client.open(path, method=method, query_string=query, json=body, headers=headers)
+        try:
+            return response.status_code, len(response.get_data())
+        finally:
+            # Runs call_on_close hooks, e.g. releasing streaming routes' admission slots
+            response.close()
+
+
+class HTTPTransport:
+    """Send requests to the app served by a local threaded WSGI server."""
+
+    def __init__(self, app):
+        import logging
+
+        from werkzeug.serving import make_server
+
+        logging.getLogger("werkzeug").setLevel(logging.ERROR)
+        self.server = make_server("127.0.0.1", 0, app, threaded=True)
+        self.port = self.server.server_port
+        threading.Thread(
+            target=self.server.serve_forever, name="benchmark-server", daemon=True
+        ).start()
+
+    def request(self, method, path, query, body, headers):
+        connection = http.client.HTTPConnection("127.0.0.1", self.port, timeout=300)
+        try:
+            payload = None if body is None else json.dumps(body).encode("utf-8")
+            headers = dict(headers, **({"Content-Type": "application/json"} if payload else {}))
+            connection.request(
+                method, f"{path}?{query}" if query else path, body=payload, headers=headers
+            )
+            response = connection.getresponse()
+            data = response.read()
+            return response.status, len(data)
+        finally:
+            connection.close()
+
+    def close(self):
+        self.server.shutdown()
+
+
+def _rss_mb():
+    """Current resident set size, from /proc where available."""
+    try:
+        with open("/proc/self/status", "r", encoding="utf-8") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    try:
+        import resource
+
+        # ru_maxrss is the peak, in KB on Linux and bytes on macOS
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+    except ImportError:
+        return None
+
+
+def _percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, round(pct / 100 * (len(sorted_values) - 1))))
+    return round(sorted_values[index], 3)
+
+
+def run_scenario(transport, scenario, requests, warmup, concurrency, trace_memory):
+    """Run one scenario and return its result block."""
+    for i in range(warmup):
+        query, body = scenario.build(i)
+        transport.request(scenario.method, scenario.path, query, body, scenario.headers)
+
+    latencies = []
+    statuses = {}
+    response_bytes = 0
+    lock = threading.Lock()
+
+    def one(i):
+        nonlocal response_bytes
+        query, body = scenario.build(warmup + i)
+        started = time.perf_counter()
+        try:
+            status, size = transport.request(
+                scenario.method, scenario.path, query, body, scenario.headers
+            )
+        except Exception:
+            status, size = "exception", 0
+        elapsed = (time.perf_counter() - started) * 1000
+        with lock:
+            latencies.append(elapsed)
+            statuses[str(status)] = statuses.get(str(status), 0) + 1
+            response_bytes += size
+
+    rss_before = _rss_mb()
+    if trace_memory:
+        tracemalloc.start()
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(one, range(requests)))
+    wall = time.perf_counter() - started
+    traced_peak = None
+    if trace_memory:
+        traced_peak = round(tracemalloc.get_traced_memory()[1] / (1024 * 1024), 2)
+        tracemalloc.stop()
+
+    latencies.sort()
+    ok = sum(count for status, count in statuses.items() if status in ("200", "304"))
+    return {
+        "requests": requests,
+        "concurrency": concurrency,
+        "errors": requests - ok,
+        "status_counts": statuses,
+        "latency_ms": {
+            "min": round(latencies[0], 3),
+            "mean": round(statistics.fmean(latencies), 3),
+            "p50": _percentile(latencies, 50),
+            "p90": _percentile(latencies, 90),
+            "p99": _percentile(latencies, 99),
+            "max": round(latencies[-1], 3),
+        },
+        "throughput_rps": round(requests / wall, 2) if wall else None,
+        "wall_seconds": round(wall, 3),
+        "mean_response_bytes": round(response_bytes / requests) if requests else 0,
+        "memory_mb": {"rss_before": rss_before, "rss_after": _rss_mb(), "traced_peak": traced_peak},
+    }
+
+
+def _git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True, timeout=10
+        ).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def compare(baseline, current, threshold):
+    """Print per-route changes against `baseline`; return the routes that regressed."""
+    regressions = []
+    print(f"\n{'route':<28}{'p50 ms':>22}{'p99 ms':>22}{'rps':>20}")
+    for name, result in current["results"].items():
+        before = baseline.get("results", {}).get(name)
+        if before is None:
+            continue
+        cells = []
+        for key in ("p50", "p99"):
+            old, new = before["latency_ms"][key], result["latency_ms"][key]
+            change = (new - old) / old * 100 if old else 0.0
+            cells.append(f"{old:.1f} -> {new:.1f} ({change:+.0f}%)")
+            if change > threshold:
+                regressions.append(f"{name} {key} {change:+.0f}%")
+        old_rps, new_rps = before["throughput_rps"], result["throughput_rps"]
+        cells.append(f"{old_rps:.0f} -> {new_rps:.0f}")
+        print(f"{name:<28}{cells[0]:>22}{cells[1]:>22}{cells[2]:>20}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument(
+        "--threads", type=int, default=10000, help="synthetic threads in the corpus"
+    )
+    parser.add_argument(
+        "--tasks", type=int, default=200, help="existing tasks sent to categorization"
+    )
+    parser.add_argument("--requests", type=int, default=200, help="timed requests per route")
+    parser.add_argument("--warmup", type=int, default=5, help="untimed requests per route")
+    parser.add_argument("--concurrency", type=int, default=8, help="client threads")
+    parser.add_argument(
+        "--batch-size", type=int, default=20, help="threads per batch categorization"
+    )
+    parser.add_argument("--latency-ms", type=float, default=50.0, help="stub LM latency per call")
+    parser.add_argument(
+        "--jitter-ms", type=float, default=0.0, help="uniform +/- jitter on stub latency"
+    )
+    parser.add_argument(
+        "--cascade-latency-ms",
+        type=float,
+        help="categorize on a cheap stub LM with this latency first (see DSPY_CASCADE_MODEL)",
+    )
+    parser.add_argument(
+        "--cascade-confidence", type=int, default=80, help="confidence the cheap stub LM reports"
+    )
+    parser.add_argument(
+        "--stub-rpm",
+        type=int,
+        default=0,
+        help="stub LM rejects calls over this many per minute with 429",
+    )
+    parser.add_argument(
+        "--stub-429-rate",
+        type=float,
+        default=0.0,
+        help="fraction of stub LM calls rejected with 429",
+    )
+    parser.add_argument(
+        "--spike-rate",
+        type=float,
+        default=0.0,
+        help="fraction of stub LM calls slowed by --spike-ms",
+    )
+    parser.add_argument("--spike-ms", type=float, default=0.0)
+    parser.add_argument(
+        "--lm-rpm", type=float, default=0, help="client-side requests/min limit (see LM_RPM)"
+    )
+    parser.add_argument(
+        "--lm-tpm", type=float, default=0, help="client-side tokens/min limit (see LM_TPM)"
+    )
+    parser.add_argument(
+        "--incremental-tasks",
+        type=int,
+        default=10,
+        help="tasks revisited by generate_todos_incremental (never bypasses the digests)",
+    )
+    parser.add_argument(
+        "--data-backend",
+        choices=("sqlite", "json"),
+        default="sqlite",
+        help="storage behind /api/data",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--routes", help="comma-separated subset of routes to run")
+    parser.add_argument(
+        "--server", action="store_true", help="serve over local HTTP instead of the test client"
+    )
+    parser.add_argument("--cache", action="store_true", help="allow LM cache hits")
+    parser.add_argument(
+        "--tracemalloc", action="store_true", help="report peak Python allocations (slower)"
+    )
+    parser.add_argument("--output", help="write results JSON here")
+    parser.add_argument("--compare", help="earlier results JSON to compare against")
+    parser.add_argument(
+        "--threshold", type=float, default=10.0, help="regression threshold in percent"
+    )
+    args = parser.parse_args(argv)
+
+    from app import create_app, data_routes, dspy_routes, metrics, programs, rate_limits
+    from app.data_store import JsonDocumentStore
+    from app.sqlite_store import SqliteDocumentStore
+    from app.todo_digests import TodoDigestStore
+    from benchmarks.stub_lm import StubLM
+
+    started = time.perf_counter()
+    threads = corpus.build_threads(args.threads, seed=args.seed)
+    tasks = corpus.build_tasks(threads, args.tasks, seed=args.seed)
+    corpus_seconds = time.perf_counter() - started
+
+    stub = StubLM(
+        latency_ms=args.latency_ms,
+        jitter_ms=args.jitter_ms,
+        seed=args.seed,
+        rpm_limit=args.stub_rpm,
+        error_rate=args.stub_429_rate,
+        spike_rate=args.spike_rate,
+        spike_ms=args.spike_ms,
+    )
+    # Behind the same rate limiter as the real clients (see app.programs)
+    limiter = rate_limits.ModelLimiter(stub.model, rpm=args.lm_rpm, tpm=args.lm_tpm)
+    programs.set_lm(rate_limits.rate_limited(stub, limiter))
+    programs.get_program("draft_email_reply")
+    cascade_stub = None
+    if args.cascade_latency_ms is not None:
+        cascade_stub = StubLM(
+            latency_ms=args.cascade_latency_ms,
+            jitter_ms=args.jitter_ms,
+            seed=args.seed,
+            model="stub/cascade",
+            values={"confidence": str(args.cascade_confidence)},
+        )
+        programs.set_cascade_lm(rate_limits.rate_limited(cascade_stub))
+
+    workdir = tempfile.mkdtemp(prefix="clinbox-bench-")
+    if args.data_backend == "sqlite":
+        data_routes.store = SqliteDocumentStore(os.path.join(workdir, "coms.db"))
+    else:
+        compact_every = int(os.getenv("DATA_WAL_COMPACT_EVERY", "100"))
+        data_routes.store = JsonDocumentStore(
+            os.path.join(workdir, "coms.json"), compact_every=compact_every
+        )
+    data_routes.store.save(corpus.build_document(threads, tasks))
+    _, etag = data_routes.store.load_versioned()
+    dspy_routes.todo_digests = TodoDigestStore(os.path.join(workdir, "todo_digests.db"))
+
+    app = create_app()
+    transport = HTTPTransport(app) if args.server else TestClientTransport(app)
+
+    scenarios = build_scenarios(threads, tasks, args, etag)
+    selected = (
+        list(scenarios) if not args.routes else [name.strip() for name in args.routes.split(",")]
+    )
+    unknown = [name for name in selected if name not in scenarios]
+    if unknown:
+        parser.error(f"unknown routes: {', '.join(unknown)} (choose from {', '.join(scenarios)})")
+
+    results = {}
+    try:
+        for name in selected:
+            calls_before = stub.calls
+            rejected_before = stub.rate_limited
+            cascade_calls_before = cascade_stub.calls if cascade_stub is not None else 0
+            results[name] = run_scenario(
+                transport,
+                scenarios[name],
+                args.requests,
+                args.warmup,
+                args.concurrency,
+                args.tracemalloc,
+            )
+            results[name]["lm_calls"] = stub.calls - calls_before
+            results[name]["lm_rate_limited"] = stub.rate_limited - rejected_before
+            if cascade_stub is not None:
+                results[name]["lm_calls_cascade"] = cascade_stub.calls - cascade_calls_before
+            latency = results[name]["latency_ms"]
+            print(
+                f"{name:<28} p50 {latency['p50']:>9.2f} ms  p99 {latency['p99']:>9.2f} ms  "
+                f"{results[name]['throughput_rps']:>8.1f} req/s  errors {results[name]['errors']}",
+                flush=True,
+            )
+    finally:
+        if args.server:
+            transport.close()
+
+    report = {
+        "version": RESULTS_VERSION,
+        "meta": {
+            "commit": _git_commit(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "transport": "http" if args.server else "test_client",
+            "corpus": {
+                "threads": len(threads),
+                "tasks": len(tasks),
+                "build_seconds": round(corpus_seconds, 3),
+            },
+            "args": vars(args),
+        },
+        "results": results,
+    }
+    if not args.server:
+        # Per-model latency, tokens and cost, and the cascade's escalation rate
+        report["models"] = metrics.model_report()
+        # Concurrency limit the AIMD controller settled on, throttling and 429 counts
+        report["rate_limits"] = rate_limits.snapshot()
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nWrote {args.output}")
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            regressions = compare(json.load(f), report, args.threshold)
+        if regressions:
+            print(f"\nRegressions over {args.threshold:.0f}%: " + "; ".join(regressions))
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
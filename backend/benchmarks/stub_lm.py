@@ -0,0 +1,170 @@
+"""Deterministic local stand-in for the Gemini LM.
+
+StubLM answers any DSPy ChatAdapter (or JSONAdapter) prompt with well-formed
+values for the signature's output fields after a configurable delay, and reports token usage
+estimated from the prompt size, so benchmarks exercise the real DSPy parsing and
+route code without a network call. It can also act like a rate-limited provider,
+rejecting calls with HTTP 429 and adding latency spikes.
+"""
+
+import asyncio
+import collections
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from types import SimpleNamespace
+
+import dspy
+import litellm
+
+_OUTPUT_FIELD = re.compile(r"^\d+\. `(\w+)`", re.MULTILINE)
+
+# Values that parse cleanly for the fields of app.dspy_signatures
+CANNED_VALUES = {
+    "action": "create_new",
+    "task_id": "",
+    "confidence": "72",
+    "new_task_subject": "Follow up on site query",
+    "new_task_summary": "Review the thread and respond to the outstanding site query.",
+    "new_task_priority": "Medium",
+    "to": "site.coordinator@example.com",
+    "cc": "",
+    "bcc": "",
+    "subject": "Re: Site query",
+    "body": (
+        "Hi,\n\n"
+        "Thank you for the update. We will review and follow up shortly.\n\n"
+        "Best regards"
+    ),
+    "references": "[]",
+    "coverage_assessment": "gaps_identified",
+    "todos": json.dumps(
+        [
+            {
+                "description": "Confirm the query resolution with the site",
+                "priority": "High",
+                "tag": "Thread 1",
+                "reasoning": "The latest message asks for confirmation.",
+            }
+        ]
+    ),
+    "summary": "Generated 1 TODO suggestion based on the thread content.",
+    "category": "Important",
+    "quick_actions": json.dumps([{"action": "Reply to confirm receipt"}]),
+    "workflow_id": "workflow_001",
+    "fixed_output": "[]",
+}
+
+
+def _output_fields(messages):
+    """Output field names listed in the ChatAdapter system message, in order."""
+    for message in messages:
+        if message.get("role") == "system":
+            _, _, rest = message.get("content", "").partition("Your output fields are:")
+            section = rest.split("All interactions will be structured", 1)[0]
+            return _OUTPUT_FIELD.findall(section)
+    return []
+
+
+class StubLM(dspy.BaseLM):
+    """A DSPy LM that sleeps for `latency_ms` (± `jitter_ms`) and returns canned fields."""
+
+    def __init__(
+        self,
+        latency_ms=0.0,
+        jitter_ms=0.0,
+        seed=0,
+        model="stub/benchmark",
+        values=None,
+        rpm_limit=0,
+        error_rate=0.0,
+        spike_rate=0.0,
+        spike_ms=0.0,
+        **kwargs,
+    ):
+        super().__init__(model=model, temperature=0.0, cache=False, **kwargs)
+        # Per-field overrides of CANNED_VALUES, e.g. {"confidence": "40"}
+        self.values = dict(CANNED_VALUES, **(values or {}))
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        # Provider misbehaviour: a requests-per-minute limit enforced over a sliding
+        # minute, a fraction of calls rejected with 429 regardless, and a fraction of
+        # calls slowed down by spike_ms
+        self.rpm_limit = rpm_limit
+        self.error_rate = error_rate
+        self.spike_rate = spike_rate
+        self.spike_ms = spike_ms
+        self._random = random.Random(seed)
+        self._accepted = collections.deque()
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.rate_limited = 0
+
+    def _delay(self):
+        jitter = self._random.uniform(-self.jitter_ms, self.jitter_ms) if self.jitter_ms else 0.0
+        spike = (
+            self.spike_ms if self.spike_rate and self._random.random() < self.spike_rate else 0.0
+        )
+        return max(0.0, self.latency_ms + jitter + spike) / 1000
+
+    def _admit(self):
+        """Raise a litellm RateLimitError (HTTP 429) the way the provider would."""
+        with self._lock:
+            now = time.monotonic()
+            while self._accepted and now - self._accepted[0] >= 60:
+                self._accepted.popleft()
+            rejected = (self.rpm_limit and len(self._accepted) >= self.rpm_limit) or (
+                self.error_rate and self._random.random() < self.error_rate
+            )
+            if not rejected:
+                self._accepted.append(now)
+                return
+            self.rate_limited += 1
+        raise litellm.RateLimitError(
+            message="Resource has been exhausted (stub)", llm_provider="stub", model=self.model
+        )
+
+    def _response(self, prompt, messages):
+        self.calls += 1
+        messages = messages or [{"role": "user", "content": prompt or ""}]
+        fields = _output_fields(messages)
+        prompt_text = "".join(str(message.get("content", "")) for message in messages)
+        digest = hashlib.sha1(prompt_text.encode("utf-8")).hexdigest()[:8]
+
+        values = {name: self.values.get(name, f"Stub {name} {digest}") for name in fields}
+        if "Respond with a JSON object" in prompt_text:
+            # JSONAdapter, which DSPy falls back to when ChatAdapter fails
+            content = json.dumps(values)
+        else:
+            parts = [f"[[ ## {name} ## ]]\n{value}" for name, value in values.items()]
+            parts.append("[[ ## completed ## ]]")
+            content = "\n\n".join(parts)
+
+        prompt_tokens = len(prompt_text) // 4
+        completion_tokens = len(content) // 4
+        usage = {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+        }
+        # dspy.LM reports usage to an active dspy.track_usage(); do the same
+        if dspy.settings.usage_tracker is not None:
+            dspy.settings.usage_tracker.add_usage(self.model, dict(usage))
+        return SimpleNamespace(
+            choices=[SimpleNamespace(message=SimpleNamespace(content=content, tool_calls=None))],
+            usage=usage,
+            model=self.model,
+        )
+
+    def forward(self, prompt=None, messages=None, **kwargs):
+        self._admit()
+        time.sleep(self._delay())
+        return self._response(prompt, messages)
+
+    async def aforward(self, prompt=None, messages=None, **kwargs):
+        self._admit()
+        await asyncio.sleep(self._delay())
+        return self._response(prompt, messages)
@@ -0,0 +1,193 @@
+"""Time and memory of indexing and querying a large workflow event log.
+
+Writes `--events` synthetic events to the JSON-lines log of a temporary copy of
+simulated_backend/workflows.json, spread over `--workflows` workflows and the
+last `--days` days, a few trigger emails per workflow. Then reports:
+
+    index   - indexing the whole log into a WorkflowEventIndex
+    append  - appending events through the index (fsync per batch of --batch)
+    queries - latency of typical filtered first pages and of deep pagination
+
+    python -m benchmarks.workflow_events --events 1000000 --output workflows.json
+"""
+
+import argparse
+import datetime
+import gc
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+from app import workflow_events
+from benchmarks.run import _rss_mb
+
+STATUSES = ("completed", "in_progress", "pending_approval", "failed")
+
+
+def _iso(timestamp):
+    return datetime.datetime.fromtimestamp(timestamp, datetime.timezone.utc).strftime(
+        "%Y-%m-%dT%H:%M:%SZ"
+    )
+
+
+def synthetic_event(index, args, rng, now):
+    workflow = rng.randrange(args.workflows)
+    return {
+        "id": f"wf_event_{index:09d}",
+        "workflowId": f"workflow_{workflow + 1:03d}",
+        "workflowName": f"Workflow {workflow + 1}",
+        "eventDescription": f"Synthetic run {index}",
+        "date": _iso(now - args.days * 86400 + index * args.days * 86400 / args.events),
+        "status": rng.choices(STATUSES, weights=(80, 10, 7, 3))[0],
+        "triggerEmail": (
+            f"site{workflow * 4 + rng.randrange(4)}@example.com" if rng.random() < 0.7 else None
+        ),
+    }
+
+
+def write_log(path, args, now):
+    rng = random.Random(args.seed)
+    with open(path, "w", encoding="utf-8") as f:
+        for index in range(args.events):
+            f.write(json.dumps(synthetic_event(index, args, rng, now)) + "\n")
+
+
+def _timed(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - started) * 1000)
+    samples.sort()
+    return {
+        "p50_ms": round(statistics.median(samples), 3),
+        "p95_ms": round(samples[int(len(samples) * 0.95) - 1 if len(samples) > 1 else 0], 3),
+        "max_ms": round(samples[-1], 3),
+    }
+
+
+def run(args):
+    directory = tempfile.mkdtemp(prefix="clinbox-workflows-")
+    try:
+        events_path = os.path.join(directory, "workflows.json")
+        shutil.copy(workflow_events.EVENTS_PATH, events_path)
+        index = workflow_events.WorkflowEventIndex(events_path, rescan_seconds=0)
+        now = time.time()
+
+        started = time.perf_counter()
+        write_log(index.log_path, args, now)
+        print(f"wrote {args.events} events ({time.perf_counter() - started:.1f}s)")
+
+        gc.collect()
+        rss_before = _rss_mb()
+        started = time.perf_counter()
+        index.refresh(force=True)
+        seconds = time.perf_counter() - started
+        stats = index.stats()
+        results = {
+            "index": {
+                "seconds": round(seconds, 3),
+                "events_per_second": round(stats["events"] / seconds),
+                "rss_growth_mb": round(_rss_mb() - rss_before, 1),
+                **stats,
+            }
+        }
+
+        rng = random.Random(args.seed + 1)
+        batches = max(1, args.appends // args.batch)
+        started = time.perf_counter()
+        for batch in range(batches):
+            index.append(
+                synthetic_event(args.events + batch * args.batch + i, args, rng, now)
+                for i in range(args.batch)
+            )
+        seconds = time.perf_counter() - started
+        results["append"] = {
+            "events": batches * args.batch,
+            "seconds": round(seconds, 3),
+            "batches_per_second": round(batches / seconds, 1),
+        }
+
+        day_ago = now - 86400
+        queries = {
+            "latest": {},
+            "workflow": {"workflow_id": "workflow_001"},
+            "workflow_failed_24h": {
+                "workflow_id": "workflow_001",
+                "status": "failed",
+                "since": day_ago,
+            },
+            "failed_24h": {"status": "failed", "since": day_ago},
+            "trigger_email": {"trigger_email": "site1@example.com"},
+            "workflow_pending_week": {
+                "workflow_id": "workflow_002",
+                "status": ["pending_approval", "in_progress"],
+                "since": now - 7 * 86400,
+            },
+        }
+        results["queries"] = {}
+        for name, filters in queries.items():
+            events, _ = index.query(limit=args.limit, **filters)
+            results["queries"][name] = dict(
+                _timed(lambda: index.query(limit=args.limit, **filters), args.repeat),
+                returned=len(events),
+            )
+
+        # Follow cursors `--pages` pages deep into one workflow's history
+        def paginate():
+            cursor = None
+            for _ in range(args.pages):
+                _, cursor = index.query(workflow_id="workflow_001", limit=args.limit, cursor=cursor)
+                if cursor is None:
+                    break
+
+        timing = _timed(paginate, max(1, args.repeat // 10))
+        results["queries"]["paginate"] = {
+            "pages": args.pages,
+            "per_page_ms": round(timing["p50_ms"] / args.pages, 3),
+            **timing,
+        }
+        results["rss_mb"] = _rss_mb()
+        return results
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the workflow event index.")
+    parser.add_argument("--events", type=int, default=1000000)
+    parser.add_argument("--workflows", type=int, default=20)
+    parser.add_argument("--days", type=int, default=90, help="time span of the events")
+    parser.add_argument("--appends", type=int, default=1000, help="events appended after indexing")
+    parser.add_argument("--batch", type=int, default=10, help="events per append")
+    parser.add_argument("--limit", type=int, default=50, help="page size")
+    parser.add_argument("--pages", type=int, default=100, help="pages followed when paginating")
+    parser.add_argument("--repeat", type=int, default=200, help="runs of each query")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write the JSON report here")
+    args = parser.parse_args(argv)
+
+    results = run(args)
+    report = {
+        "meta": {
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "args": vars(args),
+        },
+        "results": results,
+    }
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
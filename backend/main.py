@@ -1,4 +1,4 @@
-"""Main entry point for the Flask application."""
+"""Development entry point for the Flask application (see app.server for production)."""
 
 from app import create_app
 
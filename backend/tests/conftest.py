@@ -0,0 +1,38 @@
+"""Shared fixtures: every store points at a temporary directory and every LM call
+goes to benchmarks.stub_lm.StubLM, so the tests need no network or API key."""
+
+import os
+import tempfile
+
+# Set before any app module is imported: the stores are module-level singletons
+_tmp = tempfile.mkdtemp(prefix="clinbox-tests-")
+os.environ.update(
+    {
+        "DSPY_WARM_UP": "0",
+        "JOB_WORKERS": "0",
+        "LM_CACHE_DIR": "",
+        "JOBS_DB_PATH": os.path.join(_tmp, "jobs.db"),
+        "ANALYSIS_DB_PATH": os.path.join(_tmp, "analysis.db"),
+        "TODO_DIGEST_DB_PATH": os.path.join(_tmp, "todo_digests.db"),
+        "DATA_DB_PATH": os.path.join(_tmp, "coms.db"),
+    }
+)
+
+import pytest  # noqa: E402
+
+from app import create_app, lm_cache, programs  # noqa: E402
+from benchmarks.stub_lm import StubLM  # noqa: E402
+
+
+@pytest.fixture
+def stub_lm():
+    """A fresh stub LM behind every program, with an empty LM cache."""
+    stub = StubLM()
+    programs.set_lm(stub)
+    lm_cache.lm_cache.clear()
+    return stub
+
+
+@pytest.fixture
+def client(stub_lm):
+    return create_app().test_client()
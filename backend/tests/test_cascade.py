@@ -0,0 +1,61 @@
+import pytest
+
+from app import programs
+from benchmarks import corpus
+from benchmarks.stub_lm import StubLM
+
+
+@pytest.fixture
+def categorize(client):
+    thread = corpus.build_threads(1)[0]
+
+    def post(cheap):
+        programs.set_cascade_lm(cheap)
+        response = client.post(
+            "/api/dspy/categorize-email", json={"email_thread": thread, "existing_tasks": []}
+        )
+        assert response.status_code == 200
+        return response.get_json()
+
+    yield post
+    programs.set_cascade_lm(None)
+
+
+def test_confident_cheap_answer_is_kept(categorize, stub_lm):
+    cheap = StubLM(model="stub/cheap", values={"confidence": "90"})
+
+    body = categorize(cheap)
+
+    assert body["metadata"]["model"] == "stub/cheap"
+    assert body["metadata"]["cascade"] == {"model": "stub/cheap", "escalated": False}
+    assert (cheap.calls, stub_lm.calls) == (1, 0)
+
+
+def test_low_confidence_escalates_to_the_route_model(categorize, stub_lm):
+    cheap = StubLM(model="stub/cheap", values={"confidence": "40"})
+
+    body = categorize(cheap)
+
+    assert body["metadata"]["model"] == "stub/benchmark"
+    assert body["metadata"]["cascade"]["reason"] == "low_confidence"
+    assert (cheap.calls, stub_lm.calls) == (1, 1)
+
+
+def test_invalid_cheap_answer_escalates(categorize, stub_lm):
+    # Assigning to a task that is not among the candidates cannot be accepted
+    cheap = StubLM(
+        model="stub/cheap",
+        values={"action": "assign_existing", "task_id": "no-such-task", "confidence": "95"},
+    )
+
+    body = categorize(cheap)
+
+    assert body["metadata"]["cascade"]["reason"] == "invalid"
+    assert body["recommendation"]["action"] == "create_new"
+
+
+def test_no_cascade_without_a_cheap_model(categorize, stub_lm):
+    body = categorize(None)
+
+    assert "cascade" not in body["metadata"]
+    assert stub_lm.calls == 1
@@ -0,0 +1,48 @@
+import json
+
+from benchmarks import corpus
+
+
+def _lines(response):
+    return [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+
+
+def test_batch_streams_one_line_per_thread_then_a_summary(client, stub_lm):
+    threads = corpus.build_threads(6)
+    tasks = corpus.build_tasks(threads, 4)
+
+    response = client.post(
+        "/api/dspy/categorize-email/batch",
+        json={"email_threads": threads, "existing_tasks": tasks, "max_concurrency": 3},
+    )
+
+    assert response.status_code == 200
+    assert response.mimetype == "application/x-ndjson"
+    lines = _lines(response)
+    assert lines[-1] == {"done": True, "total": 6, "succeeded": 6, "failed": 0}
+    assert sorted(line["index"] for line in lines[:-1]) == list(range(6))
+    assert all(line["success"] and line["recommendation"] for line in lines[:-1])
+
+
+def test_batch_reports_a_bad_thread_on_its_own_line(client, stub_lm):
+    threads = corpus.build_threads(2)
+
+    response = client.post(
+        "/api/dspy/categorize-email/batch",
+        json={"email_threads": [threads[0], "not a thread", threads[1]], "existing_tasks": []},
+    )
+
+    lines = _lines(response)
+    by_index = {line["index"]: line for line in lines[:-1]}
+    assert by_index[1]["success"] is False and by_index[1]["error"]
+    assert by_index[0]["success"] and by_index[2]["success"]
+    assert lines[-1]["failed"] == 1
+
+
+def test_batch_requires_a_list_of_threads(client):
+    response = client.post(
+        "/api/dspy/categorize-email/batch", json={"email_threads": {}, "existing_tasks": []}
+    )
+
+    assert response.status_code == 400
+    assert response.get_json()["success"] is False
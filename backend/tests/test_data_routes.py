@@ -0,0 +1,49 @@
+def test_load_answers_304_until_the_data_changes(client):
+    first = client.get("/api/data/load")
+    etag = first.headers["ETag"]
+
+    assert first.status_code == 200
+    assert client.get("/api/data/load", headers={"If-None-Match": etag}).status_code == 304
+
+    patched = client.post("/api/data/patch", json={"threads": [{"id": "etag-test"}]})
+    assert patched.status_code == 200
+
+    changed = client.get("/api/data/load", headers={"If-None-Match": etag})
+    assert changed.status_code == 200
+    assert changed.headers["ETag"] != etag
+
+
+def test_load_single_record(client):
+    client.post("/api/data/patch", json={"problems": [{"id": "p-1", "status": "Open"}]})
+
+    response = client.get("/api/data/load?problem_id=p-1")
+
+    assert response.get_json()["data"] == {"id": "p-1", "status": "Open"}
+    assert client.get("/api/data/load?problem_id=missing").status_code == 404
+
+
+def test_query_filters_by_status(client):
+    client.post(
+        "/api/data/patch",
+        json={"problems": [{"id": "q-1", "status": "Blocked"}, {"id": "q-2", "status": "Open"}]},
+    )
+
+    response = client.get("/api/data/query?collection=problems&status=Blocked")
+
+    assert [p["id"] for p in response.get_json()["data"]] == ["q-1"]
+    assert client.get("/api/data/query?collection=nope").status_code == 400
+
+
+def test_patch_rejects_records_without_ids(client):
+    response = client.post("/api/data/patch", json={"problems": [{"status": "Open"}]})
+
+    assert response.status_code == 400
+
+
+def test_save_names_the_record_without_an_id(client):
+    response = client.post(
+        "/api/data/save", json={"problems": [{"id": 1}, {"status": "Open"}], "threads": []}
+    )
+
+    assert response.status_code == 400
+    assert "problems[1]" in response.get_json()["error"]
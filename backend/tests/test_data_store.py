@@ -0,0 +1,83 @@
+import json
+import threading
+
+import pytest
+
+from app.data_store import JsonDocumentStore, apply_patch, validate_patch
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = JsonDocumentStore(str(tmp_path / "coms.json"), compact_every=5)
+    store.save({"problems": [{"id": 1, "status": "Open"}], "threads": []})
+    return store
+
+
+def test_patches_are_replayed_from_the_log_by_another_instance(store):
+    store.patch({"problems": [{"id": 1, "status": "Closed"}, {"id": 2, "status": "Open"}]})
+    store.patch({"deleted": {"problems": [2]}})
+
+    reopened = JsonDocumentStore(store.snapshot_path)
+
+    assert reopened.load()["problems"] == [{"id": 1, "status": "Closed"}]
+
+
+def test_log_is_compacted_into_the_snapshot(store):
+    for i in range(5):
+        store.patch({"threads": [{"id": i}]})
+
+    with open(store.snapshot_path, encoding="utf-8") as f:
+        snapshot = json.load(f)
+    assert len(snapshot["threads"]) == 5
+    assert store._log_length() == 0
+
+
+def test_torn_log_line_is_skipped(store):
+    store.patch({"problems": [{"id": 2}]})
+    with open(store.log_path, "a", encoding="utf-8") as f:
+        f.write('{"ts": 1, "patch": {"problems": [{"id"')
+
+    store.patch({"problems": [{"id": 3}]})
+
+    reopened = JsonDocumentStore(store.snapshot_path)
+    assert [p["id"] for p in reopened.load()["problems"]] == [1, 2, 3]
+
+
+def test_concurrent_patches_from_several_instances_are_all_kept(store):
+    # Separate instances share only the files and the file lock, like worker processes
+    instances = [JsonDocumentStore(store.snapshot_path, compact_every=7) for _ in range(4)]
+
+    def write(n, instance):
+        for i in range(25):
+            instance.patch({"threads": [{"id": f"{n}-{i}"}]})
+
+    threads = [threading.Thread(target=write, args=(n, s)) for n, s in enumerate(instances)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(JsonDocumentStore(store.snapshot_path).load()["threads"]) == 100
+
+
+def test_version_changes_with_the_data(store):
+    _, before = store.load_versioned()
+    store.patch({"problems": [{"id": 1, "status": "Closed"}]})
+    document, after = store.load_versioned()
+
+    assert after != before
+    assert store.get_record("problems", 1) == ({"id": 1, "status": "Closed"}, after)
+
+
+def test_apply_patch_keeps_positions_and_appends_new_records():
+    document = {"problems": [{"id": 1}, {"id": 2}], "threads": []}
+
+    apply_patch(document, {"problems": [{"id": 2, "x": 1}, {"id": 3}]})
+
+    assert document["problems"] == [{"id": 1}, {"id": 2, "x": 1}, {"id": 3}]
+
+
+def test_validate_patch_rejects_records_without_ids():
+    assert validate_patch({"problems": [{"status": "Open"}]})
+    assert validate_patch({"deleted": {"threads": 3}})
+    assert validate_patch({"problems": [{"id": 1}]}) is None
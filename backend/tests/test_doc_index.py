@@ -0,0 +1,80 @@
+import pytest
+
+from app.doc_index import MAX_TOP_K, DocumentIndex, parse_top_k
+
+PROTOCOL = {"id": "protocol", "title": "Study protocol", "raw_text": "dosing schedule visits"}
+
+
+@pytest.fixture
+def index():
+    index = DocumentIndex()
+    index.upsert(PROTOCOL)
+    index.upsert({"id": "icf", "title": "Consent form", "raw_text": "informed consent signature"})
+    return index
+
+
+def test_search_ranks_the_matching_document_first(index):
+    hits = index.search("consent signature")
+
+    assert hits[0]["doc_id"] == "icf"
+    assert "raw_text" not in hits[0]["document"]
+
+
+def test_unchanged_upsert_is_a_no_op_and_remove_drops_passages(index):
+    assert not index.upsert(dict(PROTOCOL))
+
+    index.remove("icf")
+
+    assert len(index) == 1
+    assert index.search("consent") == []
+
+
+def test_request_documents_are_ranked_without_entering_the_index(index):
+    extra = [{"id": "lab", "title": "Lab manual", "raw_text": "centrifuge samples consent"}]
+
+    hits = index.search("centrifuge samples", extra_documents=extra)
+
+    assert hits[0]["doc_id"] == "lab"
+    assert hits[0]["document"] == {"id": "lab", "title": "Lab manual"}
+    assert len(index) == 2
+    assert index.search("centrifuge samples") == []
+
+
+def test_request_document_replaces_indexed_document_with_the_same_id(index):
+    extra = [{"id": "protocol", "title": "Study protocol v2", "raw_text": "amended washout period"}]
+
+    hits = index.search("dosing washout", extra_documents=extra)
+
+    protocol_texts = [hit["text"] for hit in hits if hit["doc_id"] == "protocol"]
+    assert protocol_texts == ["amended washout period"]
+    assert index.search("dosing")[0]["doc_id"] == "protocol"
+
+
+def test_doc_ids_filter_applies_to_request_documents(index):
+    extra = [{"id": "lab", "title": "Lab consent"}]
+
+    hits = index.search("consent", doc_ids=["icf"], extra_documents=extra)
+
+    assert {hit["doc_id"] for hit in hits} == {"icf"}
+
+
+@pytest.mark.parametrize("top_k", ["abc", None, 0, -3])
+def test_draft_route_rejects_a_bad_top_k(client, top_k):
+    response = client.post(
+        "/api/dspy/draft-email-reply",
+        json={"email_thread": "Body: Hi", "todo_description": "Reply", "top_k": top_k},
+    )
+
+    assert response.status_code == 400
+    assert "'top_k'" in response.get_json()["error"]
+
+
+@pytest.mark.parametrize("k", ["abc", "0", "-1"])
+def test_search_route_rejects_a_bad_k(client, k):
+    response = client.get(f"/api/dspy/documents/search?q=protocol&k={k}")
+
+    assert response.status_code == 400
+
+
+def test_top_k_is_capped():
+    assert parse_top_k("1000") == MAX_TOP_K
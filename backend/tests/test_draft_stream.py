@@ -0,0 +1,63 @@
+import json
+
+PAYLOAD = {
+    "email_thread": "From: site@example.com\nSubject: Query\nBody: Please confirm the visit date.",
+    "todo_description": "Confirm the visit date",
+}
+
+
+def _events(response):
+    events = []
+    for block in response.get_data(as_text=True).strip().split("\n\n"):
+        lines = dict(line.split(": ", 1) for line in block.splitlines())
+        events.append((lines["event"], json.loads(lines["data"])))
+    return events
+
+
+def test_stream_sends_each_field_then_done(client, stub_lm):
+    response = client.post("/api/dspy/draft-email-reply/stream", json=PAYLOAD)
+
+    assert response.mimetype == "text/event-stream"
+    events = _events(response)
+    fields = [data["field"] for name, data in events if name == "field"]
+    assert sorted(fields) == ["bcc", "body", "cc", "references", "subject", "to"]
+    name, done = events[-1]
+    assert name == "done" and done["success"] is True
+    assert done["draft"]["to"] == "site.coordinator@example.com"
+
+
+def test_stream_replays_a_cached_draft_without_the_lm(client, stub_lm):
+    client.post("/api/dspy/draft-email-reply/stream", json=PAYLOAD)
+    calls = stub_lm.calls
+
+    events = _events(client.post("/api/dspy/draft-email-reply/stream", json=PAYLOAD))
+
+    assert stub_lm.calls == calls
+    assert events[-1][1]["cached"] is True
+
+
+def test_stream_reports_bad_input_as_json(client):
+    response = client.post(
+        "/api/dspy/draft-email-reply/stream",
+        json={"thread_id": {"not": "an id"}, "todo_description": "Reply"},
+    )
+
+    assert response.status_code == 500
+    assert response.is_json and response.get_json()["success"] is False
+
+
+def test_stream_requires_fields(client):
+    response = client.post("/api/dspy/draft-email-reply/stream", json={"email_thread": "x"})
+
+    assert response.status_code == 400
+    assert "todo_description" in response.get_json()["error"]
+
+
+def test_batch_reports_bad_thread_ids_as_json(client):
+    response = client.post(
+        "/api/dspy/categorize-email/batch",
+        json={"thread_ids": [{"not": "an id"}], "existing_tasks": []},
+    )
+
+    assert response.status_code == 500
+    assert response.is_json and response.get_json()["success"] is False
@@ -0,0 +1,76 @@
+import base64
+from concurrent.futures import ThreadPoolExecutor
+
+from app.gmail_inbox import GmailMessage, build_threads
+
+
+def _b64(text):
+    return base64.urlsafe_b64encode(text.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def _raw(message_id, thread_id="t1", internal_date="1", subject="Site visit", parts=None):
+    return {
+        "id": message_id,
+        "threadId": thread_id,
+        "internalDate": internal_date,
+        "snippet": "snippet",
+        "payload": {
+            "mimeType": "multipart/mixed",
+            "headers": [
+                {"name": "Subject", "value": subject},
+                {"name": "From", "value": "Coordinator <site@example.com>"},
+            ],
+            "parts": parts
+            if parts is not None
+            else [
+                {"mimeType": "text/html", "body": {"data": _b64("<p>html</p>")}},
+                {"mimeType": "text/plain", "body": {"data": _b64("plain body")}},
+                {"filename": "labs.pdf", "mimeType": "application/pdf", "body": {}},
+            ],
+        },
+    }
+
+
+def test_message_prefers_the_plain_part_and_decodes_encoded_headers():
+    message = GmailMessage(_raw("m1", subject="=?UTF-8?B?" + _b64("Résumé") + "=?="))
+
+    assert message.body == "plain body"
+    assert message.subject == "Résumé"
+    assert message.attachments == ("labs.pdf",)
+    assert message.addresses() == {"site@example.com"}
+
+
+def test_html_only_body_is_stripped_and_missing_body_falls_back_to_snippet():
+    html = GmailMessage(
+        _raw("m1", parts=[{"mimeType": "text/html", "body": {"data": _b64("<b>hi</b>")}}])
+    )
+    empty = GmailMessage(_raw("m2", parts=[]))
+
+    assert html.body == "hi"
+    assert empty.body == "snippet"
+
+
+def test_concurrent_first_reads_all_see_the_decoded_values():
+    messages = [GmailMessage(_raw(f"m{i}", subject=f"Subject {i}")) for i in range(200)]
+
+    def read(message):
+        return message.subject, message.body, message.sender
+
+    with ThreadPoolExecutor(16) as pool:
+        for message in messages:
+            results = list(pool.map(read, [message] * 16))
+            assert set(results) == {
+                (f"Subject {message.id[1:]}", "plain body", "Coordinator <site@example.com>")
+            }
+
+
+def test_threads_are_deduplicated_and_ordered_by_date():
+    messages = [
+        GmailMessage(_raw("b", internal_date="2")),
+        GmailMessage(_raw("a", internal_date="1")),
+        GmailMessage(_raw("b", internal_date="2")),
+    ]
+
+    thread = build_threads(messages)["t1"]
+
+    assert [message.id for message in thread.messages] == ["a", "b"]
@@ -0,0 +1,76 @@
+import json
+import shutil
+from types import SimpleNamespace
+
+import pytest
+
+from app.gmail_inbox import INBOX_DIR
+from app import programs
+from app.inbox_analysis import (
+    WORKFLOW_SETTINGS_PATH,
+    AnalysisStore,
+    InboxPipeline,
+    _load_workflows,
+)
+
+
+@pytest.fixture
+def pipeline(tmp_path, stub_lm):
+    inbox = tmp_path / "inbox"
+    inbox.mkdir()
+    for name in ("email_001.json", "email_002.json"):
+        shutil.copy(f"{INBOX_DIR}/{name}", inbox / name)
+    settings = tmp_path / "workflow_settings.json"
+    shutil.copy(WORKFLOW_SETTINGS_PATH, settings)
+    return InboxPipeline(
+        str(inbox),
+        AnalysisStore(str(tmp_path / "analysis.db")),
+        workflow_settings_path=str(settings),
+    )
+
+
+def test_matched_workflow_lists_its_actions_as_pending_steps(pipeline):
+    pipeline.run_once()
+
+    workflow = pipeline.store.get("email_001.json")["workflow"]
+    settings = next(w for w in _load_workflows() if w["id"] == workflow["workflowId"])
+    assert [step["name"] for step in workflow["steps"]] == [
+        action["action"] for action in settings["actions"]
+    ]
+    assert {step["result"] for step in workflow["steps"]} <= {"Awaiting approval", "Pending"}
+
+
+def test_only_changed_emails_are_analyzed_again(pipeline):
+    assert pipeline.run_once()["lm_calls"] == 2
+
+    assert pipeline.run_once()["lm_calls"] == 0
+    with open(f"{pipeline.inbox_dir}/email_002.json", "a", encoding="utf-8") as f:
+        f.write("\n")
+    assert pipeline.run_once()["lm_calls"] == 1
+
+
+def test_editing_the_workflow_settings_analyzes_every_email_again(pipeline):
+    pipeline.run_once()
+    with open(pipeline.workflow_settings_path, encoding="utf-8") as f:
+        workflows = json.load(f)
+    workflows[0]["description"] += " (edited)"
+    with open(pipeline.workflow_settings_path, "w", encoding="utf-8") as f:
+        json.dump(workflows, f)
+
+    assert pipeline.run_once()["lm_calls"] == 2
+
+
+def test_missing_output_fields_do_not_fail_the_analysis(pipeline, monkeypatch):
+    class Program:
+        async def acall(self, **inputs):
+            return SimpleNamespace(
+                summary=None, category=None, workflow_id=None, quick_actions="[]"
+            )
+
+    monkeypatch.setattr(programs, "get_program", lambda name: Program())
+
+    stats = pipeline.run_once()
+
+    assert stats["failed"] == 0
+    analysis = pipeline.store.get("email_001.json")
+    assert analysis["category"] == "Other" and "workflow" not in analysis
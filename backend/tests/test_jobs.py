@@ -0,0 +1,182 @@
+import os
+import socket
+import time
+
+import pytest
+
+from app import jobs
+from app.gmail_inbox import thread_index
+from app.jobs import JobQueue, RetryableJobError, job_queue
+
+
+@pytest.fixture
+def queue(tmp_path):
+    return JobQueue(str(tmp_path / "jobs.db"), workers=0, max_attempts=2)
+
+
+def _wait_for(queue, job_id, statuses, timeout=5):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = queue.get(job_id)
+        if job["status"] in statuses:
+            return job
+        time.sleep(0.01)
+    raise AssertionError(f"job stayed {job['status']}")
+
+
+def test_claimed_job_runs_once_and_stores_its_result(queue):
+    queue.register("echo", lambda payload: {"echo": payload["text"]})
+    job = queue.submit("echo", {"text": "hi"})
+
+    queue._run(queue._claim())
+
+    assert queue._claim() is None
+    assert queue.get(job["id"])["result"] == {"echo": "hi"}
+
+
+def test_rate_limited_job_is_retried_then_fails(queue, monkeypatch):
+    monkeypatch.setattr(jobs, "BACKOFF_BASE_SECONDS", 0)
+
+    def limited(payload):
+        raise RetryableJobError("429")
+
+    queue.register("limited", limited)
+    job = queue.submit("limited", {})
+
+    queue._run(queue._claim())
+    assert queue.get(job["id"])["status"] == "queued"
+    queue._run(queue._claim())
+
+    failed = queue.get(job["id"])
+    assert (failed["status"], failed["attempts"]) == ("failed", 2)
+
+
+def test_job_is_requeued_when_recording_its_outcome_fails(tmp_path):
+    queue = JobQueue(str(tmp_path / "jobs.db"), workers=1)
+    queue.register("echo", lambda payload: "done")
+    finish = queue._finish
+    failures = []
+
+    def flaky_finish(*args, **kwargs):
+        if not failures:
+            failures.append(1)
+            raise jobs.sqlite3.OperationalError("database is locked")
+        return finish(*args, **kwargs)
+
+    queue._finish = flaky_finish
+    job = queue.submit("echo", {})
+    queue.start()
+
+    done = _wait_for(queue, job["id"], ("succeeded", "failed"))
+
+    assert (done["status"], done["attempts"]) == ("succeeded", 2)
+
+
+def test_recover_requeues_jobs_of_dead_processes_and_stale_claims(queue, monkeypatch):
+    queue.register("echo", lambda payload: "done")
+    dead = queue.submit("echo", {})["id"]
+    stale = queue.submit("echo", {})["id"]
+    live = queue.submit("echo", {})["id"]
+    for _ in range(3):
+        queue._claim()
+    with queue._connect() as connection:
+        connection.execute(
+            "UPDATE jobs SET locked_by = ? WHERE id = ?", (f"{socket.gethostname()}:0", dead)
+        )
+        connection.execute(
+            "UPDATE jobs SET locked_by = 'other-host:1', claimed_at = 0 WHERE id = ?", (stale,)
+        )
+    monkeypatch.setattr(jobs, "_process_exists", lambda locked_by: not locked_by.endswith(":0"))
+
+    queue._recover()
+
+    assert [queue.get(job_id)["status"] for job_id in (dead, stale, live)] == [
+        "queued",
+        "queued",
+        "running",
+    ]
+
+
+@pytest.mark.parametrize(
+    "url",
+    [
+        "ftp://93.184.216.34/hook",
+        "http://127.0.0.1:5001/hook",
+        "http://10.0.0.5/hook",
+        "http://169.254.169.254/latest/meta-data",
+        "http://[::1]/hook",
+        "http://localhost/hook",
+    ],
+)
+def test_callback_urls_to_internal_addresses_are_rejected(queue, url):
+    queue.register("echo", lambda payload: "done")
+
+    with pytest.raises(ValueError, match="callback_url"):
+        queue.submit("echo", {}, callback_url=url)
+
+
+def test_public_callback_url_is_accepted(queue):
+    queue.register("echo", lambda payload: "done")
+
+    job = queue.submit("echo", {}, callback_url="https://93.184.216.34/hook")
+
+    assert job["callback_url"] == "https://93.184.216.34/hook"
+
+
+def test_submit_route_rejects_internal_callback_url(client):
+    response = client.post(
+        "/api/jobs",
+        json={
+            "kind": "categorize_email",
+            "payload": {"email_thread": {}, "existing_tasks": []},
+            "callback_url": "http://127.0.0.1/hook",
+        },
+    )
+
+    assert response.status_code == 400
+
+
+def test_job_payload_thread_id_is_resolved_like_the_route(client):
+    thread_id = thread_index.thread_ids()[0]
+
+    job = job_queue.submit("categorize_email", {"thread_id": thread_id, "existing_tasks": []})
+    payload = job_queue.get(job["id"], include_payload=True)["payload"]
+
+    assert payload["email_thread"] == thread_index.get(thread_id).to_dict()
+    with pytest.raises(ValueError, match="Unknown thread id"):
+        job_queue.submit("categorize_email", {"thread_id": "nope", "existing_tasks": []})
+
+
+def test_worker_that_lost_its_claim_cannot_overwrite_the_new_attempt(queue):
+    queue.register("echo", lambda payload: "done")
+    job = queue.submit("echo", {})
+    first = queue._claim()
+    # The first claim went stale and the job was picked up again
+    queue._requeue([jobs._claim_of(first)])
+    second = queue._claim()
+
+    queue._finish(first, "failed", error="late")
+    assert queue.get(job["id"])["status"] == "running"
+
+    queue._run(second)
+    assert queue.get(job["id"])["result"] == "done"
+
+
+def test_finished_jobs_are_purged_after_the_retention_period(queue, monkeypatch):
+    queue.register("echo", lambda payload: "done")
+    old = queue.submit("echo", {})["id"]
+    queued = queue.submit("echo", {})["id"]
+    queue._run(queue._claim())
+    with queue._connect() as connection:
+        connection.execute("UPDATE jobs SET finished_at = 0 WHERE id = ?", (old,))
+
+    queue._recover()
+
+    assert queue.get(old) is None
+    assert queue.get(queued)["status"] == "queued"
+
+
+def test_database_is_owner_only(queue):
+    queue.stats()
+
+    assert os.stat(queue.db_path).st_mode & 0o777 == 0o600
@@ -0,0 +1,79 @@
+import os
+import stat
+import time
+
+from app.lm_cache import LMCache
+
+
+def _mode(path):
+    return stat.S_IMODE(os.stat(path).st_mode)
+
+
+def test_memory_only_without_a_cache_dir():
+    cache = LMCache()
+
+    cache.set("k", {"answer": 1})
+
+    assert cache.get("k") == {"answer": 1}
+    assert cache.stats()["disk_enabled"] is False
+
+
+def test_disk_tier_is_owner_only_and_survives_a_restart(tmp_path):
+    cache_dir = tmp_path / "cache"
+    LMCache(cache_dir=str(cache_dir)).set("k", {"answer": 1})
+
+    restarted = LMCache(cache_dir=str(cache_dir))
+
+    assert restarted.get("k") == {"answer": 1}
+    assert restarted.stats()["disk_hits"] == 1
+    assert _mode(cache_dir) == 0o700
+    assert _mode(cache_dir / "k.json") == 0o600
+
+
+def test_existing_directory_is_made_owner_only(tmp_path):
+    os.chmod(tmp_path, 0o755)
+
+    LMCache(cache_dir=str(tmp_path))
+
+    assert _mode(tmp_path) == 0o700
+
+
+def test_expired_entries_are_deleted_from_disk(tmp_path):
+    cache = LMCache(ttl_seconds=60, cache_dir=str(tmp_path))
+    cache.set("old", {"answer": 1})
+    path = tmp_path / "old.json"
+    stale = time.time() - 120
+    os.utime(path, (stale, stale))
+
+    # Pruned at startup
+    LMCache(ttl_seconds=60, cache_dir=str(tmp_path))
+
+    assert not path.exists()
+
+
+def test_expired_entry_is_a_miss(tmp_path):
+    cache = LMCache(ttl_seconds=0.05, cache_dir=str(tmp_path))
+    cache.set("k", {"answer": 1})
+    time.sleep(0.1)
+
+    assert cache.get("k") is None
+    assert not (tmp_path / "k.json").exists()
+
+
+def test_least_recently_used_entries_are_evicted():
+    cache = LMCache(max_entries=2)
+    cache.set("a", {"v": 1})
+    cache.set("b", {"v": 2})
+    cache.get("a")
+    cache.set("c", {"v": 3})
+
+    assert cache.get("b") is None
+    assert cache.get("a") == {"v": 1}
+    assert cache.stats()["evictions"] == 1
+
+
+def test_key_ignores_cosmetic_input_differences():
+    key = LMCache.make_key("Sig", "model", 0.0, {"thread": "hello\r\n", "todos": '[1, 2]'})
+
+    assert key == LMCache.make_key("Sig", "model", 0.0, {"thread": "hello", "todos": "[1,2]"})
+    assert key != LMCache.make_key("Sig", "model", 0.5, {"thread": "hello", "todos": "[1,2]"})
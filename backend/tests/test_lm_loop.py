@@ -0,0 +1,78 @@
+import asyncio
+import threading
+from concurrent.futures import TimeoutError as FutureTimeout, wait
+
+import pytest
+
+from app.lm_loop import LMEventLoop, RouteBusy, _parse_limits
+
+
+def test_route_limit_bounds_calls_in_flight():
+    loop = LMEventLoop(default_limit=2)
+    in_flight = peak = 0
+    lock = threading.Lock()
+
+    async def call():
+        nonlocal in_flight, peak
+        with lock:
+            in_flight += 1
+            peak = max(peak, in_flight)
+        await asyncio.sleep(0.02)
+        with lock:
+            in_flight -= 1
+        return "ok"
+
+    futures = [loop.submit("route", call) for _ in range(8)]
+    wait(futures, timeout=5)
+
+    assert [f.result() for f in futures] == ["ok"] * 8
+    assert peak == 2
+
+
+def test_admission_rejects_beyond_limit_plus_queue_depth():
+    loop = LMEventLoop(default_limit=1, queue_depth=1)
+    loop.admit("route")
+    loop.admit("route")
+
+    with pytest.raises(RouteBusy):
+        loop.admit("route")
+    # Other routes are unaffected
+    loop.admit("other")
+
+    loop.release("route")
+    loop.admit("route")
+
+
+def test_run_times_out_and_cancels():
+    loop = LMEventLoop()
+    cancelled = threading.Event()
+
+    async def slow():
+        try:
+            await asyncio.sleep(5)
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+
+    with pytest.raises((TimeoutError, FutureTimeout)):
+        loop.run("route", slow, timeout=0.05)
+    assert cancelled.wait(1)
+
+
+def test_stream_yields_items_and_reraises_errors():
+    loop = LMEventLoop()
+
+    async def items():
+        yield 1
+        yield 2
+        raise ValueError("boom")
+
+    received = []
+    with pytest.raises(ValueError):
+        for item in loop.stream("route", items):
+            received.append(item)
+    assert received == [1, 2]
+
+
+def test_parse_limits():
+    assert _parse_limits("a=2, b=4,") == {"a": 2, "b": 4}
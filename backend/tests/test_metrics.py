@@ -0,0 +1,34 @@
+from app.metrics import Registry
+from benchmarks import corpus
+
+
+def test_registry_renders_prometheus_text():
+    registry = Registry()
+    calls = registry.counter("test_calls_total", "Calls.", ("route",))
+    latency = registry.histogram("test_seconds", "Latency.", ("route",), buckets=(0.1, 1.0))
+
+    calls.inc(route='say "hi"')
+    latency.observe(0.5, route="a")
+
+    text = registry.render()
+    assert "# TYPE test_calls_total counter" in text
+    assert 'test_calls_total{route="say \\"hi\\""} 1' in text
+    assert 'test_seconds_bucket{route="a",le="0.1"} 0' in text
+    assert 'test_seconds_bucket{route="a",le="1"} 1' in text
+    assert 'test_seconds_bucket{route="a",le="+Inf"} 1' in text
+    assert 'test_seconds_count{route="a"} 1' in text
+
+
+def test_requests_and_lm_calls_show_up_on_metrics(client, stub_lm):
+    thread = corpus.build_threads(1)[0]
+    response = client.post(
+        "/api/dspy/categorize-email", json={"email_thread": thread, "existing_tasks": []}
+    )
+    # Request counters are recorded once the server closes the response
+    response.close()
+
+    text = client.get("/metrics").get_data(as_text=True)
+
+    route = 'route="/api/dspy/categorize-email",method="POST",status="200"'
+    assert f"clinbox_http_requests_total{{{route}}} 1" in text
+    assert 'clinbox_lm_calls_total{signature="CategorizeEmailThread"' in text
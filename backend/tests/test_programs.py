@@ -0,0 +1,22 @@
+from app import programs
+from benchmarks.stub_lm import StubLM
+
+
+def test_programs_are_built_once_and_shared(stub_lm):
+    assert programs.get_program("generate_todos") is programs.get_program("generate_todos")
+    assert programs.readiness()["ready"] is True
+    assert set(programs.readiness()["programs"]) == set(programs.SIGNATURES)
+
+
+def test_set_lm_rebinds_one_program(stub_lm):
+    other = StubLM(model="stub/other")
+
+    programs.set_lm(other, "draft_email_reply")
+
+    assert programs.get_lm("draft_email_reply") is other
+    assert programs.get_lm("generate_todos") is stub_lm
+    assert programs.models()["routes"]["draft_email_reply"] == "stub/other"
+
+
+def test_parse_models():
+    assert programs._parse_models(" a=m1, b = m2 ,") == {"a": "m1", "b": "m2"}
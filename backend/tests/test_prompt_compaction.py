@@ -0,0 +1,62 @@
+from app import prompt_compaction as compaction
+
+
+def _message(content, sender="site@example.com"):
+    return {"from": sender, "to": "cra@example.com", "timestamp": "", "content": content}
+
+
+def test_quoted_replies_and_signatures_are_stripped():
+    text = "Please confirm.\n\nBest regards,\nDana\nSite Coordinator\n\nOn Mon, Dana wrote:\n> old"
+
+    assert compaction.clean_message_text(text) == "Please confirm."
+
+
+def test_repeated_messages_are_sent_once_across_threads():
+    shared = _message("The visit moved to Friday.")
+    threads = [
+        {"id": 1, "messages": [shared, _message("Thread one only.")]},
+        {"id": 2, "messages": [dict(shared, timestamp="later")]},
+    ]
+
+    compacted = compaction.compact_threads(threads, budget=10000)
+
+    assert [len(thread["messages"]) for thread in compacted] == [2, 0]
+
+
+def test_long_threads_keep_the_first_and_latest_messages():
+    messages = [_message(f"Message {i}: " + "detail " * 40) for i in range(30)]
+
+    fitted = compaction.fit_messages(messages, budget=400)
+
+    assert compaction.estimate_tokens(fitted) <= 400
+    assert fitted[0]["content"] == messages[0]["content"]
+    assert fitted[-1]["content"] == messages[-1]["content"]
+    assert "earlier messages omitted" in fitted[1]["content"]
+
+
+def test_message_digest_ignores_whitespace_case_and_timestamps():
+    a = _message("Please  confirm\nthe date")
+    b = dict(_message("please confirm the date"), timestamp="2 hours ago")
+
+    assert compaction.message_digest(a) == compaction.message_digest(b)
+    assert compaction.message_digest(a) != compaction.message_digest(_message("Other"))
+
+
+def test_documents_are_cut_to_the_relevant_chunks():
+    raw = "Unrelated boilerplate. " * 200 + "The randomization schedule changed for cohort B. " * 5
+    documents = [{"id": "d1", "title": "Protocol", "raw_text": raw}]
+
+    compacted = compaction.compact_documents(documents, "randomization cohort", budget=300)
+
+    assert compaction.estimate_tokens(compacted) <= 300
+    assert "randomization" in compacted[0]["raw_text"]
+
+
+def test_non_dict_documents_pass_through_when_over_budget():
+    raw = "Unrelated boilerplate. " * 200 + "The randomization schedule changed. " * 5
+    documents = [{"id": "d1", "raw_text": raw}, "a bare string", 42]
+
+    compacted = compaction.compact_documents(documents, "randomization", budget=600)
+
+    assert compacted[1:] == ["a bare string", 42]
+    assert "randomization" in compacted[0]["raw_text"]
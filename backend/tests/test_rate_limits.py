@@ -0,0 +1,104 @@
+import asyncio
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from app import rate_limits
+from app.rate_limits import AdaptiveConcurrency, ModelLimiter, RateLimited, TokenBucket
+
+
+class ProviderError(Exception):
+    def __init__(self, status_code=429, retry_after=None):
+        super().__init__(f"HTTP {status_code}")
+        self.status_code = status_code
+        headers = {} if retry_after is None else {"retry-after": str(retry_after)}
+        self.response = SimpleNamespace(status_code=status_code, headers=headers)
+
+
+def _response(completion_tokens=10):
+    return SimpleNamespace(usage={"completion_tokens": completion_tokens, "total_tokens": 50})
+
+
+def test_token_bucket_waits_once_the_burst_is_spent():
+    bucket = TokenBucket(per_minute=60)
+
+    assert bucket.reserve(10) == 0.0
+    assert bucket.reserve(1) == pytest.approx(1.0, abs=0.05)
+    bucket.refund(5)
+    assert bucket.available == pytest.approx(4.0, abs=0.05)
+
+
+def test_concurrency_grows_additively_and_respects_its_bounds():
+    concurrency = AdaptiveConcurrency(maximum=4, minimum=1)
+    concurrency.limit = 2.0
+
+    concurrency.increase()
+    concurrency.increase()
+    assert concurrency.limit == pytest.approx(2.9, abs=0.01)
+
+    for _ in range(10):
+        concurrency.decrease(0.5)
+    assert concurrency.limit == 1
+
+
+def test_rate_limited_calls_are_retried_until_they_succeed(monkeypatch):
+    monkeypatch.setattr(rate_limits, "RETRY_BASE_SECONDS", 0.001)
+    limiter = ModelLimiter("stub")
+    attempts = []
+
+    async def call():
+        attempts.append(1)
+        if len(attempts) < 3:
+            raise ProviderError(429)
+        return _response()
+
+    response = asyncio.run(limiter.call(call, prompt_tokens=10))
+
+    assert response.usage["completion_tokens"] == 10
+    assert (len(attempts), limiter.stats["rate_limited"]) == (3, 2)
+    assert limiter.concurrency.in_flight == 0
+
+
+def test_retry_that_would_miss_the_deadline_raises_rate_limited():
+    limiter = ModelLimiter("stub")
+
+    async def call():
+        raise ProviderError(429, retry_after=30)
+
+    async def run():
+        rate_limits.deadline.set(time.monotonic() + 1)
+        await limiter.call(call, prompt_tokens=10)
+
+    with pytest.raises(RateLimited) as raised:
+        asyncio.run(run())
+    assert raised.value.retry_after == 30
+
+
+def test_other_errors_are_not_retried():
+    limiter = ModelLimiter("stub")
+
+    async def call():
+        raise ProviderError(400)
+
+    with pytest.raises(ProviderError):
+        asyncio.run(limiter.call(call, prompt_tokens=10))
+    assert limiter.stats["rate_limited"] == 0
+
+
+def test_latency_spikes_are_judged_against_the_calls_own_route():
+    limiter = ModelLimiter("stub", max_concurrency=8)
+    for _ in range(20):
+        limiter._on_success(0.2, {}, 0, "categorize_email")
+        limiter._on_success(3.0, {}, 0, "generate_todos")
+
+    # Slow for the model overall, but normal for generate_todos
+    limiter._on_success(3.0, {}, 0, "generate_todos")
+    assert limiter.stats["decreased_latency"] == 0
+
+    limiter._on_success(3.0, {}, 0, "categorize_email")
+    assert limiter.stats["decreased_latency"] == 1
+    assert set(limiter.snapshot()["average_latency_ms_by_route"]) == {
+        "categorize_email",
+        "generate_todos",
+    }
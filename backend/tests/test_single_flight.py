@@ -0,0 +1,61 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from app.single_flight import SingleFlight
+
+
+def _run_concurrently(flight, fn, release, callers=8):
+    """Call flight.do from `callers` threads, releasing fn once all of them joined."""
+    pool = ThreadPoolExecutor(callers)
+    futures = [pool.submit(flight.do, "key", fn, "test") for _ in range(callers)]
+    while sum(flight.stats()["by_signature"].get("test", {}).values()) < callers:
+        time.sleep(0.001)
+    release.set()
+    pool.shutdown()
+    return futures
+
+
+def test_concurrent_identical_calls_share_one_run():
+    flight = SingleFlight()
+    release = threading.Event()
+    runs = []
+
+    def call():
+        runs.append(1)
+        release.wait(5)
+        return "result"
+
+    futures = _run_concurrently(flight, call, release)
+    outcomes = [future.result(5) for future in futures]
+
+    assert len(runs) == 1
+    assert sorted(shared for _, shared in outcomes) == [False] + [True] * (len(futures) - 1)
+    assert {result for result, _ in outcomes} == {"result"}
+    assert flight.stats()["in_flight"] == 0
+
+
+def test_waiting_callers_get_the_leaders_exception():
+    flight = SingleFlight()
+    release = threading.Event()
+
+    def call():
+        release.wait(5)
+        raise ValueError("provider error")
+
+    futures = _run_concurrently(flight, call, release, callers=4)
+
+    for future in futures:
+        with pytest.raises(ValueError, match="provider error"):
+            future.result(5)
+    assert flight.stats()["in_flight"] == 0
+
+
+def test_calls_after_the_first_finishes_run_again():
+    flight = SingleFlight()
+
+    assert flight.do("key", lambda: 1, "test") == (1, False)
+    assert flight.do("key", lambda: 2, "test") == (2, False)
+    assert flight.stats()["by_signature"] == {"test": {"calls": 2, "coalesced": 0}}
@@ -0,0 +1,78 @@
+import json
+import sqlite3
+import threading
+from contextlib import closing
+
+import pytest
+
+from app.sqlite_store import SqliteDocumentStore
+
+DOCUMENT = {
+    "problems": [{"id": 1, "status": "Open", "urgency": "High"}, {"id": 2, "status": "Closed"}],
+    "threads": [{"id": "t1", "status": "Open", "messages": [{"content": "a"}, {"content": "b"}]}],
+}
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = SqliteDocumentStore(str(tmp_path / "coms.db"))
+    store.save(DOCUMENT)
+    return store
+
+
+def test_document_round_trips_with_order_and_messages(store):
+    reopened = SqliteDocumentStore(store.db_path)
+
+    assert reopened.load() == DOCUMENT
+
+
+def test_patches_bump_the_version_seen_by_another_instance(store):
+    other = SqliteDocumentStore(store.db_path)
+    _, before = other.load_versioned()
+
+    store.patch({"problems": [{"id": 3, "status": "Open"}], "deleted": {"problems": [2]}})
+
+    document, after = other.load_versioned()
+    assert after != before
+    assert [p["id"] for p in document["problems"]] == [1, 3]
+    assert store.load() == document
+
+
+def test_query_and_get_record_use_the_indexed_columns(store):
+    records, _ = store.query("problems", status="Open", urgency="High")
+
+    assert [record["id"] for record in records] == [1]
+    assert store.get_record("threads", "t1")[0]["messages"][1] == {"content": "b"}
+    assert store.get_record("problems", "missing")[0] is None
+
+
+def test_concurrent_patches_from_several_instances_are_all_kept(store):
+    def add(worker):
+        instance = SqliteDocumentStore(store.db_path)
+        for i in range(10):
+            instance.patch({"threads": [{"id": f"w{worker}-{i}"}]})
+
+    threads = [threading.Thread(target=add, args=(worker,)) for worker in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(SqliteDocumentStore(store.db_path).load()["threads"]) == 1 + 4 * 10
+
+
+def test_backup_is_a_consistent_copy(store, tmp_path):
+    path = store.backup(str(tmp_path / "backup.db"))
+
+    with closing(sqlite3.connect(path)) as connection:
+        assert connection.execute("SELECT COUNT(*) FROM problems").fetchone()[0] == 2
+    assert SqliteDocumentStore(path).load() == DOCUMENT
+
+
+def test_empty_database_is_seeded_from_coms_json(tmp_path):
+    seed = tmp_path / "coms.json"
+    seed.write_text(json.dumps(DOCUMENT), encoding="utf-8")
+
+    store = SqliteDocumentStore(str(tmp_path / "seeded.db"), seed_path=str(seed))
+
+    assert store.load() == DOCUMENT
@@ -0,0 +1,82 @@
+import json
+
+import pytest
+
+from app import programs, structured_output
+from app.rate_limits import RateLimited
+from app.structured_output import (
+    TODO_SCHEMA,
+    StructuredOutputError,
+    extract_json,
+    parse_json_field,
+    validate_items,
+)
+from benchmarks.stub_lm import StubLM
+
+
+@pytest.mark.parametrize(
+    "output",
+    [
+        '```json\n[{"description": "a"},]\n```',
+        'Here you go: [{"description": "a"}] Hope that helps!',
+        '[{"description": "a"}, {"description": "b',
+    ],
+)
+def test_fenced_commented_and_truncated_json_is_fixed_locally(output):
+    data, repaired = extract_json(output)
+
+    assert repaired
+    assert data[0] == {"description": "a"}
+
+
+def test_items_are_coerced_to_the_schema_and_invalid_ones_dropped():
+    items, dropped = validate_items(
+        {"todos": [{"description": " Call site ", "priority": "high"}, {"priority": "Low"}, 3]},
+        TODO_SCHEMA,
+    )
+
+    assert items == [{"description": "Call site", "priority": "High", "tag": "", "reasoning": ""}]
+    assert dropped == 2
+
+
+def test_clean_output_needs_no_repair(stub_lm):
+    items, repair = parse_json_field(
+        json.dumps([{"description": "a"}]), TODO_SCHEMA, "GenerateTodos", "todos"
+    )
+
+    assert repair is None and items[0]["description"] == "a"
+    assert stub_lm.calls == 0
+
+
+def test_unusable_output_gets_one_repair_call(stub_lm):
+    repairer = StubLM(values={"fixed_output": json.dumps([{"description": "fixed"}])})
+    programs.set_lm(repairer, name="repair_output")
+
+    items, repair = parse_json_field("No todos.", TODO_SCHEMA, "GenerateTodos", "todos")
+
+    assert (repair, items[0]["description"]) == ("lm", "fixed")
+    assert repairer.calls == 1
+
+
+def test_failed_repair_raises_structured_output_error(stub_lm):
+    programs.set_lm(StubLM(values={"fixed_output": "still not json"}), name="repair_output")
+
+    with pytest.raises(StructuredOutputError, match="repair failed"):
+        parse_json_field("nothing here", TODO_SCHEMA, "GenerateTodos", "todos")
+
+
+def test_throttled_references_repair_still_returns_the_draft(client, stub_lm, monkeypatch):
+    programs.set_lm(StubLM(values={"references": "No references."}), name="draft_email_reply")
+
+    def throttled(*args):
+        raise RateLimited("stub/repair", retry_after=30)
+
+    monkeypatch.setattr(structured_output, "_repair_call", throttled)
+
+    response = client.post(
+        "/api/dspy/draft-email-reply",
+        json={"email_thread": "From: site@example.com\nBody: Hi", "todo_description": "Reply"},
+    )
+
+    assert response.status_code == 200
+    assert response.get_json()["draft"]["references"] == []
@@ -0,0 +1,42 @@
+from app.task_matching import patient_ids, score_tasks, select_candidates
+
+
+def test_patient_ids_need_a_patient_or_subject_word():
+    text = "Patient 203-012 and subjects 307-024, 105-003 are due; see protocol 203-999."
+
+    assert patient_ids(text) == {"203-012", "307-024", "105-003"}
+
+
+def test_phone_numbers_and_codes_are_not_patient_ids():
+    text = (
+        "Call the pharmacy at (650) 555-2345 or 555-1234 about form 202-2024. "
+        "Patient line: 650-555-2345."
+    )
+
+    assert patient_ids(text) == set()
+
+
+def test_shared_patient_id_ranks_the_task_first():
+    thread = {
+        "subject": "Lab results",
+        "messages": [{"from": "site@example.com", "content": "Results for patient 203-012."}],
+    }
+    tasks = [
+        {"id": "t1", "subject": "Labs for patient 203-012", "summary": "Awaiting lab results"},
+        {"id": "t2", "subject": "Call back 555-1234", "summary": "Pharmacy lab results"},
+    ]
+
+    candidates, _ = select_candidates(thread, tasks)
+    _, _, signals = score_tasks(thread, tasks)[0]
+
+    assert candidates[0]["id"] == "t1"
+    assert signals["shared_ids"] == ["203-012"]
+
+
+def test_phone_fragment_does_not_count_as_a_shared_id():
+    thread = {"subject": "Pharmacy", "messages": [{"content": "Please call 555-1234."}]}
+    tasks = [{"id": "t2", "subject": "Call back 555-1234", "summary": ""}]
+
+    [(_, _, signals)] = score_tasks(thread, tasks)
+
+    assert signals["patient_id"] == 0.0
@@ -0,0 +1,98 @@
+import pytest
+
+from app.todo_digests import TodoDigestStore
+
+
+@pytest.fixture
+def digests(tmp_path):
+    return TodoDigestStore(str(tmp_path / "digests.db"))
+
+
+def _payload(threads, todos=()):
+    return {
+        "task": {"id": "task-1", "subject": "Lab kits", "status": "Open"},
+        "email_threads": threads,
+        "existing_todos": list(todos),
+    }
+
+
+def _message(content):
+    return {"from": "site@example.com", "content": content}
+
+
+def _run(digests, data):
+    plan = digests.plan(data)
+    digests.record(plan, data, "gaps_identified", "summary")
+    return plan
+
+
+def test_unchanged_input_needs_no_new_analysis(digests):
+    data = _payload([{"id": 1, "messages": [_message("Kits shipped")]}])
+
+    assert _run(digests, data).mode == "full"
+    assert digests.plan(data).mode == "unchanged"
+
+
+def test_new_messages_are_planned_as_a_delta(digests):
+    _run(digests, _payload([{"id": 1, "messages": [_message("Kits shipped")]}]))
+
+    plan = digests.plan(
+        _payload([{"id": 1, "messages": [_message("Kits shipped"), _message("Kits arrived")]}])
+    )
+
+    assert plan.mode == "delta"
+    assert plan.delta_threads[0]["messages"] == [_message("Kits arrived")]
+    assert plan.delta_threads[0]["earlier_messages"] == 1
+
+
+def test_threads_sharing_an_id_stay_aligned_with_their_messages(digests):
+    first = {"id": 7, "messages": [_message("Kits shipped")]}
+    second = {"id": 7, "messages": [_message("Courier booked")]}
+    _run(digests, _payload([first, second]))
+
+    grown = dict(second, messages=second["messages"] + [_message("Courier late")])
+    plan = digests.plan(_payload([first, grown]))
+
+    assert plan.mode == "delta"
+    assert [t["messages"] for t in plan.delta_threads] == [[_message("Courier late")]]
+    assert plan.delta_threads[0]["earlier_messages"] == 1
+    assert [thread["analyzed_messages"] for thread in plan.prior_coverage()["threads"]] == [1, 1]
+
+
+def test_edited_todos_force_a_full_run(digests):
+    todo = {"description": "Confirm delivery", "tag": "Thread 1"}
+    data = _payload([{"id": 1, "messages": [_message("Kits shipped")]}], [todo])
+    _run(digests, data)
+
+    edited = dict(data, existing_todos=[dict(todo, description="Confirm pickup")])
+
+    assert digests.plan(edited).mode == "full"
+
+
+def test_route_skips_the_lm_when_nothing_changed(client, stub_lm):
+    data = _payload([{"id": "route", "messages": [_message("Please send kits")]}])
+    data["task"]["id"] = "route-task"
+
+    first = client.post("/api/dspy/generate-todos", json=data)
+    calls = stub_lm.calls
+    second = client.post("/api/dspy/generate-todos", json=data)
+
+    assert first.status_code == second.status_code == 200
+    assert second.get_json()["metadata"]["incremental"]["mode"] == "unchanged"
+    assert stub_lm.calls == calls
+
+
+@pytest.mark.parametrize(
+    "threads",
+    [
+        ["not a thread"],
+        [{"id": 1, "messages": "not a list"}],
+        [{"id": 1, "messages": ["not a message"]}],
+        [{"id": 1, "messages": [{"content": 42}]}],
+    ],
+)
+def test_route_rejects_malformed_threads(client, threads):
+    response = client.post("/api/dspy/generate-todos", json=_payload(threads))
+
+    assert response.status_code == 400
+    assert response.get_json()["success"] is False
@@ -0,0 +1,81 @@
+import json
+
+import pytest
+
+from app.workflow_events import WorkflowEventIndex, parse_time
+
+
+def _event(index, workflow="workflow_001", status="completed", trigger=None):
+    return {
+        "id": f"e{index:03d}",
+        "workflowId": workflow,
+        "workflowName": workflow.title(),
+        "eventDescription": f"Run {index}",
+        "date": f"2024-11-{index % 28 + 1:02d}T{index % 24:02d}:00:00Z",
+        "status": status,
+        "triggerEmail": trigger,
+    }
+
+
+@pytest.fixture
+def events_path(tmp_path):
+    path = tmp_path / "workflows.json"
+    base = [
+        _event(i, workflow=f"workflow_00{i % 3 + 1}", status=("completed", "failed")[i % 2])
+        for i in range(30)
+    ]
+    path.write_text(json.dumps(base), encoding="utf-8")
+    return str(path)
+
+
+def test_filters_combine_and_results_are_newest_first(events_path):
+    index = WorkflowEventIndex(events_path, rescan_seconds=0)
+
+    events, _ = index.query(workflow_id="workflow_002", status=["failed"], limit=100)
+
+    assert events and all(
+        (e["workflowId"], e["status"]) == ("workflow_002", "failed") for e in events
+    )
+    dates = [parse_time(e["date"]) for e in events]
+    assert dates == sorted(dates, reverse=True)
+
+
+def test_cursor_pages_cover_every_event_once(events_path):
+    index = WorkflowEventIndex(events_path, rescan_seconds=0)
+    seen, cursor = [], None
+
+    while True:
+        page, cursor = index.query(limit=7, cursor=cursor)
+        seen.extend(event["id"] for event in page)
+        if cursor is None:
+            break
+
+    assert sorted(seen) == sorted(f"e{i:03d}" for i in range(30))
+
+
+def test_time_range_is_inclusive_then_exclusive(events_path):
+    index = WorkflowEventIndex(events_path, rescan_seconds=0)
+    since, until = parse_time("2024-11-05"), parse_time("2024-11-10")
+
+    events, _ = index.query(since=since, until=until, limit=100)
+
+    assert events
+    assert all(since <= parse_time(e["date"]) < until for e in events)
+
+
+def test_appended_events_are_seen_by_another_index(events_path):
+    writer = WorkflowEventIndex(events_path, rescan_seconds=0)
+    reader = WorkflowEventIndex(events_path, rescan_seconds=0)
+    reader.query()
+
+    [stored] = writer.append([_event(99, workflow="workflow_009", trigger="site@example.com")])
+
+    events, _ = reader.query(trigger_email="site@example.com")
+    assert [event["id"] for event in events] == [stored["id"]]
+    assert reader.workflows()["workflow_009"]["events"] == 1
+
+
+def test_events_route_rejects_since_with_last(client):
+    response = client.get("/api/workflows/events?since=2024-11-01&last=24h")
+
+    assert response.status_code == 400